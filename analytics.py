@@ -0,0 +1,261 @@
+import math
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+# Rolling windows for per-symbol stats, e.g. "1h,24h,7d" (m/h/d suffixes)
+_WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def _parse_windows(value):
+    windows = {}
+    for part in value.split(','):
+        part = part.strip().lower()
+        if len(part) < 2 or part[-1] not in _WINDOW_UNITS or not part[:-1].isdigit() or int(part[:-1]) <= 0:
+            raise ValueError(f"bad window {part!r}")
+        windows[part] = int(part[:-1]) * _WINDOW_UNITS[part[-1]]
+    return windows
+
+try:
+    STATS_WINDOWS = _parse_windows(os.environ.get("STATS_WINDOWS", "1h,24h,7d"))
+except ValueError:
+    STATS_WINDOWS = _parse_windows("1h,24h,7d")
+
+STATS_FIELDS = ('samples', 'sma', 'high', 'low', 'return_pct', 'volatility_pct')
+
+UPSERT_STATS_SQL = '''
+    INSERT INTO crypto_stats (symbol, span, samples, sma, high, low, return_pct, volatility_pct, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(symbol, span) DO UPDATE SET
+        samples = excluded.samples,
+        sma = excluded.sma,
+        high = excluded.high,
+        low = excluded.low,
+        return_pct = excluded.return_pct,
+        volatility_pct = excluded.volatility_pct,
+        updated_at = excluded.updated_at
+'''
+
+
+def summarize(samples, price_sum, high, low, first, last, n_ret, ret_sum, ret_sq_sum):
+    """
+    Turn window aggregates into the stored stats. Returns are per scrape
+    (price / previous price - 1); volatility is their standard deviation.
+    """
+    if not samples:
+        return None
+    volatility = None
+    if n_ret >= 2:
+        mean = ret_sum / n_ret
+        # Running sums can drift a hair below zero
+        volatility = math.sqrt(max(0.0, ret_sq_sum / n_ret - mean * mean)) * 100
+    return {
+        'samples': samples,
+        'sma': price_sum / samples,
+        'high': high,
+        'low': low,
+        'return_pct': (last / first - 1) * 100 if first else None,
+        'volatility_pct': volatility,
+    }
+
+
+class _Window:
+    """
+    One symbol's points inside a time window, with running sums and monotonic
+    deques so each push and expiry is amortized O(1).
+    """
+
+    __slots__ = ('seconds', 'points', 'highs', 'lows', 'price_sum', 'n_ret', 'ret_sum', 'ret_sq_sum')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.points = deque()   # (timestamp, price, return vs the symbol's previous point)
+        self.highs = deque()    # (timestamp, price), prices decreasing
+        self.lows = deque()     # (timestamp, price), prices increasing
+        self.price_sum = 0.0
+        self.n_ret = 0
+        self.ret_sum = 0.0
+        self.ret_sq_sum = 0.0
+
+    def push(self, ts, price, ret):
+        self.points.append((ts, price, ret))
+        self.price_sum += price
+        if ret is not None:
+            self.n_ret += 1
+            self.ret_sum += ret
+            self.ret_sq_sum += ret * ret
+        while self.highs and self.highs[-1][1] <= price:
+            self.highs.pop()
+        self.highs.append((ts, price))
+        while self.lows and self.lows[-1][1] >= price:
+            self.lows.pop()
+        self.lows.append((ts, price))
+
+    def expire(self, now):
+        """Drop points at or before now - seconds"""
+        cutoff = now - timedelta(seconds=self.seconds)
+        while self.points and self.points[0][0] <= cutoff:
+            _, price, ret = self.points.popleft()
+            self.price_sum -= price
+            if ret is not None:
+                self.n_ret -= 1
+                self.ret_sum -= ret
+                self.ret_sq_sum -= ret * ret
+        while self.highs and self.highs[0][0] <= cutoff:
+            self.highs.popleft()
+        while self.lows and self.lows[0][0] <= cutoff:
+            self.lows.popleft()
+
+    def stats(self):
+        if not self.points:
+            return None
+        # The oldest point's return reaches back outside the window
+        n_ret, ret_sum, ret_sq_sum = self.n_ret, self.ret_sum, self.ret_sq_sum
+        oldest_ret = self.points[0][2]
+        if oldest_ret is not None:
+            n_ret -= 1
+            ret_sum -= oldest_ret
+            ret_sq_sum -= oldest_ret * oldest_ret
+        return summarize(
+            len(self.points), self.price_sum, self.highs[0][1], self.lows[0][1],
+            self.points[0][1], self.points[-1][1], n_ret, ret_sum, ret_sq_sum
+        )
+
+
+class _SymbolState:
+    __slots__ = ('last_price', 'windows')
+
+    def __init__(self):
+        self.last_price = None
+        self.windows = {name: _Window(seconds) for name, seconds in STATS_WINDOWS.items()}
+
+    def push(self, ts, price):
+        ret = price / self.last_price - 1 if self.last_price else None
+        self.last_price = price
+        for window in self.windows.values():
+            window.push(ts, price, ret)
+            window.expire(ts)
+
+
+# Rolling state of the process that writes snapshots: symbol -> _SymbolState.
+# Like database._last_written, only trusted while the DB generation is the
+# one our own last commit produced; otherwise it is rebuilt from history.
+_state = None
+_state_key = None
+
+
+def _load_state(cursor, now):
+    """Rebuild every symbol's windows from the points before `now` in one ordered scan"""
+    since = now - timedelta(seconds=max(STATS_WINDOWS.values()))
+    cursor.execute('''
+        SELECT symbol, price, timestamp FROM price_points
+        WHERE timestamp > ? AND timestamp < ?
+        ORDER BY symbol, timestamp, id
+    ''', (since, now))
+    state = {}
+    for symbol, price, ts in cursor.fetchall():
+        entry = state.get(symbol)
+        if entry is None:
+            entry = state[symbol] = _SymbolState()
+        entry.push(datetime.fromisoformat(ts) if isinstance(ts, str) else ts, price)
+    return state
+
+
+def warm(cursor, now, key):
+    """
+    Rebuild the windows for the database state `key` unless they already
+    match it. The writer calls this before taking the write lock, so the
+    history scan runs as a plain WAL read; update_stats() only reloads inside
+    the transaction if another commit landed in between.
+    """
+    global _state, _state_key
+    if _state is None or _state_key != key:
+        _state = _load_state(cursor, now)
+        _state_key = key
+
+
+def update_stats(cursor, records, now, key):
+    """
+    Advance each record's rolling windows by one point at `now` and upsert
+    the results, inside the caller's snapshot transaction. `key` identifies
+    the database state the in-memory windows must match.
+    """
+    global _state, _state_key
+    if _state is None or _state_key != key:
+        _state = _load_state(cursor, now)
+    _state_key = None
+    rows = []
+    for r in records:
+        entry = _state.get(r['symbol'])
+        if entry is None:
+            entry = _state[r['symbol']] = _SymbolState()
+        entry.push(now, r['price'])
+        for name, window in entry.windows.items():
+            s = window.stats()
+            rows.append((r['symbol'], name, *(s[f] for f in STATS_FIELDS), now))
+    cursor.executemany(UPSERT_STATS_SQL, rows)
+    return len(rows)
+
+
+def committed(key):
+    """Mark the in-memory windows as matching the database state `key`"""
+    global _state_key
+    if _state is not None:
+        _state_key = key
+
+
+def reset():
+    """Forget the in-memory windows (the transaction that advanced them rolled back)"""
+    global _state, _state_key
+    _state = None
+    _state_key = None
+
+
+def forget_symbols(cursor, keep_symbols):
+    """Drop stats for coins that fell out of the tracked set"""
+    placeholders = ','.join(['?'] * len(keep_symbols))
+    cursor.execute(f"DELETE FROM crypto_stats WHERE symbol NOT IN ({placeholders})", tuple(keep_symbols))
+
+
+def forget_state(keep_symbols):
+    """Drop the in-memory windows of pruned coins once the prune has committed"""
+    if _state is not None:
+        keep = set(keep_symbols)
+        for symbol in [s for s in _state if s not in keep]:
+            del _state[symbol]
+
+
+def rebuild_stats(cursor, now=None):
+    """
+    Backfill crypto_stats for every tracked coin from history with one set-based
+    aggregate query per window (LAG/FIRST_VALUE over price_points), for
+    databases that predate the table. `now` defaults to the newest point.
+    """
+    if now is None:
+        cursor.execute("SELECT MAX(COALESCE(run_until, timestamp)) FROM price_history")
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            return 0
+        now = datetime.fromisoformat(row[0])
+    rows = []
+    for name, seconds in STATS_WINDOWS.items():
+        cursor.execute('''
+            SELECT symbol, COUNT(*), SUM(price), MAX(price), MIN(price), MIN(first), MIN(last),
+                   COUNT(ret), SUM(ret), SUM(ret * ret)
+            FROM (
+                SELECT symbol, price,
+                       price / NULLIF(LAG(price) OVER w, 0) - 1 AS ret,
+                       FIRST_VALUE(price) OVER w AS first,
+                       FIRST_VALUE(price) OVER newest AS last
+                FROM price_points
+                WHERE timestamp > ? AND timestamp <= ? AND symbol IN (SELECT symbol FROM cryptos)
+                WINDOW w AS (PARTITION BY symbol ORDER BY timestamp, id),
+                       newest AS (PARTITION BY symbol ORDER BY timestamp DESC, id DESC)
+            )
+            GROUP BY symbol
+        ''', (now - timedelta(seconds=seconds), now))
+        for symbol, *aggregates in cursor.fetchall():
+            n_ret, ret_sum, ret_sq_sum = aggregates[6], aggregates[7] or 0.0, aggregates[8] or 0.0
+            s = summarize(*aggregates[:6], n_ret, ret_sum, ret_sq_sum)
+            rows.append((symbol, name, *(s[f] for f in STATS_FIELDS), now))
+    cursor.executemany(UPSERT_STATS_SQL, rows)
+    return len(rows)
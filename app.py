@@ -1,115 +1,708 @@
-from flask import Flask, render_template, jsonify
+from flask import Blueprint, Flask, Response, render_template, jsonify, request, g
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime, timezone
+from werkzeug.http import quote_etag
+from datetime import datetime, timedelta, timezone
 import atexit
+import base64
+import binascii
+import csv
+import io
+import json
 import os
+import re
+import threading
+import time
 
-from database import init_db, get_all_cryptos, get_crypto_history
-from scraper import scrape_crypto_prices  # fixed import spelling
+from database import (
+    init_db, get_all_cryptos, get_crypto_history, get_price_series, close_all_connections,
+    get_history_batch, get_last_scrape_time, get_last_check_time, get_scrape_runs, get_table_sizes,
+    get_crypto_stats, warm_history_buffer, iter_price_points, get_cryptos_page, ROLLUP_TIERS, EXPORT_FIELDS,
+    CRYPTO_FIELDS, CRYPTO_SORTS
+)
+from cache import SnapshotCache, KeyedSnapshotCache, SUPPORTED_ENCODINGS
+from stream import Broadcaster
+import stream as stream_module
+import coordination
+import jobs
+import metrics
+import pacing
 
-app = Flask(__name__)
-CORS(app)
-
-# Initialize database
-init_db()
+# Nothing heavy happens at import time: the schema, the scheduler and the
+# scraping stack (requests, bs4, APScheduler) are loaded by create_app() or
+# on first use, so read-only workers and tooling import this module cheaply.
+routes = Blueprint('routes', __name__)
 
 # Configure scheduler for automated scraping (interval from env, default 10 min)
 try:
     SCRAPE_INTERVAL_MINUTES = int(os.environ.get("SCRAPE_INTERVAL", "10"))
 except ValueError:
     SCRAPE_INTERVAL_MINUTES = 10
+try:
+    RETENTION_INTERVAL_HOURS = int(os.environ.get("RETENTION_INTERVAL", "6"))
+except ValueError:
+    RETENTION_INTERVAL_HOURS = 6
+# Set RUN_SCHEDULER=0 on processes that should only ever serve reads
+RUN_SCHEDULER = os.environ.get("RUN_SCHEDULER", "1") != "0"
+
+scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+# Set by create_app(); ensure_scheduler() does nothing in apps built without a scheduler
+_run_scheduler = False
 
-scheduler = BackgroundScheduler()
-# Prevent duplicate scheduler if app restarts (Flask debug mode)
-if not scheduler.running:
-    # Run immediately on start, then every SCRAPE_INTERVAL_MINUTES
+def start_scheduler():
+    """Start the background jobs once per process (imports APScheduler on demand)"""
+    global scheduler, _scheduler_pid
+    with _scheduler_lock:
+        # A scheduler object inherited across fork has no running threads
+        if scheduler is not None and _scheduler_pid == os.getpid():
+            return scheduler
+        return _start_scheduler()
+
+def _start_scheduler():
+    global scheduler, _scheduler_pid
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from retention import run_retention
+
+    _scheduler_pid = os.getpid()
+    scheduler = BackgroundScheduler()
+    # Every process competes for the scraper lease; only the holder runs the
+    # jobs below, the rest stay read-only API servers and take over if it dies
     scheduler.add_job(
-        func=scrape_crypto_prices,
+        func=coordination.renew_lease,
         trigger="interval",
-        minutes=SCRAPE_INTERVAL_MINUTES,
+        seconds=coordination.LEASE_RENEW_SECONDS,
         next_run_time=datetime.now(timezone.utc)
     )
+    if pacing.SCRAPE_ADAPTIVE:
+        # Run immediately on start, then after a delay picked from how fast prices move
+        pacing.AdaptiveScrapeJob(scheduler, SCRAPE_INTERVAL_MINUTES * 60).start()
+    else:
+        # Run immediately on start, then every SCRAPE_INTERVAL_MINUTES
+        scheduler.add_job(
+            func=coordination.leader_only(jobs.run_scrape_exclusive),
+            trigger="interval",
+            minutes=SCRAPE_INTERVAL_MINUTES,
+            next_run_time=datetime.now(timezone.utc)
+        )
+    # Manual scrapes queued through /api/scrape-now by any worker
+    scheduler.add_job(
+        func=coordination.leader_only(jobs.run_pending_jobs),
+        trigger="interval",
+        seconds=jobs.JOB_POLL_SECONDS,
+        max_instances=1,
+        coalesce=True
+    )
+    # Batched retention: folds old points into rollups, then deletes in small chunks
+    scheduler.add_job(
+        func=coordination.leader_only(run_retention),
+        trigger="interval",
+        hours=RETENTION_INTERVAL_HOURS,
+        max_instances=1,
+        coalesce=True
+    )
     scheduler.start()
+    # /api/scrape-now may now start queued jobs here instead of waiting for the poll
+    jobs.scheduler_started()
+    # Shut down the scheduler and hand back the scraper lease before the
+    # connections close (atexit runs handlers in reverse order)
+    atexit.register(coordination.release)
+    atexit.register(scheduler.shutdown)
+    return scheduler
 
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+def ensure_scheduler():
+    """
+    Start this process's scheduler if create_app() enabled one. gunicorn
+    calls this in each worker right after the fork (post_worker_init in
+    gunicorn.conf.py), so scraping never waits for traffic; the
+    before_request hook covers servers without that hook. Not in create_app:
+    under `gunicorn --preload` that runs in the master, which forks workers
+    while a scheduler thread may be mid-write, and the children inherit
+    SQLite and metrics lock state they can never release.
+    """
+    if _run_scheduler and (scheduler is None or _scheduler_pid != os.getpid()):
+        start_scheduler()
 
-@app.route('/')
+@routes.route('/')
 def index():
     """Render the main page"""
     return render_template('index.html')
 
-@app.route('/health')
+@routes.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@routes.after_app_request
+def record_request(response):
+    """Per-route latency and payload size; the route is the URL rule, not the raw path"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(
+            time.perf_counter() - started)
+        # Streamed responses (SSE) have no length up front
+        if response.content_length is not None:
+            metrics.HTTP_RESPONSE_BYTES.labels(route).observe(response.content_length)
+    return response
+
+def data_age_seconds(last_scrape):
+    return round((datetime.now() - last_scrape).total_seconds(), 1) if last_scrape else None
+
+@routes.route('/health')
 def health():
-    """Health check endpoint for Render"""
-    return jsonify({"status": "ok", "time": datetime.now().isoformat()}), 200
+    """Health check endpoint for Render, with the age of the stored data"""
+    last_scrape = get_last_scrape_time()
+    age = data_age_seconds(last_scrape)
+    # An unchanged listing is not written again, so freshness counts those checks too
+    last_check = get_last_check_time()
+    last_check = datetime.fromtimestamp(last_check) if last_check else None
+    freshest = max(filter(None, (last_scrape, last_check)), default=None)
+    check_age = data_age_seconds(freshest)
+    return jsonify({
+        "status": "ok",
+        "time": datetime.now().isoformat(),
+        "last_scrape": last_scrape.isoformat() if last_scrape else None,
+        "last_check": last_check.isoformat() if last_check else None,
+        "data_age_seconds": age,
+        # Missed at least two scheduled scrapes (still 200 so the service is not restarted)
+        "stale": check_age is None or check_age > 3 * pacing.longest_interval(SCRAPE_INTERVAL_MINUTES * 60)
+    }), 200
+
+def _table_sizes():
+    rows, file_bytes = get_table_sizes()
+    return rows, file_bytes, data_age_seconds(get_last_scrape_time())
+
+@routes.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text format, summed across all worker processes"""
+    body, content_type = metrics.render(_table_sizes)
+    return Response(body, content_type=content_type)
+
+def _iso_utc(ts):
+    """Convert 'YYYY-MM-DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SSZ' for consistent client parsing"""
+    t = str(ts).strip()
+    if 'T' not in t:
+        t = t.replace(' ', 'T')
+    if not (t.endswith('Z') or t.endswith('+00:00')):
+        t = t + 'Z'
+    return t
+
+def build_cryptos_payload(include_stats=False):
+    """Build the /api/cryptos response body for the latest committed snapshot"""
+    cryptos = get_all_cryptos()
+    stats = get_crypto_stats() if include_stats else None
+    for c in cryptos:
+        if c.get('last_updated'):
+            c['last_updated'] = _iso_utc(c['last_updated'])
+        if stats is not None:
+            c['stats'] = stats.get(c['symbol'], {})
+    return {
+        'success': True,
+        'data': cryptos,
+        # Time of the newest row, so every worker builds byte-identical bodies (and ETags)
+        'timestamp': _snapshot_timestamp(max((c['last_updated'] for c in cryptos if c.get('last_updated')), default=None))
+    }
+
+def _snapshot_timestamp(newest):
+    """The listing's `timestamp`: its newest last_updated, or now for an empty table"""
+    return _iso_utc(newest) if newest else datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def wants_stats(args):
+    """stats=1 (or true/yes) on /api/cryptos: include each coin's rolling stats"""
+    return args.get('stats', '').lower() in ('1', 'true', 'yes')
+
+# Paged /api/cryptos (any of sort=, order=, limit=, after=, fields=)
+CRYPTOS_PAGE_DEFAULT_LIMIT = 100
+CRYPTOS_PAGE_MAX_LIMIT = 1000
+_PAGE_PARAMS = ('sort', 'order', 'limit', 'after', 'fields')
+
+def _encode_cursor(sort, order, row):
+    raw = json.dumps([sort, order, row[CRYPTO_SORTS[sort]], row['symbol']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(token, sort, order):
+    """after= token -> (key value, symbol); it must come from a page with the same sort and order"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, cursor_order, value, symbol = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("after is not a valid cursor")
+    if not isinstance(symbol, str) or not (value is None or isinstance(value, (int, float))):
+        raise ValueError("after is not a valid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("after is a cursor for a different sort or order")
+    return value, symbol
+
+def parse_cryptos_page_query(args):
+    """Validate the paging parameters into a hashable key; None when the request is not paged"""
+    if not any(name in args for name in _PAGE_PARAMS):
+        return None
+    sort = args.get('sort', 'market_cap')
+    if sort not in CRYPTO_SORTS:
+        raise ValueError("sort must be one of " + ', '.join(CRYPTO_SORTS))
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    try:
+        limit = int(args.get('limit', CRYPTOS_PAGE_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= CRYPTOS_PAGE_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {CRYPTOS_PAGE_MAX_LIMIT}")
+    after = _decode_cursor(args['after'], sort, order) if args.get('after') else None
+    if args.get('fields'):
+        fields = tuple(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+        unknown = [f for f in fields if f not in CRYPTO_FIELDS]
+        if unknown:
+            raise ValueError("unknown fields: " + ', '.join(unknown))
+    else:
+        fields = CRYPTO_FIELDS
+    return sort, order, limit, after, fields, wants_stats(args)
+
+def build_cryptos_page_payload(key):
+    """Build one paged /api/cryptos body: the requested fields (symbol always) and the next cursor"""
+    sort, order, limit, after, fields, include_stats = key
+    rows, more, newest = get_cryptos_page(sort, order == 'desc', limit, after, fields)
+    keep = ('symbol', *fields)
+    data = [{name: row[name] for name in keep} for row in rows]
+    stats = get_crypto_stats([row['symbol'] for row in rows]) if include_stats and rows else {}
+    for c in data:
+        if c.get('last_updated'):
+            c['last_updated'] = _iso_utc(c['last_updated'])
+        if include_stats:
+            c['stats'] = stats.get(c['symbol'], {})
+    return {
+        'success': True,
+        'data': data,
+        'sort': sort,
+        'order': order,
+        'next': _encode_cursor(sort, order, rows[-1]) if more else None,
+        # Same stamp as the unpaged list, so pages of one scrape agree
+        'timestamp': _snapshot_timestamp(newest)
+    }
+
+# range= values like 90m, 24h, 7d, 4w, 1y
+_RANGE_RE = re.compile(r'^(\d+)([mhdwy])$')
+_RANGE_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+_TIER_SECONDS = {'1m': 60, '1h': 3600, '1d': 86400}
+# resolution=auto picks the finest tier that keeps a series under this many points
+HISTORY_MAX_POINTS = 1000
+
+def parse_history_query(args):
+    """Validate range=/resolution= into (range_seconds, resolution); (None, None) means legacy"""
+    range_arg = args.get('range')
+    resolution = args.get('resolution', 'auto' if range_arg else None)
+    if not range_arg and not resolution:
+        return None, None
+
+    m = _RANGE_RE.match(range_arg or '24h')
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError("range must look like 24h, 7d, 4w or 1y")
+    seconds = int(m.group(1)) * _RANGE_UNITS[m.group(2)]
+
+    if resolution == 'auto':
+        resolution = next(
+            (tier for tier in ROLLUP_TIERS if seconds / _TIER_SECONDS[tier] <= HISTORY_MAX_POINTS),
+            '1d'
+        )
+    if resolution != 'raw' and resolution not in ROLLUP_TIERS:
+        raise ValueError("resolution must be one of raw, auto, " + ', '.join(ROLLUP_TIERS))
+    return seconds, resolution
+
+def build_history_payload(key):
+    """Build the /api/crypto/<symbol>/history response body"""
+    symbol, seconds, resolution = key
+    if seconds is None:
+        # No range/resolution: the latest raw points, as before
+        return {
+            'success': True,
+            'data': get_crypto_history(symbol),
+            'symbol': symbol
+        }
+    since = datetime.now() - timedelta(seconds=seconds)
+    return {
+        'success': True,
+        'data': get_price_series(symbol, since, resolution),
+        'symbol': symbol,
+        'resolution': resolution
+    }
+
+# Limits for /api/history (one request covering many sparklines)
+HISTORY_BATCH_MAX_SYMBOLS = 1000
+HISTORY_BATCH_DEFAULT_POINTS = 24
+
+def parse_batch_history_query(args):
+    """Validate symbols=/points= into (symbols, points); no symbols means every tracked coin"""
+    symbols = tuple(sorted({s.strip().upper() for s in args.get('symbols', '').split(',') if s.strip()}))
+    if len(symbols) > HISTORY_BATCH_MAX_SYMBOLS:
+        raise ValueError(f"at most {HISTORY_BATCH_MAX_SYMBOLS} symbols per request")
+    try:
+        points = int(args.get('points', HISTORY_BATCH_DEFAULT_POINTS))
+    except ValueError:
+        raise ValueError("points must be an integer")
+    if not 1 <= points <= HISTORY_MAX_POINTS:
+        raise ValueError(f"points must be between 1 and {HISTORY_MAX_POINTS}")
+    return symbols, points
+
+def build_batch_history_payload(key):
+    """
+    Build the /api/history body in columnar form: one shared timestamp array
+    (scrapes write every coin with the same timestamp) and one price array per
+    symbol, with null where a coin has no point at that time.
+    """
+    symbols, points = key
+    rows = get_history_batch(symbols, points)
+    timestamps = sorted({row['timestamp'] for row in rows})
+    index = {ts: i for i, ts in enumerate(timestamps)}
+    series = {}
+    for row in rows:
+        values = series.get(row['symbol'])
+        if values is None:
+            values = series[row['symbol']] = [None] * len(timestamps)
+        values[index[row['timestamp']]] = row['price']
+    return {
+        'success': True,
+        'points': points,
+        'timestamps': [_iso_utc(ts) for ts in timestamps],
+        'series': series
+    }
+
+def build_stats_payload(symbol):
+    """Build the /api/cryptos/<symbol>/stats body: rolling stats per window"""
+    return {
+        'success': True,
+        'symbol': symbol,
+        'stats': get_crypto_stats([symbol]).get(symbol, {})
+    }
 
-@app.route('/api/cryptos')
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+_encode_line = json.JSONEncoder(separators=(',', ':')).encode
+
+def _parse_time(value, name):
+    """
+    ISO 8601 date or datetime -> naive server-local datetime, the way the
+    scraper stores timestamps (datetime.now()) and the export emits them.
+    A value with an offset ('Z', '+02:00') is converted to local time.
+    """
+    try:
+        t = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    if t.tzinfo is not None:
+        t = t.astimezone().replace(tzinfo=None)
+    return t
+
+def _iso_local(ts):
+    """Stored 'YYYY-MM-DD HH:MM:SS[.ffffff]' -> ISO 8601 with no offset: server-local, as stored"""
+    return str(ts).strip().replace(' ', 'T', 1)
+
+def parse_export_query(args):
+    """Validate format=/symbols=/since=/until=/after= for /api/export"""
+    fmt = args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_MIMETYPES:
+        raise ValueError("format must be one of " + ', '.join(EXPORT_MIMETYPES))
+    symbols = sorted({s.strip().upper() for s in args.get('symbols', '').split(',') if s.strip()})
+    since = _parse_time(args['since'], 'since') if args.get('since') else None
+    until = _parse_time(args['until'], 'until') if args.get('until') else None
+    if since and until and since >= until:
+        raise ValueError("since must be before until")
+    after = None
+    if args.get('after'):
+        # The symbol and timestamp of the last row received
+        symbol, _, ts = args['after'].partition(',')
+        if not symbol.strip() or not ts:
+            raise ValueError("after must look like SYMBOL,TIMESTAMP")
+        after = (symbol.strip().upper(), str(_parse_time(ts, 'after')))
+    return fmt, symbols, since, until, after
+
+def encode_export(fmt, batches):
+    """
+    Turn iter_price_points batches into NDJSON lines or CSV rows, one chunk per
+    batch. The 200 status is already sent when a read fails mid-stream, so an
+    NDJSON export ends with an explicit {"success": false, "error": ...} line;
+    CSV has no place for one, so the error is logged and the stream closed.
+    """
+    rows_sent = 0
+    try:
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            writer.writerow(EXPORT_FIELDS)
+            yield buf.getvalue()
+            for rows in batches:
+                buf.seek(0)
+                buf.truncate()
+                writer.writerows((symbol, _iso_local(ts), *values) for symbol, ts, *values in rows)
+                rows_sent += len(rows)
+                yield buf.getvalue()
+            return
+        for rows in batches:
+            yield ''.join(
+                _encode_line(dict(zip(EXPORT_FIELDS, (symbol, _iso_local(ts), *values)))) + '\n'
+                for symbol, ts, *values in rows
+            )
+            rows_sent += len(rows)
+    except Exception as e:
+        print(f"❌ Export ({fmt}) failed after {rows_sent} rows: {e}")
+        if fmt != 'csv':
+            yield _encode_line({'success': False, 'error': str(e)}) + '\n'
+
+# Normalized list + encoded JSON, rebuilt only when a new scrape is committed
+cryptos_cache = SnapshotCache(build_cryptos_payload, name='cryptos')
+# The same list with each coin's rolling stats (/api/cryptos?stats=1)
+cryptos_stats_cache = SnapshotCache(lambda: build_cryptos_payload(include_stats=True), name='cryptos_stats')
+stats_cache = KeyedSnapshotCache(build_stats_payload, cryptos_cache, name='stats')
+cryptos_page_cache = KeyedSnapshotCache(build_cryptos_page_payload, cryptos_cache, name='cryptos_page')
+history_cache = KeyedSnapshotCache(build_history_payload, cryptos_cache, name='history')
+batch_history_cache = KeyedSnapshotCache(build_batch_history_payload, cryptos_cache, name='history_batch', max_entries=64)
+# Pushes one delta event per committed scrape to every /api/stream subscriber
+broadcaster = Broadcaster(cryptos_cache)
+
+def negotiate_snapshot(snapshot, if_none_match, accept_encodings):
+    """(status, headers, body) for a snapshot: 304 on an ETag match, else the best precompressed body"""
+    headers = {
+        'ETag': quote_etag(snapshot.etag),
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    if if_none_match.contains(snapshot.etag):
+        return 304, headers, b''
+
+    encoding = accept_encodings.best_match(SUPPORTED_ENCODINGS)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        return 200, headers, snapshot.encoded(encoding)
+    return 200, headers, snapshot.body
+
+def snapshot_response(snapshot):
+    """Serve a snapshot with its ETag (see negotiate_snapshot)"""
+    status, headers, body = negotiate_snapshot(snapshot, request.if_none_match, request.accept_encodings)
+    if status == 304:
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+@routes.route('/api/cryptos')
 def get_cryptos():
-    """API endpoint to get all latest crypto prices"""
+    """
+    API endpoint to get all latest crypto prices (stats=1 adds rolling stats
+    per coin), or one page of them with sort=, order=, limit=, after=, fields=
+    """
     try:
-        cryptos = get_all_cryptos()
-        # Normalize timestamps to ISO8601 UTC (with Z) for consistent client parsing
-        for c in cryptos:
-            ts = c.get('last_updated')
-            if ts:
-                # Convert 'YYYY-MM-DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SSZ'
-                t = str(ts).strip()
-                if 'T' not in t:
-                    t = t.replace(' ', 'T')
-                if not (t.endswith('Z') or t.endswith('+00:00')):
-                    t = t + 'Z'
-                c['last_updated'] = t
+        key = parse_cryptos_page_query(request.args)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': cryptos,
-            # Use UTC time for API timestamp
-            'timestamp': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
+    try:
+        if key is not None:
+            return snapshot_response(cryptos_page_cache.get(key))
+        return snapshot_response((cryptos_stats_cache if wants_stats(request.args) else cryptos_cache).get())
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/crypto/<symbol>/history')
+@routes.route('/api/cryptos/<symbol>/stats')
+def get_stats(symbol):
+    """Moving average, high/low, return and volatility over each rolling window"""
+    try:
+        snapshot = stats_cache.get(symbol.upper())
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    if not snapshot.data['stats']:
+        return jsonify({
+            'success': False,
+            'error': 'No stats for this symbol'
+        }), 404
+    return snapshot_response(snapshot)
+
+@routes.route('/api/crypto/<symbol>/history')
 def get_history(symbol):
-    """API endpoint to get price history for a specific crypto"""
+    """API endpoint to get price history for a specific crypto (optional range= and resolution=)"""
     try:
-        history = get_crypto_history(symbol.upper())
+        seconds, resolution = parse_history_query(request.args)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': history,
-            'symbol': symbol.upper()
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
+    try:
+        return snapshot_response(history_cache.get((symbol.upper(), seconds, resolution)))
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/scrape-now')
-def scrape_now():
-    """Manual trigger to scrape data immediately"""
+@routes.route('/api/history')
+def get_history_batch_route():
+    """API endpoint for many symbols' recent history in one columnar response"""
+    try:
+        key = parse_batch_history_query(request.args)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    try:
+        return snapshot_response(batch_history_cache.get(key))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@routes.route('/api/export')
+def export():
+    """Stream raw price history as NDJSON or CSV, ordered by symbol then time (resumable with after=)"""
     try:
-        scrape_crypto_prices()
+        fmt, symbols, since, until, after = parse_export_query(request.args)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    return Response(
+        encode_export(fmt, iter_price_points(symbols, since, until, after)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename=price_history.{fmt}',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@routes.route('/api/scrape-runs')
+def scrape_runs():
+    """Recent scrape runs with fetch time and whether the listing changed (for tuning SCRAPE_INTERVAL)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 1000)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'limit must be an integer'
+        }), 400
+    runs = get_scrape_runs(limit)
+    for run in runs:
+        run['started_at'] = datetime.fromtimestamp(run['started_at'], timezone.utc).isoformat().replace('+00:00', 'Z')
+    return jsonify({
+        'success': True,
+        'runs': runs
+    })
+
+@routes.route('/api/stream')
+def stream():
+    """Server-Sent Events: a full snapshot on connect, then changed rows per scrape"""
+    if not broadcaster.try_subscribe():
+        # Clients fall back to polling /api/cryptos
         return jsonify({
+            'success': False,
+            'error': 'Too many open streams' if stream_module.SSE_MAX_STREAMS else 'Streaming is served by asgi.py only'
+        }), 503
+    response = Response(
+        broadcaster.stream(request.headers.get('Last-Event-ID')),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(broadcaster.unsubscribe)
+    return response
+
+@routes.route('/api/scrape-now', methods=['GET', 'POST'])
+def scrape_now():
+    """Queue a manual scrape (merged with any in-flight one) and return its job id"""
+    try:
+        job, created = jobs.request_scrape()
+        if created is None:
+            # Data was refreshed moments ago; point the client at that job instead
+            response = jsonify({
+                'success': False,
+                'error': 'Data was refreshed recently, try again later',
+                'job': jobs.describe_job(job)
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(jobs.MIN_REFRESH_SECONDS)
+            return response
+        response = jsonify({
             'success': True,
-            'message': 'Scraping completed successfully'
+            'message': 'Scrape queued' if created else 'Joined the scrape already in progress',
+            'job': jobs.describe_job(job)
         })
+        response.status_code = 202
+        response.headers['Location'] = f"/api/jobs/{job['id']}"
+        return response
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@routes.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Status and timing of a manual scrape job"""
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown job'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+def create_app(run_scheduler=None):
+    """
+    Build the Flask app: apply pending schema migrations (a no-op once the
+    database is current), warm the in-memory recent history, register the
+    routes and, unless disabled, arrange for each serving process to start
+    the scheduler that competes for the scraper lease.
+    """
+    global _run_scheduler
+    # Samples from a previous run, unless another live process shares the directory
+    metrics.reset_stale()
+    app = Flask(__name__)
+    # Expose ETag so cross-origin dashboards can send conditional requests
+    CORS(app, expose_headers=['ETag'])
+    app.register_blueprint(routes)
+
+    init_db()
+    # Recent history served from memory; with --preload workers inherit it
+    warm_history_buffer()
+    atexit.register(metrics.process_exit)
+    atexit.register(close_all_connections)
+    _run_scheduler = RUN_SCHEDULER if run_scheduler is None else run_scheduler
+    if _run_scheduler:
+        app.before_request(ensure_scheduler)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `gunicorn app:app` and `from app import app` still work; the app is built on first access
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    from scraper import scrape_crypto_prices
+
     # Initial scrape on startup
     print("🚀 Starting Crypto Tracker...")
+    app = create_app()
     print("📊 Performing initial data scrape...")
     scrape_crypto_prices()
     print("✅ Initial scrape complete!")
+    # Keep scraping on schedule even before the first page view
+    if RUN_SCHEDULER:
+        start_scheduler()
     
     # Run the Flask app (disable debug to prevent scheduler restarts)
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,413 @@
+"""
+ASGI entry point for serving many slow or idle connections from one small
+instance:
+
+    pip install uvicorn
+    uvicorn asgi:app --workers 2
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+
+The read-only JSON endpoints (/api/cryptos, /api/cryptos/<symbol>/stats,
+/api/crypto/<symbol>/history and /api/history) are answered by async
+handlers. A snapshot that is already built is served straight from the event
+loop; anything that needs SQLite runs on a bounded thread pool
+(ASGI_DB_THREADS). /api/stream is served from the event loop too: an open
+stream is a parked coroutine, not a thread, so one worker can hold thousands
+of idle subscribers (ASGI_MAX_STREAMS). Every other route goes to the
+unchanged Flask app, one pool thread per request for the whole response
+(ASGI_WSGI_THREADS), just as a gthread worker would run it.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header, parse_etags
+
+import app as flask_module
+import metrics
+import stream
+
+try:
+    # Threads doing SQLite work for the async routes (cache rebuilds, generation checks)
+    ASGI_DB_THREADS = int(os.environ.get("ASGI_DB_THREADS", "8"))
+except ValueError:
+    ASGI_DB_THREADS = 8
+
+try:
+    # Threads for requests handed to the Flask app (exports hold one while they stream)
+    ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "4"))
+except ValueError:
+    ASGI_WSGI_THREADS = 4
+
+try:
+    # Open /api/stream connections per worker; each is a coroutine waiting on a shared future
+    ASGI_MAX_STREAMS = int(os.environ.get("ASGI_MAX_STREAMS", "10000"))
+except ValueError:
+    ASGI_MAX_STREAMS = 10000
+
+
+def _cryptos(args, match):
+    key = flask_module.parse_cryptos_page_query(args)
+    if key is not None:
+        return flask_module.cryptos_page_cache, (key,)
+    return (flask_module.cryptos_stats_cache if flask_module.wants_stats(args) else flask_module.cryptos_cache), ()
+
+def _stats(args, match):
+    return flask_module.stats_cache, (match.group(1).upper(),)
+
+def _history(args, match):
+    seconds, resolution = flask_module.parse_history_query(args)
+    return flask_module.history_cache, ((match.group(1).upper(), seconds, resolution),)
+
+def _history_batch(args, match):
+    return flask_module.batch_history_cache, (flask_module.parse_batch_history_query(args),)
+
+# (Flask rule, used as the metrics route label, path pattern, query -> (cache, get() args))
+ROUTES = [
+    ('/api/cryptos', re.compile(r'^/api/cryptos$'), _cryptos),
+    ('/api/cryptos/<symbol>/stats', re.compile(r'^/api/cryptos/([^/]+)/stats$'), _stats),
+    ('/api/crypto/<symbol>/history', re.compile(r'^/api/crypto/([^/]+)/history$'), _history),
+    ('/api/history', re.compile(r'^/api/history$'), _history_batch),
+]
+
+
+STREAM_PATH = '/api/stream'
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def _error(status, message):
+    """The body jsonify() gives the same error under the Flask app"""
+    body = json.dumps({'success': False, 'error': message}, sort_keys=True, separators=(',', ':')) + '\n'
+    return status, {}, body.encode('utf-8')
+
+
+class AsgiApp:
+    """
+    The ASGI callable. Pools, the Flask app and the scheduler are set up per
+    process on lifespan startup (or the first request), so a server that
+    imports this in a master and forks workers starts them after the fork.
+    """
+
+    def __init__(self, flask_app=None):
+        self._flask_app = flask_app
+        self._pid = None
+        self._lock = threading.Lock()
+        self._db_pool = None
+        self._wsgi_pool = None
+        self._started = None
+        self._streams = 0
+        self._published = None
+        self._commit_seen = None
+        self._ticker = None
+
+    def _pools(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._db_pool = ThreadPoolExecutor(ASGI_DB_THREADS, thread_name_prefix='asgi-db')
+                    self._wsgi_pool = ThreadPoolExecutor(ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+                    self._started = None
+                    self._streams = 0
+                    self._ticker = None
+                    self._pid = os.getpid()
+        return self._db_pool
+
+    def _start(self):
+        """Build the Flask app (migrations, history warm-up, exit hooks) and start the scheduler"""
+        if self._flask_app is None:
+            self._flask_app = flask_module.create_app(run_scheduler=False)
+        if flask_module.RUN_SCHEDULER:
+            flask_module.start_scheduler()
+
+    async def _ensure_started(self):
+        pool = self._pools()
+        if self._started is None:
+            self._started = asyncio.get_running_loop().run_in_executor(pool, self._start)
+        await self._started
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        await self._ensure_started()
+        if scope['method'] == 'GET':
+            if scope['path'] == STREAM_PATH:
+                await self._serve_stream(scope, receive, send)
+                return
+            for rule, pattern, lookup in ROUTES:
+                match = pattern.match(scope['path'])
+                if match:
+                    await self._serve_snapshot(scope, send, rule, match, lookup)
+                    return
+        await self._serve_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._ensure_started()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._ticker is not None:
+                    self._ticker.cancel()
+                for pool in (self._db_pool, self._wsgi_pool):
+                    if pool is not None:
+                        pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _serve_snapshot(self, scope, send, rule, match, lookup):
+        started = time.perf_counter()
+        headers = {}
+        for name, value in scope['headers']:
+            headers[name.decode('latin-1')] = value.decode('latin-1')
+        args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        try:
+            status, extra, body = await self._resolve(args, match, lookup, headers)
+        except Exception as e:
+            status, extra, body = _error(500, str(e))
+
+        response_headers = []
+        if status != 304:
+            response_headers.append((b'content-type', b'application/json'))
+            response_headers.append((b'content-length', str(len(body)).encode()))
+        if 'origin' in headers:
+            # What flask_cors adds to the same routes under the Flask app
+            response_headers.append((b'access-control-allow-origin', b'*'))
+            response_headers.append((b'access-control-expose-headers', b'ETag'))
+        response_headers.extend((k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in extra.items())
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+        metrics.HTTP_REQUEST_SECONDS.labels(rule, 'GET', status).observe(time.perf_counter() - started)
+        metrics.HTTP_RESPONSE_BYTES.labels(rule).observe(len(body))
+
+    async def _resolve(self, args, match, lookup, headers):
+        try:
+            cache, key = lookup(args, match)
+        except ValueError as e:
+            return _error(400, str(e))
+        # A built, current snapshot needs no database read and no thread hop
+        snapshot = cache.peek(*key)
+        if snapshot is None:
+            snapshot = await asyncio.get_running_loop().run_in_executor(self._db_pool, cache.get, *key)
+        if lookup is _stats and not snapshot.data['stats']:
+            return _error(404, 'No stats for this symbol')
+        return flask_module.negotiate_snapshot(
+            snapshot,
+            parse_etags(headers.get('if-none-match')),
+            parse_accept_header(headers.get('accept-encoding'))
+        )
+
+    def _ensure_ticker(self):
+        """
+        One task per worker refreshes the broadcaster (on a pool thread, since
+        a rebuild reads SQLite) at each commit here or every check interval,
+        and resolves the shared future every waiting stream is parked on.
+        """
+        if self._ticker is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._published = loop.create_future()
+        self._commit_seen = asyncio.Event()
+        seen = self._commit_seen
+        flask_module.broadcaster.add_waker(lambda: loop.call_soon_threadsafe(seen.set))
+        self._ticker = asyncio.ensure_future(self._tick())
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        broadcaster = flask_module.broadcaster
+        while True:
+            try:
+                await asyncio.wait_for(self._commit_seen.wait(), broadcaster.check_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._commit_seen.clear()
+            if not self._streams:
+                continue
+            try:
+                published = await loop.run_in_executor(self._db_pool, broadcaster.refresh)
+            except Exception as e:
+                print(f"⚠️ Stream refresh failed: {e}")
+                continue
+            if published:
+                self._publish()
+
+    def _publish(self):
+        """Wake every parked stream; they read the new events from the broadcaster"""
+        waiting, self._published = self._published, asyncio.get_running_loop().create_future()
+        waiting.set_result(None)
+
+    async def _serve_stream(self, scope, receive, send):
+        """Server-Sent Events from the event loop, the same frames the Flask route sends"""
+        started = time.perf_counter()
+        headers = {}
+        for name, value in scope['headers']:
+            headers[name.decode('latin-1')] = value.decode('latin-1')
+        cors = []
+        if 'origin' in headers:
+            cors = [(b'access-control-allow-origin', b'*'), (b'access-control-expose-headers', b'ETag')]
+
+        if ASGI_MAX_STREAMS and self._streams >= ASGI_MAX_STREAMS:
+            # Clients fall back to polling /api/cryptos
+            status, _, body = _error(503, 'Too many open streams')
+            await send({'type': 'http.response.start', 'status': status, 'headers': [
+                (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *cors]})
+            await send({'type': 'http.response.body', 'body': body})
+            metrics.HTTP_REQUEST_SECONDS.labels(STREAM_PATH, 'GET', status).observe(time.perf_counter() - started)
+            return
+
+        broadcaster = flask_module.broadcaster
+        self._streams += 1
+        gone = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            self._ensure_ticker()
+            if await asyncio.get_running_loop().run_in_executor(self._db_pool, broadcaster.refresh):
+                self._publish()
+            # Take the future before reading events, so nothing published after the read is missed
+            published = self._published
+            first, last_seen = broadcaster.opening(headers.get('last-event-id'))
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                *cors
+            ]})
+            metrics.HTTP_REQUEST_SECONDS.labels(STREAM_PATH, 'GET', 200).observe(time.perf_counter() - started)
+            await send({'type': 'http.response.body', 'body': first.encode('utf-8'), 'more_body': True})
+
+            opened = last_beat = time.monotonic()
+            while not gone.done():
+                remaining = stream.SSE_MAX_STREAM_SECONDS - (time.monotonic() - opened)
+                if remaining <= 0:
+                    break
+                timeout = min(remaining, max(0.0, stream.SSE_HEARTBEAT_SECONDS - (time.monotonic() - last_beat)))
+                await asyncio.wait((published, gone), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if gone.done():
+                    break
+                published = self._published
+                frames, last_seen = broadcaster.pending(last_seen)
+                if not frames and time.monotonic() - last_beat >= stream.SSE_HEARTBEAT_SECONDS:
+                    frames = ": ping\n\n"
+                if frames:
+                    last_beat = time.monotonic()
+                    await send({'type': 'http.response.body', 'body': frames.encode('utf-8'), 'more_body': True})
+            if not gone.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            # The client went away mid-send
+            pass
+        finally:
+            self._streams -= 1
+            gone.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _serve_wsgi(self, scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        loop = asyncio.get_running_loop()
+        gone = threading.Event()
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            gone.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await loop.run_in_executor(self._wsgi_pool, self._run_wsgi, _environ(scope, body), loop, send, gone)
+        except ClientDisconnected:
+            pass
+        finally:
+            watcher.cancel()
+
+    def _run_wsgi(self, environ, loop, send, gone):
+        """Run one request through the Flask app on this thread, passing each chunk to the event loop"""
+        def emit(message):
+            if gone.is_set():
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+            def write(data):
+                raise RuntimeError("write() is not supported; return an iterable")
+            return write
+
+        chunks = self._flask_app(environ, start_response)
+        try:
+            emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            for chunk in chunks:
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Streams (SSE, exports) end here when the client goes away
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+def _environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+app = AsgiApp()
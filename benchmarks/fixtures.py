@@ -0,0 +1,148 @@
+"""
+Deterministic CoinGecko-style listing pages for offline benchmarks.
+
+Real pages saved with `python -m benchmarks.scraper_bench --record` are
+stored next to this module in fixtures/ and replayed alongside these.
+"""
+import os
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class StubResponse:
+    """The parts of requests.Response the scraper uses, for serving pages without a network"""
+
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+_HEAD = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Cryptocurrency Prices</title>'
+    '<link rel="stylesheet" href="/app.css"><script src="/app.js"></script></head><body>'
+    '<nav class="tw-flex"><a href="/">CoinGecko</a><a href="/en/exchanges">Exchanges</a></nav>'
+    '<div class="tw-grid"><div class="tw-card">Market Cap $3.38T <span>−1.2%</span></div></div>'
+)
+_TAIL = '<footer><p>© CoinGecko</p></footer></body></html>'
+
+
+def _coin(i):
+    """Synthetic but stable values for the coin ranked i"""
+    symbol = 'C' + ''.join(chr(65 + (i // 26 ** k) % 26) for k in range(3))
+    price = 65000.0 / i
+    market_cap = 1.2e12 / i
+    volume = 3.4e10 / i
+    change = ((i * 37) % 200 - 100) / 10.0
+    return symbol, price, market_cap, volume, change
+
+
+def coin_record(i):
+    """The record the scraper parses from row i of table_page(), for seeding databases"""
+    symbol, price, mcap, vol, change = _coin(i)
+    return {
+        'symbol': symbol,
+        'name': f"Coin {i}",
+        'price': price,
+        'market_cap': mcap,
+        'volume_24h': vol,
+        'change_24h': change,
+        'change_dir': 'up' if change >= 0 else 'down',
+        'image_url': f"https://assets.example/coins/{i}.png",
+    }
+
+
+def _money(v):
+    for div, suffix in ((1e12, 'T'), (1e9, 'B'), (1e6, 'M')):
+        if v >= div:
+            return f'${v / div:,.2f}{suffix}'
+    return f'${v:,.2f}'
+
+
+def _pct(v):
+    # CoinGecko renders negative changes with U+2212 and an arrow icon
+    icon = 'caret-up' if v >= 0 else 'caret-down'
+    sign = '' if v >= 0 else '−'
+    return f'<td><span class="gecko-{icon}"><i class="fas fa-{icon}"></i>{sign}{abs(v):.1f}%</span></td>'
+
+
+def table_page(rows, first=1, tick=0):
+    """
+    The normal layout: a headed table the engine maps by column name.
+    `first` is the rank of the first row (later listing pages); a non-zero
+    `tick` nudges prices so consecutive pages carry different values.
+    """
+    out = [_HEAD, '<table class="gecko-homepage-coin-table"><thead><tr>'
+           '<th></th><th>#</th><th>Coin</th><th></th><th>Price</th><th>1h</th><th>24h</th>'
+           '<th>7d</th><th>24h Volume</th><th>Market Cap</th><th>Last 7 Days</th></tr></thead><tbody>']
+    for i in range(first, first + rows):
+        symbol, price, mcap, vol, change = _coin(i)
+        if tick:
+            price *= 1 + ((tick * 7 + i) % 11 - 5) / 1000
+        out.append(
+            f'<tr class="hover:tw-bg-gray-50"><td><button><svg class="star"></svg></button></td>'
+            f'<td class="tw-text-center">{i}</td>'
+            f'<td><a href="/en/coins/coin-{i}" class="tw-flex"><img src="https://assets.example/coins/{i}.png" alt="Coin {i}" loading="lazy">'
+            f'<div class="tw-flex-col">Coin {i}<div class="tw-text-xs">{symbol}</div></div></a></td>'
+            f'<td><button>Buy</button></td>'
+            f'<td><span data-price-target="price">${price:,.2f}</span></td>'
+            f'{_pct(change / 7)}{_pct(change)}{_pct(change * 2)}'
+            f'<td><span>{_money(vol)}</span></td><td><span>{_money(mcap)}</span></td>'
+            f'<td><img src="https://assets.example/sparkline/{i}.svg" alt="7d chart"></td></tr>'
+        )
+    out.append('</tbody></table>')
+    out.append(_TAIL)
+    return ''.join(out)
+
+
+def coin_id_page(rows):
+    """Fallback layout: no header row, only data-coin-id attributes"""
+    out = [_HEAD, '<table><tbody>']
+    for i in range(1, rows + 1):
+        symbol, price, mcap, vol, change = _coin(i)
+        out.append(
+            f'<tr data-coin-id="{i}"><td>{i}</td>'
+            f'<td><img src="https://assets.example/coins/{i}.png" alt="Coin {i}"><span>Coin {i}</span> <span>{symbol}</span></td>'
+            f'<td>${price:,.2f}</td>{_pct(change)}<td>{_money(vol)}</td><td>{_money(mcap)}</td></tr>'
+        )
+    out.append('</tbody></table>')
+    out.append(_TAIL)
+    return ''.join(out)
+
+
+def bare_tr_page(rows):
+    """Last-resort layout: rows without usable cells, parsed heuristically"""
+    out = [_HEAD, '<table>']
+    for i in range(1, rows + 1):
+        symbol, price, mcap, vol, change = _coin(i)
+        out.append(
+            f'<tr><td><a href="/en/coins/coin-{i}">Coin {i} {symbol}</a> <span>${price:,.2f}</span> '
+            f'<span>{change:.1f}%</span> <span>{_money(mcap)}</span> <div>{_money(vol)}</div></td></tr>'
+        )
+    out.append('</table>')
+    out.append(_TAIL)
+    return ''.join(out)
+
+
+def builtin_fixtures():
+    """Return [(name, html_bytes, row_count)] for the generated pages"""
+    fixtures = []
+    for rows in (10, 100, 1000):
+        fixtures.append((f'table-{rows}', table_page(rows).encode('utf-8'), rows))
+    fixtures.append(('coin-id-100', coin_id_page(100).encode('utf-8'), 100))
+    fixtures.append(('bare-tr-100', bare_tr_page(100).encode('utf-8'), 100))
+    return fixtures
+
+
+def recorded_fixtures():
+    """Return [(name, html_bytes, None)] for pages saved under fixtures/"""
+    if not os.path.isdir(FIXTURE_DIR):
+        return []
+    fixtures = []
+    for fname in sorted(os.listdir(FIXTURE_DIR)):
+        if fname.endswith('.html'):
+            with open(os.path.join(FIXTURE_DIR, fname), 'rb') as f:
+                fixtures.append((os.path.splitext(fname)[0], f.read(), None))
+    return fixtures
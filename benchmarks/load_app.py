@@ -0,0 +1,35 @@
+"""
+gunicorn entry point for load tests: the real app, with CoinGecko replaced by
+generated listing pages whose prices move on every fetch, so each scrape is
+a real write.
+
+    gunicorn benchmarks.load_app:app --workers 2 --threads 4
+    gunicorn benchmarks.load_app:asgi_app -k uvicorn.workers.UvicornWorker --workers 2
+
+benchmarks.load_test starts this for you; it never touches coingecko.com.
+"""
+import itertools
+
+import requests
+
+import scraper
+from app import create_app
+from asgi import AsgiApp
+from benchmarks.fixtures import StubResponse, table_page
+
+_ticks = itertools.count(1)
+
+
+def _listing(self, url, *args, **kwargs):
+    """Serve the listing page for `url` with freshly nudged prices"""
+    page = int(url.rsplit('page=', 1)[1]) if 'page=' in url else 1
+    first = (page - 1) * scraper.ROWS_PER_PAGE + 1
+    rows = max(0, min(scraper.ROWS_PER_PAGE, scraper.TOP_N - first + 1))
+    return StubResponse(table_page(rows, first=first, tick=next(_ticks)).encode())
+
+
+requests.Session.get = _listing
+
+app = create_app()
+# The same app behind the async entry point
+asgi_app = AsgiApp(app)
@@ -0,0 +1,428 @@
+"""
+Load test for the API under gunicorn, against a seeded local database.
+
+Seeds a SQLite file with synthetic coins and history, then for each gunicorn
+configuration (WORKERSxTHREADS) starts benchmarks.load_app (the real app with
+a stub in place of CoinGecko) and drives mixed traffic at each concurrency
+level: dashboard reads, history charts, batch sparklines and, from a separate
+writer, manual scrapes that commit real snapshots.
+
+    python -m benchmarks.load_test                                   # defaults
+    python -m benchmarks.load_test --configs 1x8,2x4,4x2 --concurrency 8,32
+    python -m benchmarks.load_test --compare benchmarks/results/load-....json
+    python -m benchmarks.load_test --server asgi --compare <gthread results>
+
+--server asgi runs the async entry point (asgi.py) on uvicorn workers under
+gunicorn instead of gthread workers; THREADS then sizes its SQLite pool.
+
+Reports p50/p95/p99 latency and throughput per endpoint, plus SQLite busy
+errors (500s mentioning a locked or busy database, and failed scrape saves),
+and saves everything as JSON so runs can be compared. The clients share one
+Python process, so treat absolute numbers as relative between runs on the
+same machine.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+
+# Keep the harness's own metric samples out of a running server's shared directory
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='load-test-metrics-')
+
+import database  # noqa: E402
+from benchmarks.fixtures import coin_record  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PERCENTILES = (50, 95, 99)
+BUSY_MARKERS = ('database is locked', 'database is busy', 'database table is locked')
+_SAMPLE_RE = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def seed_database(path, coins, days, interval_minutes):
+    """Create a database holding `days` of history for `coins` coins, one scrape every `interval_minutes`"""
+    database.close_all_connections()
+    database.DATABASE_PATH = path
+    database.init_db()
+    records = [coin_record(i) for i in range(1, coins + 1)]
+    steps = max(1, days * 24 * 60 // interval_minutes)
+    now = datetime.now()
+    times = [now - timedelta(minutes=interval_minutes * (steps - k)) for k in range(steps)]
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany(database.INSERT_HISTORY_SQL, (
+        (r['symbol'], r['price'] * (1 + 0.02 * math.sin(k / 12 + n)), r['market_cap'], r['volume_24h'], ts)
+        for k, ts in enumerate(times) for n, r in enumerate(records)
+    ))
+    cursor.executemany("INSERT OR IGNORE INTO scrape_times (timestamp) VALUES (?)", ((ts,) for ts in times))
+    database.rebuild_rollups(cursor)
+    conn.commit()
+    cursor.close()
+    # The current snapshot goes through the normal write path (cryptos, generation)
+    database.save_crypto_batch(records)
+    database.close_all_connections()
+    return steps * coins
+
+
+def parse_configs(value):
+    """'2x4,1x8' -> [(2, 4), (1, 8)]"""
+    configs = []
+    for part in value.split(','):
+        workers, _, threads = part.strip().lower().partition('x')
+        configs.append((int(workers), int(threads or 1)))
+    return configs
+
+
+def parse_mix(value):
+    """'cryptos=60,history=30' -> {'cryptos': 60, 'history': 30}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in READS:
+            raise ValueError(f"unknown request kind {name!r}; expected one of {', '.join(READS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# Read request kinds: name -> (rng, symbols) -> path
+READS = {
+    'cryptos': lambda rng, symbols: '/api/cryptos',
+    'history': lambda rng, symbols: (
+        f"/api/crypto/{rng.choice(symbols)}/history?range={rng.choice(('24h', '7d', '30d'))}"
+    ),
+    'history_raw': lambda rng, symbols: f"/api/crypto/{rng.choice(symbols)}/history",
+    'batch': lambda rng, symbols: '/api/history?points=24',
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _tail(path, lines=20):
+    with open(path) as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+def start_server(db_path, workers, threads, port, preload, log_path, server='gthread'):
+    """Start gunicorn on benchmarks.load_app and wait until /health answers"""
+    env = dict(
+        os.environ,
+        DATABASE_PATH=db_path,
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix='load-test-server-metrics-'),
+        MIN_REFRESH_SECONDS='0',
+        RUN_SCHEDULER='1',
+        ASGI_DB_THREADS=str(threads),
+    )
+    if server == 'asgi':
+        target = ['benchmarks.load_app:asgi_app', '-k', 'uvicorn.workers.UvicornWorker']
+    else:
+        target = ['benchmarks.load_app:app', '--threads', str(threads)]
+    cmd = [
+        sys.executable, '-m', 'gunicorn', *target,
+        '--workers', str(workers),
+        '--bind', f"127.0.0.1:{port}", '--timeout', '120',
+    ]
+    if preload:
+        cmd.append('--preload')
+    log = open(log_path, 'w')
+    # Own session, so stop_server can take down workers along with the master
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {proc.returncode}:\n{_tail(log_path)}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"gunicorn did not answer /health within 60s:\n{_tail(log_path)}")
+
+
+def stop_server(proc):
+    """Stop gunicorn; a worker stuck past the timeout is killed with the rest of the group"""
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def read_metrics(base):
+    """Counters from /metrics that show write outcomes and lock contention"""
+    totals = {'scrapes_saved': 0.0, 'scrapes_failed': 0.0, 'lock_wait_s': 0.0, 'lock_waits': 0.0}
+    text = requests.get(f"{base}/metrics", timeout=10).text
+    for line in text.splitlines():
+        m = _SAMPLE_RE.match(line)
+        if not m:
+            continue
+        name, labels, value = m.group(1), m.group(2) or '', float(m.group(3))
+        if name == 'crypto_scrape_runs_total':
+            if 'result="ok"' in labels:
+                totals['scrapes_saved'] += value
+            elif 'result="failed"' in labels:
+                totals['scrapes_failed'] += value
+        elif name == 'crypto_db_lock_wait_seconds_sum':
+            totals['lock_wait_s'] += value
+        elif name == 'crypto_db_lock_wait_seconds_count':
+            totals['lock_waits'] += value
+    return totals
+
+
+def _error_text(response):
+    """Start of the body of a failed response, None for a success"""
+    return response.text[:200] if response.status_code >= 500 else None
+
+
+def _is_busy(error):
+    return error is not None and any(marker in error for marker in BUSY_MARKERS)
+
+
+def _reader(base, mix, symbols, deadline, seed, samples):
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = 'gzip'
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        path = READS[kind](rng, symbols)
+        started = time.perf_counter()
+        try:
+            response = session.get(base + path, timeout=30)
+            status, error = response.status_code, _error_text(response)
+        except requests.RequestException as e:
+            status, error = 0, str(e)[:200]
+        samples.append((kind, (time.perf_counter() - started) * 1000, status, error))
+
+
+def _writer(base, interval, deadline, samples):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{base}/api/scrape-now", timeout=30)
+            status, error = response.status_code, _error_text(response)
+        except requests.RequestException as e:
+            status, error = 0, str(e)[:200]
+        elapsed = time.perf_counter() - started
+        samples.append(('scrape', elapsed * 1000, status, error))
+        time.sleep(max(0.0, interval - elapsed))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    summary = {f"p{pct}": round(percentile(values, pct), 2) for pct in PERCENTILES} if values else {}
+    summary['mean'] = round(sum(values) / len(values), 2) if values else None
+    summary['count'] = len(values)
+    return summary
+
+
+def run_level(base, concurrency, duration, mix, symbols, write_interval, seed):
+    """Drive `concurrency` readers (plus one writer) for `duration` seconds"""
+    before = read_metrics(base)
+    deadline = time.monotonic() + duration
+    per_thread = [[] for _ in range(concurrency + 1)]
+    threads = [
+        threading.Thread(target=_reader, args=(base, mix, symbols, deadline, seed + n, per_thread[n]))
+        for n in range(concurrency)
+    ]
+    if write_interval > 0:
+        threads.append(threading.Thread(target=_writer, args=(base, write_interval, deadline, per_thread[-1])))
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    # Let the last queued scrape land before reading the counters
+    time.sleep(min(3.0, write_interval) if write_interval > 0 else 0)
+    after = read_metrics(base)
+
+    samples = [s for thread_samples in per_thread for s in thread_samples]
+    ok = [s for s in samples if 200 <= s[2] < 400 or s[2] == 429]
+    ok_set = set(ok)
+    latency = {'all': summarize(s[1] for s in ok)}
+    for kind in sorted({s[0] for s in samples}):
+        latency[kind] = summarize(s[1] for s in ok if s[0] == kind)
+    reads = sum(1 for s in samples if s[0] != 'scrape')
+    return {
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'read_rps': round(reads / elapsed, 1),
+        'latency_ms': latency,
+        'errors': len(samples) - len(ok),
+        # Status 0 means the request never got a response (timeout or refused)
+        'error_statuses': dict(Counter(str(s[2]) for s in samples if s not in ok_set)),
+        'busy_errors': sum(1 for s in samples if _is_busy(s[3])),
+        # A few distinct failure messages, to tell lock contention from other faults
+        'error_samples': sorted({f"{s[0]} {s[2]}: {s[3]}" for s in samples if s not in ok_set})[:5],
+        'scrapes_saved': int(after['scrapes_saved'] - before['scrapes_saved']),
+        'scrapes_failed': int(after['scrapes_failed'] - before['scrapes_failed']),
+        'lock_wait_s': round(after['lock_wait_s'] - before['lock_wait_s'], 4),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    print(f"{'config':<8}{'conc':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'errors':>8}{'busy':>6}{'saves':>7}{'lock s':>9}")
+    for r in results:
+        lat = r['latency_ms']['all']
+        print(f"{r['config']:<8}{r['concurrency']:>6}{r['throughput_rps']:>9.1f}"
+              f"{lat.get('p50', 0):>9.1f}{lat.get('p95', 0):>9.1f}{lat.get('p99', 0):>9.1f}"
+              f"{r['errors']:>8}{r['busy_errors'] + r['scrapes_failed']:>6}{r['scrapes_saved']:>7}"
+              f"{r['lock_wait_s']:>9.3f}")
+
+
+def print_comparison(results, previous):
+    """Throughput and p95 against an earlier results file, per config and concurrency"""
+    old = {(r['config'], r['concurrency']): r for r in previous['results']}
+    meta = previous['meta']
+    print(f"\nCompared with {meta.get('saved_at')} ({meta.get('commit') or 'unknown commit'}, "
+          f"{meta.get('args', {}).get('server', 'gthread')}):")
+    print(f"{'config':<8}{'conc':>6}{'req/s':>18}{'p95 ms':>20}{'busy':>10}")
+    for r in results:
+        before = old.get((r['config'], r['concurrency']))
+        if before is None:
+            continue
+        rps, old_rps = r['throughput_rps'], before['throughput_rps']
+        p95, old_p95 = r['latency_ms']['all'].get('p95', 0), before['latency_ms']['all'].get('p95', 0)
+        busy = r['busy_errors'] + r['scrapes_failed']
+        old_busy = before['busy_errors'] + before['scrapes_failed']
+        rps_delta = f"{(rps / old_rps - 1) * 100:+.0f}%" if old_rps else 'n/a'
+        p95_delta = f"{(p95 / old_p95 - 1) * 100:+.0f}%" if old_p95 else 'n/a'
+        print(f"{r['config']:<8}{r['concurrency']:>6}{rps:>11.1f} {rps_delta:>6}"
+              f"{p95:>13.1f} {p95_delta:>6}{old_busy:>5}->{busy:<4}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coins', type=int, default=100, help='tracked coins (TOP_N for the stub scraper)')
+    parser.add_argument('--days', type=int, default=7, help='days of seeded history')
+    parser.add_argument('--interval', type=int, default=10, help='minutes between seeded scrapes')
+    parser.add_argument('--configs', default='2x4', help='gunicorn WORKERSxTHREADS, comma separated')
+    parser.add_argument('--concurrency', default='8,32', help='concurrent clients, comma separated')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds per concurrency level')
+    parser.add_argument('--mix', default='cryptos=60,history=25,history_raw=5,batch=10',
+                        help=f"read weights over {', '.join(READS)}")
+    parser.add_argument('--write-interval', type=float, default=2.0,
+                        help='seconds between manual scrapes (0 disables writes)')
+    parser.add_argument('--preload', action=argparse.BooleanOptionalAction, default=True,
+                        help='start gunicorn with --preload, as render.yaml does')
+    parser.add_argument('--server', choices=('gthread', 'asgi'), default='gthread',
+                        help='gthread workers on the Flask app, or uvicorn workers on asgi.py (needs uvicorn)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='results file (default benchmarks/results/load-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    configs = parse_configs(args.configs)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    symbols = [coin_record(i)['symbol'] for i in range(1, args.coins + 1)]
+    os.environ['TOP_N'] = str(args.coins)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded = os.path.join(tmp, 'seed.db')
+        started = time.perf_counter()
+        rows = seed_database(seeded, args.coins, args.days, args.interval)
+        print(f"🌱 Seeded {args.coins} coins, {rows} history rows in {time.perf_counter() - started:.1f}s")
+
+        for workers, threads in configs:
+            name = f"{workers}x{threads}"
+            # Every configuration starts from the same data
+            db_path = os.path.join(tmp, f"{name}.db")
+            shutil.copy(seeded, db_path)
+            port = free_port()
+            log_path = os.path.join(tmp, f"{name}.log")
+            print(f"🚀 gunicorn {name} ({args.server}) on port {port}")
+            proc = start_server(db_path, workers, threads, port, args.preload, log_path, args.server)
+            base = f"http://127.0.0.1:{port}"
+            try:
+                # Warm every cache and code path once before measuring
+                warm = random.Random(args.seed)
+                for kind in mix:
+                    requests.get(base + READS[kind](warm, symbols), timeout=30)
+                for level in levels:
+                    result = run_level(base, level, args.duration, mix, symbols,
+                                       args.write_interval, args.seed)
+                    result.update(config=name, workers=workers, threads=threads, server=args.server)
+                    results.append(result)
+                    print(f"   {level} clients: {result['throughput_rps']} req/s, "
+                          f"p95 {result['latency_ms']['all'].get('p95')} ms, "
+                          f"{result['errors']} errors, {result['busy_errors']} busy")
+            finally:
+                stop_server(proc)
+
+    print()
+    print_report(results)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    payload = {
+        'meta': {
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'cpus': os.cpu_count(),
+            'python': sys.version.split()[0],
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(out, 'w') as f:
+        json.dump(payload, f, indent=2)
+    print(f"\n💾 Results written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
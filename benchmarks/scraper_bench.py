@@ -0,0 +1,426 @@
+"""
+Offline benchmark for the scrape pipeline: fetch -> parse -> save -> prune,
+plus the repeat fetches the scraper short-circuits (a 304, and a 200 whose
+listing table hashes the same as last time).
+
+Replays generated and recorded listing pages through the scraper's own
+fetch_listing/_page_records path with a local stub in place of the HTTP
+client, so nothing touches coingecko.com.
+
+    python -m benchmarks.scraper_bench --against main     # gate: this tree vs a git ref, same host
+    python -m benchmarks.scraper_bench                    # report, vs a local baseline
+    python -m benchmarks.scraper_bench --update-baseline  # store a local baseline
+    python -m benchmarks.scraper_bench --record           # save the live page as a fixture
+
+Timings are only comparable on one machine, so --against checks out the ref
+into a temporary git worktree and benches it and this tree side by side,
+alternating every iteration. Exits with status 1 when any stage is slower than the reference by
+more than --tolerance, and 2 when there is no reference to compare against.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+# Keep the benchmark's metric samples out of a running server's shared directory
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='scraper-bench-metrics-')
+
+import database  # noqa: E402
+import scraper  # noqa: E402
+from benchmarks.fixtures import FIXTURE_DIR, StubResponse, builtin_fixtures, recorded_fixtures  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scraper_baseline.json')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ('fetch', 'parse', 'save', 'prune', 'not_modified', 'unchanged')
+
+
+@contextlib.contextmanager
+def stub_http(content, status_code=200):
+    """Serve `content` (with a fixed ETag) or a bare status for every HTTP GET the scraper makes"""
+    original = requests.Session.get
+    requests.Session.get = lambda self, *args, **kwargs: StubResponse(
+        content, status_code, {'ETag': '"bench"', 'Last-Modified': 'Thu, 01 Jan 2026 00:00:00 GMT'})
+    try:
+        yield
+    finally:
+        requests.Session.get = original
+
+
+@contextlib.contextmanager
+def scratch_database():
+    """Point the database module at a fresh temporary file"""
+    original = database.DATABASE_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        database.close_all_connections()
+        database.DATABASE_PATH = os.path.join(tmp, 'bench.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.init_db()
+        try:
+            yield
+        finally:
+            database.close_all_connections()
+            database.DATABASE_PATH = original
+
+
+@contextlib.contextmanager
+def scraper_limit(limit):
+    """Parse up to `limit` coins, the way the scraper would with TOP_N = limit"""
+    original = scraper.TOP_N
+    scraper.TOP_N = limit
+    scraper._page_state.clear()
+    try:
+        yield
+    finally:
+        scraper.TOP_N = original
+        scraper._page_state.clear()
+
+
+def _conditional_fetch(status_code, content):
+    """One fetch_listing + _page_records round for a page seen before: a 304, or a 200 whose table hashes the same"""
+    with stub_http(content, status_code):
+        resp, status, _ = scraper.fetch_listing(scraper.URL)
+        records, _, unchanged = scraper._page_records(scraper.URL, resp, status)
+    if not unchanged:
+        raise RuntimeError(f"a repeat {status_code} was parsed again instead of short-circuiting")
+    return records
+
+
+def nudge_prices(records, tick):
+    """
+    Move every price a little, as load_app's pages do, so each iteration
+    saves a new snapshot instead of only extending the previous run
+    """
+    for i, r in enumerate(records):
+        r['price'] *= 1 + ((tick * 7 + i) % 11 - 5) / 1000
+    return records
+
+
+def run_pipeline(content, limit, tick=0):
+    """Run each stage once through the scraper's own fetch path; return ({stage: seconds}, rows_parsed)"""
+    timings = {}
+    quiet = io.StringIO()
+    with stub_http(content), contextlib.redirect_stdout(quiet):
+        # A first sight of the page: no validators yet, so it is parsed in full
+        scraper._page_state.clear()
+        started = time.perf_counter()
+        resp, status, _ = scraper.fetch_listing(scraper.URL)
+        timings['fetch'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        records, _, _ = scraper._page_records(scraper.URL, resp, status)
+        timings['parse'] = time.perf_counter() - started
+        records = nudge_prices([dict(r) for r in records], tick)
+
+        started = time.perf_counter()
+        database.save_crypto_batch(records)
+        timings['save'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        database.prune_cryptos([r['symbol'] for r in records])
+        timings['prune'] = time.perf_counter() - started
+
+    for stage, status_code in (('not_modified', 304), ('unchanged', 200)):
+        started = time.perf_counter()
+        _conditional_fetch(status_code, content)
+        timings[stage] = time.perf_counter() - started
+    return timings, len(records)
+
+
+def peak_memory(content, limit, tick):
+    """Peak extra allocation (bytes) per stage, measured in a separate traced pass"""
+    peaks = {}
+    quiet = io.StringIO()
+
+    @contextlib.contextmanager
+    def traced(stage):
+        # Collect first so BeautifulSoup's parent/child cycles from the last stage are gone
+        gc.collect()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        yield
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - start
+
+    with stub_http(content), contextlib.redirect_stdout(quiet):
+        scraper._page_state.clear()
+        tracemalloc.start()
+        try:
+            with traced('fetch'):
+                resp, status, _ = scraper.fetch_listing(scraper.URL)
+            with traced('parse'):
+                records, _, _ = scraper._page_records(scraper.URL, resp, status)
+            records = nudge_prices([dict(r) for r in records], tick)
+            with traced('save'):
+                database.save_crypto_batch(records)
+            with traced('prune'):
+                database.prune_cryptos([r['symbol'] for r in records])
+            with traced('not_modified'):
+                _conditional_fetch(304, content)
+            with traced('unchanged'):
+                _conditional_fetch(200, content)
+        finally:
+            tracemalloc.stop()
+    return peaks
+
+
+def summarise(content, parsed, samples, peaks):
+    """Reduce one fixture's per-stage samples (seconds) and peaks (bytes) to its report entry"""
+    result = {'bytes': len(content), 'rows': parsed, 'stages': {}}
+    for stage in STAGES:
+        median = statistics.median(samples[stage])
+        result['stages'][stage] = {
+            'median_ms': round(median * 1000, 3),
+            'min_ms': round(min(samples[stage]) * 1000, 3),
+            'peak_kib': round(peaks[stage] / 1024, 1)
+        }
+    parse_s = statistics.median(samples['parse'])
+    result['rows_per_sec'] = round(parsed / parse_s, 1) if parse_s else None
+    return result
+
+
+def bench_fixture(name, content, rows, repeats):
+    # Recorded pages have an unknown row count; parse everything they contain
+    limit = rows or 10 ** 6
+    samples = {stage: [] for stage in STAGES}
+    parsed = 0
+    with scratch_database(), scraper_limit(limit):
+        for tick in range(1, repeats + 1):
+            timings, parsed = run_pipeline(content, limit, tick)
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+        peaks = peak_memory(content, limit, repeats + 1)
+    return summarise(content, parsed, samples, peaks)
+
+
+def serve_worker():
+    """
+    Run pipeline iterations on request for --against: one JSON command per
+    stdin line ('open' a fixture, 'run' one tick, 'close' it), one JSON reply
+    per stdout line.
+    """
+    replies = sys.stdout
+    sys.stdout = sys.stderr  # keep stray prints off the reply channel
+    fixture = None
+    for line in sys.stdin:
+        cmd = json.loads(line)
+        reply = {}
+        if cmd['op'] == 'open':
+            with open(cmd['path'], 'rb') as f:
+                content = f.read()
+            stack = contextlib.ExitStack()
+            stack.enter_context(scratch_database())
+            stack.enter_context(scraper_limit(cmd['limit']))
+            fixture = (content, cmd['limit'], stack)
+        elif cmd['op'] == 'run':
+            reply['timings'], reply['rows'] = run_pipeline(fixture[0], fixture[1], cmd['tick'])
+        elif cmd['op'] == 'close':
+            reply['peaks'] = peak_memory(fixture[0], fixture[1], cmd['tick'])
+            fixture[2].close()
+            fixture = None
+        replies.write(json.dumps(reply) + '\n')
+        replies.flush()
+    return 0
+
+
+# Runs this file's harness as __main__ with the code under test (database,
+# scraper) importable from the worker's working directory
+WORKER_BOOT = "import runpy, sys; path = sys.argv[1]; sys.argv = [path, '--worker']; runpy.run_path(path, run_name='__main__')"
+
+
+def _start_worker(code_dir):
+    return subprocess.Popen([sys.executable, '-c', WORKER_BOOT, os.path.abspath(__file__)],
+                            cwd=code_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+
+def _ask(worker, **cmd):
+    worker.stdin.write(json.dumps(cmd) + '\n')
+    worker.stdin.flush()
+    line = worker.stdout.readline()
+    if not line:
+        raise RuntimeError(f"bench worker exited with status {worker.wait()}")
+    return json.loads(line)
+
+
+def _stop_worker(worker):
+    try:
+        worker.stdin.close()
+    except OSError:
+        pass
+    try:
+        worker.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        worker.kill()
+        worker.wait()
+
+
+def bench_against(ref, repeats):
+    """
+    Bench git `ref` and this tree side by side on this host. Each side's code
+    runs in its own long-lived worker, and every tick of every fixture is run
+    by both back to back, so the two see the same machine at the same moment
+    rather than rounds many seconds apart. Both sides replay this tree's
+    fixtures through this tree's harness. Returns (ours, theirs); each of
+    our stages also carries the median of the per-tick ours/theirs ratios.
+    """
+    fixtures = builtin_fixtures() + recorded_fixtures()
+    with tempfile.TemporaryDirectory(prefix='scraper-bench-') as tmp:
+        base_dir = os.path.join(tmp, 'base')
+        subprocess.run(['git', 'worktree', 'add', '--detach', '--quiet', base_dir, ref], cwd=REPO_DIR, check=True)
+        workers = {}
+        try:
+            workers = {'theirs': _start_worker(base_dir), 'ours': _start_worker(REPO_DIR)}
+            results = {side: {} for side in workers}
+            for i, (name, content, rows) in enumerate(fixtures):
+                path = os.path.join(tmp, f'fixture-{i}.html')
+                with open(path, 'wb') as f:
+                    f.write(content)
+                limit = rows or 10 ** 6
+                samples = {side: {stage: [] for stage in STAGES} for side in workers}
+                parsed = {}
+                for worker in workers.values():
+                    _ask(worker, op='open', path=path, limit=limit)
+                for tick in range(1, repeats + 1):
+                    # Alternate who goes first so neither side always runs in the other's wake
+                    order = list(workers) if tick % 2 else list(reversed(list(workers)))
+                    for side in order:
+                        reply = _ask(workers[side], op='run', tick=tick)
+                        parsed[side] = reply['rows']
+                        for stage in STAGES:
+                            samples[side][stage].append(reply['timings'][stage])
+                for side, worker in workers.items():
+                    peaks = _ask(worker, op='close', tick=repeats + 1)['peaks']
+                    results[side][name] = summarise(content, parsed[side], samples[side], peaks)
+                for stage in STAGES:
+                    ratios = [ours / max(theirs, 1e-9) for ours, theirs in
+                              zip(samples['ours'][stage], samples['theirs'][stage])]
+                    results['ours'][name]['stages'][stage]['paired_ratio'] = round(statistics.median(ratios), 3)
+        finally:
+            for worker in workers.values():
+                _stop_worker(worker)
+            subprocess.run(['git', 'worktree', 'remove', '--force', base_dir], cwd=REPO_DIR, check=False)
+    return results['ours'], results['theirs']
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """
+    Return a list of human-readable regressions against the baseline. Stages
+    are compared on their fastest sample, which a busy or throttled host
+    disturbs far less than the median (older results only have the median).
+    With --against a stage must also be slower tick for tick: one side
+    missing the host's fast moments moves the minimum but not the paired
+    ratio, while a real slowdown moves both.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for stage, stats in result['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if not base_stats:
+                continue
+            base_ms = base_stats.get('min_ms', base_stats['median_ms'])
+            now_ms = stats.get('min_ms', stats['median_ms'])
+            if 'paired_ratio' in stats and stats['paired_ratio'] <= 1 + tolerance:
+                continue
+            if now_ms > base_ms * (1 + tolerance) and now_ms - base_ms > min_ms:
+                regressions.append(f"{name}/{stage}: {now_ms:.2f} ms vs baseline {base_ms:.2f} ms")
+    return regressions
+
+
+def print_report(results):
+    widths = {s: max(11, len(s) + 5) for s in STAGES}
+    print(f"{'fixture':<16}{'rows':>6}{'KiB':>8}  " + ''.join(f"{s + ' ms':>{widths[s]}}{'peak KiB':>10}" for s in STAGES) + f"{'rows/s':>11}")
+    for name, r in results.items():
+        cells = ''.join(f"{r['stages'][s]['median_ms']:>{widths[s]}.2f}{r['stages'][s]['peak_kib']:>10.1f}" for s in STAGES)
+        print(f"{name:<16}{r['rows']:>6}{r['bytes'] / 1024:>8.1f}  {cells}{r['rows_per_sec'] or 0:>11.0f}")
+
+
+def record_live_page():
+    """Save the current CoinGecko homepage into fixtures/ for later replay"""
+    scraper._page_state.clear()
+    resp, status, _ = scraper.fetch_listing(scraper.URL)
+    if status != 'modified':
+        return 1
+    content = resp.content
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(FIXTURE_DIR, time.strftime('coingecko-%Y%m%d-%H%M%S.html'))
+    with open(path, 'wb') as f:
+        f.write(content)
+    print(f"💾 Recorded {len(content)} bytes to {path}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown ratio per stage')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='ignore regressions smaller than this')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--against', metavar='REF', help='compare with this git ref, benched on this host')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return serve_worker()
+    if args.record:
+        return record_live_page()
+
+    if not recorded_fixtures():
+        print(f"⚠️ No recorded pages in {FIXTURE_DIR}; parse timings cover generated markup only "
+              "(add one with --record)")
+
+    if args.against:
+        results, baseline = bench_against(args.against, args.repeats)
+        print(f"Reference ({args.against}):")
+        print_report(baseline)
+        print("This tree:")
+        print_report(results)
+        return _report_regressions(compare(results, baseline, args.tolerance, args.min_ms))
+
+    results = {}
+    for name, content, rows in builtin_fixtures() + recorded_fixtures():
+        results[name] = bench_fixture(name, content, rows, args.repeats)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📌 Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"❌ No baseline at {args.baseline}; use --against REF, or --update-baseline on a known-good commit")
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return _report_regressions(compare(results, baseline, args.tolerance, args.min_ms))
+
+
+def _report_regressions(regressions):
+    for line in regressions:
+        print(f"❌ Regression {line}")
+    if regressions:
+        return 1
+    print("✅ No stage regressed past the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
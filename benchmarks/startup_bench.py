@@ -0,0 +1,171 @@
+"""
+Startup benchmark: how long a fresh worker takes to import the app, build it
+and answer its first request.
+
+Each sample runs in a new interpreter (that is what a gunicorn boot or a
+Render cold start pays), once against an empty database (schema migration
+included) and once against an already migrated one.
+
+    python -m benchmarks.startup_bench                    # report
+    python -m benchmarks.startup_bench --update-baseline  # store new baseline
+
+Exits with status 1 when any timing is slower than the stored baseline by more
+than --tolerance, or when importing `app` pulls in the scraping stack, and 2
+when there is no baseline to compare against.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Keep the benchmark's metric samples out of a running server's shared directory
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='startup-bench-metrics-')
+
+import database  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_baseline.json')
+TIMINGS = ('process_ms', 'import_ms', 'create_ms', 'first_response_ms')
+# Modules only the scraping process should ever load
+HEAVY_MODULES = ('requests', 'bs4', 'lxml', 'apscheduler', 'scraper', 'extract')
+
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+heavy = [m for m in %r if m in sys.modules]
+flask_app = app.create_app(run_scheduler=False)
+created = time.perf_counter()
+status = flask_app.test_client().get('/api/cryptos').status_code
+answered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'first_response_ms': (answered - created) * 1000,
+    'status': status,
+    'heavy_modules': heavy,
+}))
+''' % (HEAVY_MODULES,)
+
+
+def seed_database(path, coins=100):
+    """Create a migrated database holding one snapshot of `coins` synthetic rows"""
+    database.close_all_connections()
+    database.DATABASE_PATH = path
+    database.init_db()
+    database.save_crypto_batch([{
+        'symbol': f"C{i:03d}",
+        'name': f"Coin {i}",
+        'price': 1000.0 / (i + 1),
+        'market_cap': 1e12 / (i + 1),
+        'volume_24h': 1e10 / (i + 1),
+        'change_24h': 0.0,
+        'change_dir': 'flat',
+        'image_url': ''
+    } for i in range(coins)])
+    database.close_all_connections()
+
+
+def run_child(db_path):
+    """Start one interpreter, returning its timings plus total process wall time"""
+    env = dict(os.environ, DATABASE_PATH=db_path, RUN_SCHEDULER='0')
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', _CHILD], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    elapsed = (time.perf_counter() - started) * 1000
+    result = json.loads(out.strip().splitlines()[-1])
+    result['process_ms'] = elapsed
+    return result
+
+
+def bench_scenario(name, repeats, tmp):
+    """Median timings for `repeats` cold starts against a fresh or migrated database"""
+    db_path = os.path.join(tmp, f"{name}.db")
+    samples = []
+    if name == 'migrated-db':
+        seed_database(db_path)
+    for _ in range(repeats):
+        if name == 'fresh-db':
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+        samples.append(run_child(db_path))
+    result = {key: round(statistics.median(s[key] for s in samples), 2) for key in TIMINGS}
+    result['status'] = samples[-1]['status']
+    result['heavy_modules'] = sorted({m for s in samples for m in s['heavy_modules']})
+    return result
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Return a list of human-readable regressions against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        for key in TIMINGS:
+            if key not in base:
+                continue
+            if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > min_ms:
+                regressions.append(f"{name}/{key}: {result[key]:.1f} ms vs baseline {base[key]:.1f} ms")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'scenario':<14}" + ''.join(f"{key:>19}" for key in TIMINGS) + "  heavy imports")
+    for name, r in results.items():
+        cells = ''.join(f"{r[key]:>19.1f}" for key in TIMINGS)
+        print(f"{name:<14}{cells}  {', '.join(r['heavy_modules']) or '-'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown ratio per timing')
+    parser.add_argument('--min-ms', type=float, default=10.0, help='ignore regressions smaller than this')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {name: bench_scenario(name, args.repeats, tmp) for name in ('fresh-db', 'migrated-db')}
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    for name, r in results.items():
+        if r['heavy_modules']:
+            print(f"❌ {name}: importing app loaded {', '.join(r['heavy_modules'])}")
+            failed = True
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📌 Baseline written to {args.baseline}")
+        return 1 if failed else 0
+
+    if not os.path.exists(args.baseline):
+        print(f"❌ No baseline at {args.baseline}; run with --update-baseline on a known-good commit")
+        return 1 if failed else 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+    for line in regressions:
+        print(f"❌ Regression {line}")
+    if regressions or failed:
+        return 1
+    print("✅ Startup is within the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+from database import add_commit_listener, get_generation
+from metrics import CACHE_LOOKUPS
+
+# How often (seconds) a worker re-reads the DB generation stamp to notice
+# snapshots committed by another process
+try:
+    SNAPSHOT_CHECK_SECONDS = float(os.environ.get("SNAPSHOT_CHECK_SECONDS", "2"))
+except ValueError:
+    SNAPSHOT_CHECK_SECONDS = 2.0
+
+
+# Encodings we can precompress, in server preference order
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class Snapshot:
+    """An immutable, ready-to-serve view of one committed scrape"""
+
+    __slots__ = ('generation', 'data', 'body', 'etag', '_encoded', '_lock')
+
+    def __init__(self, generation, data, body):
+        self.generation = generation
+        self.data = data
+        self.body = body
+        # Strong validator from the bytes themselves, so every worker agrees on it
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_data(cls, generation, data):
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        return cls(generation, data, body)
+
+    def encoded(self, encoding):
+        """Return the body compressed with encoding ('gzip' or 'br'), built once"""
+        body = self._encoded.get(encoding)
+        if body is None:
+            with self._lock:
+                body = self._encoded.get(encoding)
+                if body is None:
+                    if encoding == 'br':
+                        body = brotli.compress(self.body)
+                    else:
+                        body = gzip.compress(self.body, compresslevel=6, mtime=0)
+                    self._encoded[encoding] = body
+        return body
+
+
+class SnapshotCache:
+    """
+    Holds the latest built snapshot and rebuilds it only when the generation
+    changes. Commits from this process invalidate it immediately through the
+    database commit listener; commits from other workers are picked up by
+    checking the generation stamp at most every SNAPSHOT_CHECK_SECONDS.
+    """
+
+    def __init__(self, builder, name='snapshot', check_seconds=SNAPSHOT_CHECK_SECONDS):
+        self._builder = builder
+        self._hit_counter = CACHE_LOOKUPS.labels(name, 'hit')
+        self._miss_counter = CACHE_LOOKUPS.labels(name, 'miss')
+        self._check_seconds = check_seconds
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        add_commit_listener(self._on_commit)
+
+    def _on_commit(self, generation):
+        self._dirty = True
+
+    def invalidate(self):
+        self._dirty = True
+
+    def peek(self):
+        """Return the current Snapshot if it can be served without touching the database, else None"""
+        snap = self._snapshot
+        if snap is not None and not self._dirty and time.monotonic() - self._checked_at < self._check_seconds:
+            self.hits += 1
+            self._hit_counter.inc()
+            return snap
+        return None
+
+    def get(self):
+        """Return the current Snapshot, rebuilding it if the data changed"""
+        snap = self.peek()
+        if snap is not None:
+            return snap
+
+        with self._lock:
+            generation = get_generation()
+            snap = self._snapshot
+            if snap is None or snap.generation != generation or self._dirty:
+                # Clear the flag first so a commit during the build marks us stale again
+                self._dirty = False
+                snap = Snapshot.from_data(generation, self._builder())
+                self._snapshot = snap
+                self.misses += 1
+                self._miss_counter.inc()
+            else:
+                self.hits += 1
+                self._hit_counter.inc()
+            self._checked_at = time.monotonic()
+            return snap
+
+
+class KeyedSnapshotCache:
+    """
+    Per-key snapshots (e.g. one per symbol) that live for a single generation
+    of a parent SnapshotCache. Everything is dropped when the generation moves.
+    """
+
+    def __init__(self, builder, parent, name='keyed', max_entries=256):
+        self._builder = builder
+        self._hit_counter = CACHE_LOOKUPS.labels(name, 'hit')
+        self._miss_counter = CACHE_LOOKUPS.labels(name, 'miss')
+        self._parent = parent
+        self._max_entries = max_entries
+        self._generation = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._parent.get().generation
+
+    def peek(self, key):
+        """Return the snapshot for key if it is built and current without a database read, else None"""
+        parent = self._parent.peek()
+        if parent is None:
+            return None
+        with self._lock:
+            if parent.generation != self._generation:
+                return None
+            snap = self._entries.get(key)
+        if snap is not None:
+            self._hit_counter.inc()
+        return snap
+
+    def get(self, key):
+        generation = self.generation()
+        with self._lock:
+            if generation != self._generation:
+                self._entries = {}
+                self._generation = generation
+            snap = self._entries.get(key)
+        if snap is not None:
+            self._hit_counter.inc()
+        else:
+            self._miss_counter.inc()
+            snap = Snapshot.from_data(generation, self._builder(key))
+            with self._lock:
+                if self._generation == generation:
+                    if len(self._entries) >= self._max_entries:
+                        self._entries.pop(next(iter(self._entries)))
+                    self._entries[key] = snap
+        return snap
@@ -0,0 +1,51 @@
+import functools
+import os
+import socket
+import uuid
+
+from database import acquire_lease, release_lease
+
+# Only the process holding this lease runs scheduled scrapes and maintenance
+SCRAPER_LEASE = 'scraper'
+
+try:
+    # A dead holder is replaced after this long; renewed every LEASE_RENEW_SECONDS
+    LEASE_TTL_SECONDS = int(os.environ.get("LEASE_TTL_SECONDS", "90"))
+except ValueError:
+    LEASE_TTL_SECONDS = 90
+LEASE_RENEW_SECONDS = max(1, LEASE_TTL_SECONDS // 3)
+
+_holder_id = None
+_holder_pid = None
+
+
+def holder_id():
+    """Identity of this process (regenerated after fork so workers never share it)"""
+    global _holder_id, _holder_pid
+    if _holder_pid != os.getpid():
+        _holder_pid = os.getpid()
+        _holder_id = f"{socket.gethostname()}:{_holder_pid}:{uuid.uuid4().hex[:8]}"
+    return _holder_id
+
+
+def renew_lease():
+    """Take or keep the scraper lease; returns True while this process is the leader"""
+    return acquire_lease(SCRAPER_LEASE, holder_id(), LEASE_TTL_SECONDS)
+
+
+def release():
+    """Hand the lease back on shutdown so another process can take over at once"""
+    try:
+        release_lease(SCRAPER_LEASE, holder_id())
+    except Exception:
+        pass
+
+
+def leader_only(func):
+    """Run the wrapped job only in the process that holds the scraper lease"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not renew_lease():
+            return None
+        return func(*args, **kwargs)
+    return wrapper
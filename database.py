@@ -1,21 +1,144 @@
 import sqlite3
+import threading
+import time
+import weakref
 from datetime import datetime
 import os
 
+import analytics
+from history_buffer import RecentHistory
+from metrics import db_timed, begin_immediate, ROWS_WRITTEN, SCRAPE_STAGE_SECONDS
+
 # Allow overriding DB path via environment variable for deployments
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'crypto_data.db')
 
-def get_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+# Connection tuning (milliseconds to wait on a locked DB, page cache size in KiB)
+DB_BUSY_TIMEOUT_MS = _env_int('DB_BUSY_TIMEOUT_MS', 5000)
+DB_CACHE_SIZE_KB = _env_int('DB_CACHE_SIZE_KB', 8192)
+# Recent points kept in memory per symbol (32 bytes each; 0 turns the buffer off)
+HISTORY_BUFFER_POINTS = max(0, _env_int('HISTORY_BUFFER_POINTS', 1008))
+# Bulk export: rows per fetchmany() batch, and rows per query before it is
+# reissued from the last key (so a long export never pins one WAL snapshot)
+EXPORT_BATCH_ROWS = max(1, _env_int('EXPORT_BATCH_ROWS', 1000))
+EXPORT_CHUNK_ROWS = max(1, _env_int('EXPORT_CHUNK_ROWS', 50000))
+
+class _Connection(sqlite3.Connection):
+    """A connection that can be weakly referenced (the built-in type cannot)"""
+
+class _ThreadToken:
+    """Lives in a thread's locals; when the thread ends it is freed and its connection closed"""
+
+# One long-lived connection per thread. Tracked weakly so they can all be
+# closed on exit, while a finished thread's connection closes with the thread.
+_local = threading.local()
+_connections = weakref.WeakSet()
+_connections_lock = threading.Lock()
+# Connections inherited across fork: closing them in the child could drop
+# locks SQLite holds for the file in this process, so they are only kept
+_inherited = []
+# Bumped by close_all_connections so every thread reopens lazily afterwards
+_pool_epoch = 0
+
+def _open_connection():
+    """Open and configure a new SQLite connection"""
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        check_same_thread=False,
+        factory=_Connection
+    )
+    conn.owner_pid = os.getpid()
     conn.row_factory = sqlite3.Row
+    # Let retention hand freed pages back with incremental_vacuum. Only takes
+    # effect on a new database, and only if set before switching to WAL.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets API readers run while the scraper writes; NORMAL is durable enough under WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    return conn
+
+def get_connection():
+    """Return the calling thread's database connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    # A connection inherited across fork (gunicorn --preload) must not be reused
+    if (conn is None or getattr(_local, 'pid', None) != os.getpid()
+            or getattr(_local, 'epoch', None) != _pool_epoch):
+        if conn is not None and getattr(_local, 'pid', None) != os.getpid():
+            _local.closer.detach()
+            _inherited.append(conn)
+        conn = _open_connection()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.epoch = _pool_epoch
+        _local.token = _ThreadToken()
+        _local.closer = weakref.finalize(_local.token, _close_quietly, conn)
+        # At exit close_all_connections does this; a forked child must not
+        _local.closer.atexit = False
+        with _connections_lock:
+            _connections.add(conn)
     return conn
 
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def close_all_connections():
+    """Close every connection opened by this process (shutdown hook)"""
+    global _pool_epoch
+    pid = os.getpid()
+    with _connections_lock:
+        # Handles inherited from a parent process belong to the parent
+        conns = [c for c in _connections if c.owner_pid == pid]
+        _connections.clear()
+        _pool_epoch += 1
+    for conn in conns:
+        _close_quietly(conn)
+
+# Bump and append to _MIGRATIONS whenever the schema changes
+SCHEMA_VERSION = 6
+
+@db_timed
 def init_db():
-    """Initialize the database with required tables"""
+    """
+    Bring the schema up to SCHEMA_VERSION, tracked in PRAGMA user_version.
+    Once the database is current this is a single PRAGMA read.
+    """
     conn = get_connection()
     cursor = conn.cursor()
-    
+    try:
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return False
+
+        # Workers starting together migrate one at a time; later ones see the new version
+        begin_immediate(cursor, 'init_db')
+        cursor.execute("PRAGMA user_version")
+        current = cursor.fetchone()[0]
+        for version, migrate in _MIGRATIONS:
+            if version > current:
+                migrate(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    print(f"✅ Database schema at version {SCHEMA_VERSION}")
+    return True
+
+def _migrate_v1(cursor):
+    """Baseline schema; idempotent so databases created before versioning upgrade in place"""
     # Create cryptos table for latest prices
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS cryptos (
@@ -51,70 +174,601 @@ def init_db():
             market_cap REAL,
             volume_24h REAL,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            run_until TIMESTAMP,
             FOREIGN KEY (symbol) REFERENCES cryptos (symbol)
         )
     ''')
-    
+
+    # Migration: run_until marks a row whose values stayed unchanged up to that scrape
+    cursor.execute("PRAGMA table_info(price_history)")
+    if 'run_until' not in [r[1] for r in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE price_history ADD COLUMN run_until TIMESTAMP")
+
+    # One row per committed scrape; expands run-length history rows into points
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_times (
+            timestamp TIMESTAMP PRIMARY KEY
+        ) WITHOUT ROWID
+    ''')
+
+    # Full per-scrape series: stored rows plus the repeats each run stands for
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS price_points AS
+        SELECT id, symbol, price, market_cap, volume_24h, timestamp
+        FROM price_history
+        UNION ALL
+        SELECT h.id, h.symbol, h.price, h.market_cap, h.volume_24h, s.timestamp
+        FROM price_history h
+        JOIN scrape_times s ON s.timestamp > h.timestamp AND s.timestamp <= h.run_until
+        WHERE h.run_until IS NOT NULL
+    ''')
+
     # Create index for faster queries
     cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_symbol_timestamp 
         ON price_history (symbol, timestamp)
     ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database initialized successfully")
 
-def save_crypto_data(crypto_data):
-    """Save or update cryptocurrency data"""
+    # Retention scans by age across all symbols
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_timestamp
+        ON price_history (timestamp)
+    ''')
+
+    # Small key/value table; 'generation' is bumped on every committed snapshot
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # Named leases with expiry, used to elect a single scraper across processes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+    # Manual scrape requests; concurrent triggers share one queued/running row
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            requested_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            requests INTEGER NOT NULL DEFAULT 1,
+            error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scrape_jobs_status
+        ON scrape_jobs (status, finished_at)
+    ''')
+
+    # OHLC rollups per symbol and tier, clustered by (symbol, resolution, bucket)
+    # so one series is a contiguous range scan
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_rollups (
+            symbol TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume_24h REAL,
+            market_cap REAL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (symbol, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+
+    # Seed rollups from raw history the first time the table exists
+    cursor.execute("SELECT 1 FROM price_rollups LIMIT 1")
+    if cursor.fetchone() is None:
+        rebuild_rollups(cursor)
+
+def _migrate_v2(cursor):
+    """One row per scrape run: fetch timing and whether the listing changed"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            outcome TEXT NOT NULL,
+            fetch_ms REAL,
+            pages INTEGER,
+            pages_not_modified INTEGER,
+            pages_unchanged INTEGER,
+            bytes INTEGER,
+            records INTEGER
+        )
+    ''')
+
+def _migrate_v3(cursor):
+    """Rolling per-symbol stats (one row per symbol and window), backfilled from history"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crypto_stats (
+            symbol TEXT NOT NULL,
+            span TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            sma REAL,
+            high REAL,
+            low REAL,
+            return_pct REAL,
+            volatility_pct REAL,
+            updated_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (symbol, span)
+        ) WITHOUT ROWID
+    ''')
+    analytics.rebuild_stats(cursor)
+
+def _migrate_v4(cursor):
+    """Index run ends so other processes can find runs extended since their last look"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_run_until
+        ON price_history (run_until) WHERE run_until IS NOT NULL
+    ''')
+
+# Sort keys for paged listings (API name -> cryptos column), each indexed on (column, symbol)
+CRYPTO_SORTS = {'market_cap': 'market_cap', 'volume': 'volume_24h', 'change': 'change_24h'}
+
+def _migrate_v5(cursor):
+    """Indexes for paged listings: a page is a range scan in (sort key, symbol) order, not a sort"""
+    for column in CRYPTO_SORTS.values():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_cryptos_{column} ON cryptos ({column}, symbol)")
+
+def _migrate_v6(cursor):
+    """Adaptive pacing: the delay chosen after each scheduled run, and why"""
+    cursor.execute("PRAGMA table_info(scrape_runs)")
+    columns = [r[1] for r in cursor.fetchall()]
+    if 'next_interval_s' not in columns:
+        cursor.execute("ALTER TABLE scrape_runs ADD COLUMN next_interval_s REAL")
+    if 'pacing' not in columns:
+        cursor.execute("ALTER TABLE scrape_runs ADD COLUMN pacing TEXT")
+
+# (version, migration) pairs applied in order by init_db
+_MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+]
+
+UPSERT_CRYPTO_SQL = '''
+    INSERT INTO cryptos (symbol, name, price, market_cap, volume_24h, change_24h, change_dir, image_url, last_updated)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(symbol) DO UPDATE SET
+        name = excluded.name,
+        price = excluded.price,
+        market_cap = excluded.market_cap,
+        volume_24h = excluded.volume_24h,
+        change_24h = excluded.change_24h,
+        change_dir = excluded.change_dir,
+        image_url = excluded.image_url,
+        last_updated = excluded.last_updated
+'''
+
+INSERT_HISTORY_SQL = '''
+    INSERT INTO price_history (symbol, price, market_cap, volume_24h, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Rollup tiers: name -> bucket start format (shared by Python and SQLite strftime)
+ROLLUP_TIERS = {
+    '1m': '%Y-%m-%d %H:%M:00',
+    '1h': '%Y-%m-%d %H:00:00',
+    '1d': '%Y-%m-%d 00:00:00',
+}
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO price_rollups (symbol, resolution, bucket, open, high, low, close, volume_24h, market_cap, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(symbol, resolution, bucket) DO UPDATE SET
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        close = excluded.close,
+        volume_24h = excluded.volume_24h,
+        market_cap = excluded.market_cap,
+        samples = samples + 1
+'''
+
+def _rollup_rows(records, now):
+    """One upsert row per record per tier for a snapshot taken at `now`"""
+    rows = []
+    for resolution, fmt in ROLLUP_TIERS.items():
+        bucket = now.strftime(fmt)
+        rows.extend((
+            r['symbol'], resolution, bucket,
+            r['price'], r['price'], r['price'], r['price'],
+            r['volume_24h'], r['market_cap']
+        ) for r in records)
+    return rows
+
+def rebuild_rollups(cursor, resolutions=None, since=None, until=None, replace=True):
+    """
+    Recompute rollup tiers from the raw points (price_points, so run-length
+    rows count once per scrape), optionally only for points in [since, until).
+    With replace=False existing buckets are kept as-is.
+    """
+    where = []
+    params = []
+    if since is not None:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("timestamp < ?")
+        params.append(until)
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+
+    for resolution in resolutions or ROLLUP_TIERS:
+        fmt = ROLLUP_TIERS[resolution]
+        cursor.execute(f'''
+            {verb} INTO price_rollups
+                (symbol, resolution, bucket, open, high, low, close, volume_24h, market_cap, samples)
+            SELECT symbol, ?, bucket, MIN(open), MAX(price), MIN(price), MIN(close),
+                   MIN(last_volume), MIN(last_market_cap), COUNT(*)
+            FROM (
+                SELECT symbol, price, strftime(?, timestamp) AS bucket,
+                       FIRST_VALUE(price) OVER w AS open,
+                       LAST_VALUE(price) OVER w AS close,
+                       LAST_VALUE(volume_24h) OVER w AS last_volume,
+                       LAST_VALUE(market_cap) OVER w AS last_market_cap
+                FROM price_points
+                {where_sql}
+                WINDOW w AS (
+                    PARTITION BY symbol, strftime(?, timestamp)
+                    ORDER BY timestamp, id
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
+            )
+            GROUP BY symbol, bucket
+        ''', (resolution, fmt, *params, fmt))
+
+# Callbacks run after each committed snapshot, e.g. to drop in-process caches
+_commit_listeners = []
+
+def add_commit_listener(callback):
+    """Register callback(generation) to run after every committed snapshot"""
+    _commit_listeners.append(callback)
+
+def _bump_generation(cursor):
+    """Increment the snapshot generation stamp inside the caller's transaction"""
+    cursor.execute('''
+        INSERT INTO meta (key, value) VALUES ('generation', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    ''')
+    cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+    return int(cursor.fetchone()[0])
+
+@db_timed
+def get_generation():
+    """Return the current snapshot generation (0 before the first scrape)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+    row = cursor.fetchone()
+    cursor.close()
+    return int(row[0]) if row else 0
+
+@db_timed
+def get_last_scrape_time():
+    """Return when the most recent scrape was committed, or None"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(timestamp) FROM scrape_times")
+    row = cursor.fetchone()
+    cursor.close()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+SCRAPE_RUN_FIELDS = ('started_at', 'outcome', 'fetch_ms', 'pages', 'pages_not_modified',
+                     'pages_unchanged', 'bytes', 'records')
+
+@db_timed
+def record_scrape_run(**run):
+    """Log one scrape run ('saved', 'unchanged', 'empty' or 'failed') with its fetch timing; returns its id"""
     conn = get_connection()
     cursor = conn.cursor()
-    
     try:
-        # Insert or update the latest price in cryptos table
+        cursor.execute(
+            f"INSERT INTO scrape_runs ({', '.join(SCRAPE_RUN_FIELDS)}) VALUES ({', '.join(['?'] * len(SCRAPE_RUN_FIELDS))})",
+            tuple(run.get(field) for field in SCRAPE_RUN_FIELDS)
+        )
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not record scrape run: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+
+@db_timed
+def get_scrape_runs(limit=50):
+    """Most recent scrape runs, newest first"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM scrape_runs ORDER BY id DESC LIMIT ?", (limit,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return [dict(row) for row in rows]
+
+@db_timed
+def set_scrape_run_pacing(run_id, next_interval_s, pacing):
+    """Attach a pacing decision to scrape run `run_id` (the scheduled run it follows)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE scrape_runs SET next_interval_s = ?, pacing = ? WHERE id = ?",
+            (next_interval_s, pacing, run_id)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not record pacing decision: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+@db_timed
+def get_pacing_signals(runs=10):
+    """
+    Inputs for adaptive scrape pacing: the mean absolute price move per
+    tracked coin between the last two saved scrapes and the minutes between
+    them, the spread (standard deviation) of change_24h across tracked coins,
+    and the newest `runs` scrape runs as (outcome, fetch_ms), newest first.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    signals = {'move_pct': None, 'gap_minutes': None, 'spread_pct': None}
+    cursor.execute("SELECT timestamp FROM scrape_times ORDER BY timestamp DESC LIMIT 2")
+    times = [row[0] for row in cursor.fetchall()]
+    if len(times) == 2:
+        # Only coins that changed get a row at the newest scrape; the rest moved 0
         cursor.execute('''
-            INSERT INTO cryptos (symbol, name, price, market_cap, volume_24h, change_24h, change_dir, image_url, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(symbol) DO UPDATE SET
-                name = excluded.name,
-                price = excluded.price,
-                market_cap = excluded.market_cap,
-                volume_24h = excluded.volume_24h,
-                change_24h = excluded.change_24h,
-                change_dir = excluded.change_dir,
-                image_url = excluded.image_url,
-                last_updated = excluded.last_updated
-        ''', (
-            crypto_data['symbol'],
-            crypto_data['name'],
-            crypto_data['price'],
-            crypto_data['market_cap'],
-            crypto_data['volume_24h'],
-            crypto_data['change_24h'],
-            crypto_data.get('change_dir'),
-            crypto_data['image_url'],
-            datetime.now()
-        ))
-        
-        # Also save to price_history for historical tracking
+            SELECT SUM(ABS(h.price / p.price - 1)), (SELECT COUNT(*) FROM cryptos)
+            FROM price_history h
+            JOIN price_history p ON p.id = (
+                SELECT id FROM price_history
+                WHERE symbol = h.symbol AND timestamp < h.timestamp
+                ORDER BY timestamp DESC LIMIT 1
+            )
+            WHERE h.timestamp = ? AND p.price > 0
+        ''', (times[0],))
+        total, tracked = cursor.fetchone()
+        if tracked:
+            signals['move_pct'] = (total or 0.0) / tracked * 100
+            gap = datetime.fromisoformat(times[0]) - datetime.fromisoformat(times[1])
+            signals['gap_minutes'] = gap.total_seconds() / 60
+
+    cursor.execute('''
+        SELECT AVG(change_24h * change_24h) - AVG(change_24h) * AVG(change_24h), COUNT(change_24h)
+        FROM cryptos
+    ''')
+    variance, count = cursor.fetchone()
+    if count >= 2:
+        signals['spread_pct'] = max(0.0, variance) ** 0.5
+
+    cursor.execute("SELECT outcome, fetch_ms FROM scrape_runs ORDER BY id DESC LIMIT ?", (runs,))
+    signals['runs'] = [(row[0], row[1]) for row in cursor.fetchall()]
+    cursor.close()
+    return signals
+
+@db_timed
+def get_last_check_time():
+    """Unix time of the last scrape that saved data or found the listing unchanged, or None"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(started_at) FROM scrape_runs WHERE outcome IN ('saved', 'unchanged')")
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+# Tables reported by get_table_sizes (for monitoring)
+MONITORED_TABLES = ('cryptos', 'price_history', 'price_rollups', 'crypto_stats', 'scrape_times',
+                    'scrape_jobs', 'scrape_runs')
+
+@db_timed
+def get_table_sizes():
+    """Return ({table: row count}, bytes used by the database and its WAL)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    rows = {}
+    for table in MONITORED_TABLES:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        rows[table] = cursor.fetchone()[0]
+    cursor.close()
+    file_bytes = 0
+    for path in (DATABASE_PATH, DATABASE_PATH + '-wal'):
+        try:
+            file_bytes += os.path.getsize(path)
+        except OSError:
+            pass
+    return rows, file_bytes
+
+def save_crypto_data(crypto_data):
+    """Save or update cryptocurrency data"""
+    return save_crypto_batch([crypto_data])
+
+# In-memory copy of the rows this process last wrote: symbol -> (values, history_id, seen_at).
+# Only trusted while the DB generation is the one our own last commit produced.
+_last_written = None
+_last_written_key = None
+_last_batch_at = None
+
+# Counts from the most recent save_crypto_batch, for monitoring
+last_batch_stats = {}
+
+def _record_values(r):
+    return (r['name'], r['price'], r['market_cap'], r['volume_24h'],
+            r['change_24h'], r.get('change_dir'), r['image_url'])
+
+def _last_snapshot(cursor):
+    """Return the last-written copy, reloading it from `cryptos` if another writer committed since"""
+    global _last_written, _last_written_key
+    cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+    row = cursor.fetchone()
+    key = (os.getpid(), int(row[0]) if row else 0)
+    if _last_written is None or _last_written_key != key:
         cursor.execute('''
-            INSERT INTO price_history (symbol, price, market_cap, volume_24h, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            crypto_data['symbol'],
-            crypto_data['price'],
-            crypto_data['market_cap'],
-            crypto_data['volume_24h'],
-            datetime.now()
-        ))
-        
+            SELECT symbol, name, price, market_cap, volume_24h, change_24h, change_dir, image_url
+            FROM cryptos
+        ''')
+        # Without a known history row the first batch inserts fresh points
+        _last_written = {row[0]: (tuple(row)[1:], None, None) for row in cursor.fetchall()}
+        _last_written_key = key
+    return _last_written
+
+def _extend_runs(cursor, runs, now):
+    """
+    Stretch each (symbol, history_id) row's run up to `now`. Returns the symbols
+    whose row is gone (deleted by retention) so the caller inserts them instead.
+    """
+    if not runs:
+        return []
+    cursor.executemany("UPDATE price_history SET run_until = ? WHERE id = ?",
+                       [(now, history_id) for _, history_id in runs])
+    if cursor.rowcount == len(runs):
+        return []
+    placeholders = ','.join(['?'] * len(runs))
+    cursor.execute(f"SELECT id FROM price_history WHERE id IN ({placeholders})",
+                   [history_id for _, history_id in runs])
+    present = {row[0] for row in cursor.fetchall()}
+    return [symbol for symbol, history_id in runs if history_id not in present]
+
+# Bound on "?" placeholders per statement (SQLite's default limit is 32766)
+_MAX_SQL_PARAMS = 30000
+
+def _touch_cryptos(cursor, symbols, now):
+    """Stamp unchanged coins as seen at `now` without rewriting their rows"""
+    for i in range(0, len(symbols), _MAX_SQL_PARAMS):
+        chunk = symbols[i:i + _MAX_SQL_PARAMS]
+        cursor.execute(f"UPDATE cryptos SET last_updated = ? WHERE symbol IN ({','.join(['?'] * len(chunk))})",
+                       (now, *chunk))
+
+@db_timed
+def save_crypto_batch(records, keep_symbols=None):
+    """
+    Save a whole scrape in a single transaction, writing only what changed.
+
+    Records are compared with an in-memory copy of the last snapshot: a coin
+    whose values are identical skips its `cryptos` upsert (one UPDATE moves
+    `last_updated` for all of them, so it still means "last seen"), and when its price,
+    market cap and volume match the previous scrape its last `price_history`
+    row is extended (`run_until`) instead of adding a new one; the
+    `price_points` view expands runs back into one point per scrape. Rollups
+    and rolling stats (analytics.py) are still updated for every record, and
+    when `keep_symbols` is given the top-N prune runs in the same transaction,
+    so readers never see a half-written snapshot. Returns the number of
+    records saved (0 on failure).
+    """
+    global _last_written, _last_written_key, _last_batch_at, last_batch_stats
+    if not records:
+        return 0
+
+    # One timestamp for the whole snapshot keeps history rows aligned per scrape
+    now = datetime.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        # A cold start rebuilds the rolling windows from up to a week of history:
+        # read it before taking the write lock instead of while holding it
+        with SCRAPE_STAGE_SECONDS.labels('analytics_warm').time():
+            cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+            row = cursor.fetchone()
+            analytics.warm(cursor, now, (os.getpid(), int(row[0]) if row else 0))
+        begin_immediate(cursor, 'save_crypto_batch')
+        last = _last_snapshot(cursor)
+        previous_generation = _last_written_key[1]
+
+        crypto_rows = []
+        seen = []
+        history_rows = []
+        runs = []
+        for r in records:
+            values = _record_values(r)
+            prev = last.get(r['symbol'])
+            if prev is None or prev[0] != values:
+                crypto_rows.append((r['symbol'], *values, now))
+            else:
+                seen.append(r['symbol'])
+            # Only continue a run the symbol was part of in the immediately preceding scrape
+            if (prev is not None and prev[1] is not None and prev[2] == _last_batch_at
+                    and prev[0][1:4] == values[1:4]):
+                runs.append((r['symbol'], prev[1]))
+            else:
+                history_rows.append((r['symbol'], r['price'], r['market_cap'], r['volume_24h'], now))
+
+        cursor.executemany(UPSERT_CRYPTO_SQL, crypto_rows)
+        _touch_cryptos(cursor, seen, now)
+        lost = set(_extend_runs(cursor, runs, now))
+        if lost:
+            runs = [run for run in runs if run[0] not in lost]
+            history_rows.extend((r['symbol'], r['price'], r['market_cap'], r['volume_24h'], now)
+                                for r in records if r['symbol'] in lost)
+        cursor.executemany(INSERT_HISTORY_SQL, history_rows)
+        cursor.execute("INSERT OR IGNORE INTO scrape_times (timestamp) VALUES (?)", (now,))
+        history_ids = dict(runs)
+        if history_rows:
+            cursor.execute('''
+                SELECT symbol, MAX(id) FROM price_history
+                WHERE timestamp = ? GROUP BY symbol
+            ''', (now,))
+            history_ids.update((row[0], row[1]) for row in cursor.fetchall())
+        cursor.executemany(UPSERT_ROLLUP_SQL, _rollup_rows(records, now))
+        with SCRAPE_STAGE_SECONDS.labels('analytics').time():
+            analytics.update_stats(cursor, records, now, _last_written_key)
+        if keep_symbols:
+            with SCRAPE_STAGE_SECONDS.labels('prune').time():
+                _prune_cryptos(cursor, keep_symbols)
+        generation = _bump_generation(cursor)
         conn.commit()
     except Exception as e:
-        print(f"❌ Error saving {crypto_data['symbol']}: {e}")
+        print(f"❌ Error saving batch of {len(records)} records: {e}")
         conn.rollback()
+        # The in-memory copies may now be ahead of the database; reload them next time
+        _last_written = None
+        analytics.reset()
+        return 0
     finally:
-        conn.close()
+        cursor.close()
+
+    if keep_symbols:
+        _forget_pruned(keep_symbols)
+    for r in records:
+        last[r['symbol']] = (_record_values(r), history_ids.get(r['symbol']), now)
+    _last_written_key = (os.getpid(), generation)
+    analytics.committed(_last_written_key)
+    if recent_history.enabled:
+        recent_history.append_batch(records, now, previous_generation, generation)
+    _last_batch_at = now
+    last_batch_stats = {
+        'records': len(records),
+        'cryptos_written': len(crypto_rows),
+        'cryptos_seen': len(seen),
+        'history_inserted': len(history_rows),
+        'history_extended': len(runs),
+    }
+    ROWS_WRITTEN.labels('cryptos').inc(len(crypto_rows))
+    ROWS_WRITTEN.labels('history_inserted').inc(len(history_rows))
+    ROWS_WRITTEN.labels('history_extended').inc(len(runs))
+
+    for callback in _commit_listeners:
+        try:
+            callback(generation)
+        except Exception as e:
+            print(f"⚠️ Commit listener failed: {e}")
+    return len(records)
 
+@db_timed
 def get_all_cryptos():
     """Get all cryptocurrencies with their latest prices"""
     conn = get_connection()
@@ -127,63 +781,496 @@ def get_all_cryptos():
     ''')
     
     rows = cursor.fetchall()
-    conn.close()
+    cursor.close()
     
     return [dict(row) for row in rows]
 
+CRYPTO_FIELDS = ('symbol', 'name', 'price', 'market_cap', 'volume_24h', 'change_24h', 'change_dir',
+                 'image_url', 'last_updated')
+
+@db_timed
+def get_cryptos_page(sort='market_cap', descending=True, limit=100, after=None, fields=CRYPTO_FIELDS):
+    """
+    One keyset page of the latest prices, ordered by a CRYPTO_SORTS key then
+    symbol, with NULL keys last in either direction. `after` is the
+    (key value, symbol) of the previous page's last row. Only `fields` (plus
+    the key and symbol) are read. Returns (rows, more, newest), `newest`
+    being MAX(last_updated) read by the same statement as the rows.
+    """
+    column = CRYPTO_SORTS[sort]
+    select = ', '.join(dict.fromkeys(('symbol', column, *fields))) + ', (SELECT MAX(last_updated) FROM cryptos) AS newest'
+    direction, op = ('DESC', '<') if descending else ('ASC', '>')
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    rows = []
+    # Non-NULL keys walk the (key, symbol) index from the cursor; NULL keys follow as their own range
+    if after is None or after[0] is not None:
+        where, params = f"{column} IS NOT NULL", []
+        if after is not None:
+            where += f" AND ({column}, symbol) {op} (?, ?)"
+            params = list(after)
+        cursor.execute(f'''
+            SELECT {select} FROM cryptos WHERE {where}
+            ORDER BY {column} {direction}, symbol {direction}
+            LIMIT ?
+        ''', (*params, limit + 1))
+        rows = cursor.fetchall()
+    if len(rows) <= limit:
+        where, params = f"{column} IS NULL", []
+        if after is not None and after[0] is None:
+            where += f" AND symbol {op} ?"
+            params = [after[1]]
+        cursor.execute(f'''
+            SELECT {select} FROM cryptos WHERE {where}
+            ORDER BY symbol {direction}
+            LIMIT ?
+        ''', (*params, limit + 1 - len(rows)))
+        rows += cursor.fetchall()
+    if rows:
+        newest = rows[0]['newest']
+    else:
+        cursor.execute("SELECT MAX(last_updated) FROM cryptos")
+        newest = cursor.fetchone()[0]
+    cursor.close()
+
+    page = [{name: row[name] for name in row.keys() if name != 'newest'} for row in rows[:limit]]
+    return page, len(rows) > limit, newest
+
+# Newest points per symbol in memory; lookups it cannot answer exactly go to SQL
+recent_history = RecentHistory(HISTORY_BUFFER_POINTS)
+
+def _recent(cursor):
+    """The in-memory history, brought up to the current generation, or None when disabled"""
+    if not recent_history.enabled:
+        return None
+    recent_history.sync(cursor)
+    return recent_history
+
+@db_timed
+def warm_history_buffer():
+    """Load recent history into memory (startup), returning the number of points"""
+    if not recent_history.enabled:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        return recent_history.warm(cursor)
+    finally:
+        cursor.close()
+
+@db_timed
 def get_crypto_history(symbol, limit=24):
-    """Get price history for a specific cryptocurrency"""
+    """Get price history for a specific cryptocurrency (one point per scrape, runs expanded)"""
     conn = get_connection()
     cursor = conn.cursor()
-    
+
+    recent = _recent(cursor)
+    points = recent.latest(symbol, limit) if recent else None
+    if points is not None:
+        cursor.close()
+        return points
+
     cursor.execute('''
         SELECT price, market_cap, volume_24h, timestamp
-        FROM price_history
+        FROM price_points
         WHERE symbol = ?
         ORDER BY timestamp DESC
         LIMIT ?
     ''', (symbol, limit))
     
     rows = cursor.fetchall()
-    conn.close()
+    cursor.close()
     
     return [dict(row) for row in rows]
 
+@db_timed
+def get_history_batch(symbols, points):
+    """
+    Latest `points` raw points per symbol (all tracked coins when symbols is
+    empty), oldest first: from memory when every symbol has that many
+    buffered, else from a single ROW_NUMBER() window query.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    recent = _recent(cursor)
+    if recent:
+        if not symbols:
+            cursor.execute("SELECT symbol FROM cryptos")
+            tracked = [row[0] for row in cursor.fetchall()]
+        rows = recent.latest_many(symbols or tracked, points)
+        if rows is not None:
+            cursor.close()
+            return rows
+
+    if symbols:
+        symbol_filter = "symbol IN (%s)" % ','.join(['?'] * len(symbols))
+        params = list(symbols)
+    else:
+        symbol_filter = "symbol IN (SELECT symbol FROM cryptos)"
+        params = []
+    cursor.execute(f'''
+        SELECT symbol, price, timestamp FROM (
+            SELECT symbol, price, timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) AS rn
+            FROM price_points
+            WHERE {symbol_filter}
+        )
+        WHERE rn <= ?
+        ORDER BY timestamp, symbol
+    ''', (*params, points))
+
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return [dict(row) for row in rows]
+
+@db_timed
+def get_price_series(symbol, since, resolution='raw'):
+    """
+    Get a symbol's history since `since` (newest first) at a given resolution:
+    'raw' reads the expanded price_points (or memory, when the buffer reaches
+    back past `since`), '1m'/'1h'/'1d' read the OHLC rollup tier.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    if resolution == 'raw':
+        recent = _recent(cursor)
+        points = recent.since(symbol, since) if recent else None
+        if points is not None:
+            cursor.close()
+            return points
+        cursor.execute('''
+            SELECT price, market_cap, volume_24h, timestamp
+            FROM price_points
+            WHERE symbol = ? AND timestamp >= ?
+            ORDER BY timestamp DESC
+        ''', (symbol, since))
+    else:
+        cursor.execute('''
+            SELECT bucket AS timestamp, open, high, low, close, volume_24h, market_cap, samples
+            FROM price_rollups
+            WHERE symbol = ? AND resolution = ? AND bucket >= ?
+            ORDER BY bucket DESC
+        ''', (symbol, resolution, since.strftime(ROLLUP_TIERS[resolution])))
+
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return [dict(row) for row in rows]
+
+@db_timed
+def get_crypto_stats(symbols=None):
+    """Rolling stats as {symbol: {window: {samples, sma, high, low, return_pct, volatility_pct}}}"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    if symbols:
+        cursor.execute(f'''
+            SELECT * FROM crypto_stats WHERE symbol IN ({','.join(['?'] * len(symbols))})
+        ''', tuple(symbols))
+    else:
+        cursor.execute("SELECT * FROM crypto_stats")
+
+    rows = cursor.fetchall()
+    cursor.close()
+
+    stats = {}
+    for row in rows:
+        stats.setdefault(row['symbol'], {})[row['span']] = {
+            field: row[field] for field in analytics.STATS_FIELDS
+        }
+    return stats
+
+EXPORT_FIELDS = ('symbol', 'timestamp', 'price', 'market_cap', 'volume_24h')
+
+def _export_query(bounds):
+    """
+    One symbol's points in time order, as price_points would give them. The
+    run arm is driven from price_history (CROSS JOIN fixes the loop order):
+    probing scrape_times first rescans every earlier run per scrape, which
+    turns a ranged export quadratic.
+    """
+    points = ' AND '.join(['symbol = ?'] + [f"timestamp {op} ?" for op, _, _ in bounds])
+    runs = ' AND '.join(['h.symbol = ?', 'h.run_until IS NOT NULL']
+                        + [f"{column} {op} ?" for op, column, _ in bounds]
+                        + [f"s.timestamp {op} ?" for op, _, _ in bounds])
+    return f'''
+        SELECT symbol, timestamp, price, market_cap, volume_24h
+        FROM price_history
+        WHERE {points}
+        UNION ALL
+        SELECT h.symbol, s.timestamp, h.price, h.market_cap, h.volume_24h
+        FROM price_history h
+        CROSS JOIN scrape_times s ON s.timestamp > h.timestamp AND s.timestamp <= h.run_until
+        WHERE {runs}
+        ORDER BY timestamp
+        LIMIT ?
+    '''
+
+def iter_price_points(symbols=None, since=None, until=None, after=None):
+    """
+    Stream raw points (EXPORT_FIELDS tuples) ordered by symbol, then time, in
+    lists of at most EXPORT_BATCH_ROWS, for `symbols` (default: every symbol
+    with history) in [since, until). `after` = (symbol, timestamp) resumes
+    just past that row. Memory stays at one batch however large the export.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    try:
+        if symbols:
+            names = sorted(set(symbols))
+        else:
+            cursor.execute("SELECT DISTINCT symbol FROM price_history ORDER BY symbol")
+            names = [row[0] for row in cursor.fetchall()]
+        if after:
+            names = [name for name in names if name >= after[0]]
+
+        for name in names:
+            last = after[1] if after and name == after[0] else None
+            while True:
+                # (operator, run row column it also bounds, value); stored timestamps compare as text
+                bounds = []
+                if since is not None:
+                    bounds.append(('>=', 'h.run_until', str(since)))
+                if last is not None:
+                    bounds.append(('>', 'h.run_until', last))
+                if until is not None:
+                    bounds.append(('<', 'h.timestamp', str(until)))
+                values = [v for _, _, v in bounds]
+                cursor.execute(_export_query(bounds), (
+                    name, *values, name, *values, *values, EXPORT_CHUNK_ROWS
+                ))
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    last = rows[-1][1]
+                    yield rows
+                if count < EXPORT_CHUNK_ROWS:
+                    break
+    finally:
+        cursor.close()
+
+@db_timed
 def cleanup_old_data(days=7):
-    """Remove price history older than specified days"""
+    """Remove price history older than specified days in one statement (see retention.py for the batched engine)"""
     conn = get_connection()
     cursor = conn.cursor()
-    
-    cursor.execute('''
-        DELETE FROM price_history
-        WHERE timestamp < datetime('now', '-' || ? || ' days')
-    ''', (days,))
-    
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
+    try:
+        cursor.execute('''
+            DELETE FROM price_history
+            WHERE COALESCE(run_until, timestamp) < datetime('now', '-' || ? || ' days')
+        ''', (days,))
+        deleted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        # The connection outlives this call; an open transaction would keep the write lock
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
     print(f"🧹 Cleaned up {deleted} old records")
     return deleted
 
+@db_timed
+def acquire_lease(name, holder, ttl_seconds):
+    """
+    Take or renew lease `name` for `holder`. Succeeds when the lease is free,
+    expired, or already ours; returns True if `holder` owns it afterwards.
+    """
+    now = time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        begin_immediate(cursor, 'acquire_lease')
+        cursor.execute('''
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                holder = excluded.holder,
+                expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        ''', (name, holder, now + ttl_seconds, now))
+        acquired = cursor.rowcount > 0
+        conn.commit()
+        return acquired
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not acquire lease {name}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+@db_timed
+def release_lease(name, holder):
+    """Give up lease `name` if `holder` still owns it"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        begin_immediate(cursor, 'release_lease')
+        cursor.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@db_timed
+def enqueue_scrape_job(job_id, min_gap_seconds=0, stale_seconds=600):
+    """
+    Queue a manual scrape, merging into any queued or running job.
+
+    Returns (job, created). When nothing is in flight and a job succeeded less
+    than `min_gap_seconds` ago, that finished job is returned with created=None.
+    Jobs left running longer than `stale_seconds` (a crashed scraper) are failed.
+    """
+    now = time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # Take the write lock up front so two workers cannot both create a job
+        begin_immediate(cursor, 'enqueue_scrape_job')
+        cursor.execute('''
+            UPDATE scrape_jobs SET status = 'failed', finished_at = ?, error = 'Abandoned by its scraper'
+            WHERE status = 'running' AND started_at < ?
+        ''', (now, now - stale_seconds))
+        cursor.execute('''
+            SELECT * FROM scrape_jobs
+            WHERE status IN ('queued', 'running')
+            ORDER BY requested_at LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE scrape_jobs SET requests = requests + 1 WHERE id = ?", (row['id'],))
+            conn.commit()
+            return _job_dict(row, extra_requests=1), False
+
+        if min_gap_seconds:
+            cursor.execute('''
+                SELECT * FROM scrape_jobs
+                WHERE status = 'succeeded' AND finished_at > ?
+                ORDER BY finished_at DESC LIMIT 1
+            ''', (now - min_gap_seconds,))
+            row = cursor.fetchone()
+            if row:
+                conn.commit()
+                return _job_dict(row), None
+
+        # Forget finished jobs after a day
+        cursor.execute('''
+            DELETE FROM scrape_jobs
+            WHERE status IN ('succeeded', 'failed') AND finished_at < ?
+        ''', (now - 86400,))
+        cursor.execute('''
+            INSERT INTO scrape_jobs (id, status, requested_at) VALUES (?, 'queued', ?)
+        ''', (job_id, now))
+        conn.commit()
+        return get_scrape_job(job_id), True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@db_timed
+def claim_scrape_job():
+    """Mark the queued job as running and return it, or None if nothing is queued"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        begin_immediate(cursor, 'claim_scrape_job')
+        cursor.execute('''
+            UPDATE scrape_jobs SET status = 'running', started_at = ?
+            WHERE status = 'queued'
+            RETURNING id
+        ''', (time.time(),))
+        row = cursor.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return get_scrape_job(row['id']) if row else None
+
+@db_timed
+def finish_scrape_job(job_id, ok, error=None):
+    """Record the outcome of a running job"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        begin_immediate(cursor, 'finish_scrape_job')
+        cursor.execute('''
+            UPDATE scrape_jobs SET status = ?, finished_at = ?, error = ?
+            WHERE id = ?
+        ''', ('succeeded' if ok else 'failed', time.time(), error, job_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@db_timed
+def get_scrape_job(job_id):
+    """Get one scrape job as a dict, or None"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM scrape_jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return _job_dict(row) if row else None
+
+def _job_dict(row, extra_requests=0):
+    job = dict(row)
+    job['requests'] += extra_requests
+    return job
+
+def _prune_cryptos(cursor, keep_symbols):
+    """Delete every `cryptos` row not in keep_symbols using an open cursor."""
+    # Build a dynamic placeholders list for the NOT IN clause
+    analytics.forget_symbols(cursor, keep_symbols)
+    placeholders = ','.join(['?'] * len(keep_symbols))
+    cursor.execute(f"""
+        DELETE FROM cryptos
+        WHERE symbol NOT IN ({placeholders})
+    """, tuple(keep_symbols))
+    return cursor.rowcount
+
+def _forget_pruned(keep_symbols):
+    """Drop in-memory state for pruned coins; call only after the prune has committed."""
+    analytics.forget_state(keep_symbols)
+    recent_history.forget(keep_symbols)
+    # Pruned coins must be written in full if they come back
+    if _last_written is not None:
+        keep = set(keep_symbols)
+        for symbol in [s for s in _last_written if s not in keep]:
+            del _last_written[symbol]
+
+@db_timed
 def prune_cryptos(keep_symbols):
     """Keep only the provided symbols in the 'cryptos' table (used to enforce top-N)."""
     if not keep_symbols:
         return 0
     conn = get_connection()
     cursor = conn.cursor()
-    # Build a dynamic placeholders list for the NOT IN clause
-    placeholders = ','.join(['?'] * len(keep_symbols))
     try:
-        cursor.execute(f"""
-            DELETE FROM cryptos
-            WHERE symbol NOT IN ({placeholders})
-        """, tuple(keep_symbols))
-        deleted = cursor.rowcount
+        deleted = _prune_cryptos(cursor, keep_symbols)
         conn.commit()
-        return deleted
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        cursor.close()
+    _forget_pruned(keep_symbols)
+    return deleted
 
 if __name__ == "__main__":
     # Test database initialization
@@ -0,0 +1,313 @@
+import re
+import time
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Prefer lxml when it is installed; html.parser is always available
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+
+# Only build the tree for <table> elements on the first pass
+TABLE_STRAINER = SoupStrainer('table')
+
+_NUMBER_RE = re.compile(r"[-+]?[0-9]*\.?[0-9]+")
+_SYMBOL_RE = re.compile(r"\b([A-Z]{2,6})\b")
+
+
+def parse_money(s):
+    """Convert strings like '$3.38T', '$82.65B', '$1,234' to float."""
+    if not s:
+        return 0.0
+    s = s.replace('$', '').replace(',', '').strip()
+    try:
+        if s.endswith('T'):
+            return float(s[:-1]) * 1e12
+        if s.endswith('B'):
+            return float(s[:-1]) * 1e9
+        if s.endswith('M'):
+            return float(s[:-1]) * 1e6
+        if s.endswith('K'):
+            return float(s[:-1]) * 1e3
+        return float(s)
+    except ValueError:
+        # Try to extract a number from the string
+        m = _NUMBER_RE.search(s)
+        return float(m.group()) if m else 0.0
+
+
+def _header_texts(table):
+    thead = table.find('thead')
+    if not thead:
+        return None
+    return [th.get_text(strip=True).lower() for th in thead.find_all('th')]
+
+
+def build_header_map(headers):
+    """Map logical columns to indexes in the listing table's header row"""
+    def find_col_idx(names):
+        for i, h in enumerate(headers):
+            if any(n in h for n in names):
+                return i
+        return None
+
+    def find_24h_idx():
+        for i, h in enumerate(headers):
+            if '24h' in h and '7d' not in h and '1h' not in h and 'volume' not in h:
+                return i
+        return None
+
+    return {
+        'rank': find_col_idx(['#', 'rank']),
+        'coin': find_col_idx(['coin']),
+        'price': find_col_idx(['price']),
+        'change24': find_24h_idx(),
+        'volume24': find_col_idx(['24h volume', 'volume']),
+        'marketcap': find_col_idx(['market cap', 'market'])
+    }
+
+
+def find_listing_rows(soup):
+    """Return (rows, header_map) using the header-matched table, else the fallbacks"""
+    rows = []
+    header_map = {}
+    for table in soup.find_all('table'):
+        headers = _header_texts(table)
+        if headers and any('price' in h for h in headers) and any('market' in h for h in headers):
+            header_map = build_header_map(headers)
+            tbody = table.find('tbody')
+            if tbody:
+                rows = tbody.find_all('tr', recursive=False)
+            break
+
+    # Fallback: rows with data-coin-id (CoinGecko often includes this attribute)
+    if not rows:
+        rows = soup.find_all('tr', attrs={'data-coin-id': True})
+
+    # Final fallback: any top-level tr elements
+    if not rows:
+        rows = soup.find_all('tr')
+
+    return rows, header_map
+
+
+def _parse_change(raw_change, cell):
+    """Parse a 24h change cell into (change_24h, change_dir)"""
+    try:
+        # Normalize minus signs (U+2212 or other variants)
+        raw_change = raw_change.replace('−', '-').replace('–', '-')
+        change_24h = float(raw_change.replace('%', '').strip())
+
+        # Determine direction from value
+        if change_24h > 0:
+            change_dir = 'up'
+        elif change_24h < 0:
+            change_dir = 'down'
+        else:
+            change_dir = 'flat'
+
+        # Optional: check for icons indicating direction
+        icon = cell.find('svg') or cell.find('i')
+        if icon:
+            icon_classes = icon.get('class', [])
+            # icon_classes could be list or string
+            if isinstance(icon_classes, str):
+                icon_classes = [icon_classes]
+            icon_classes = [c.lower() for c in icon_classes]
+            if any('down' in c or 'arrow-down' in c for c in icon_classes):
+                change_dir = 'down'
+            elif any('up' in c or 'arrow-up' in c for c in icon_classes):
+                change_dir = 'up'
+        return change_24h, change_dir
+    except Exception:
+        return 0.0, 'flat'
+
+
+def _cell(tds, header_map, key):
+    idx = header_map.get(key)
+    return idx if idx is not None and len(tds) > idx else None
+
+
+def parse_row(row, header_map, max_rank=None):
+    """
+    Extract one coin from a listing row, or None when the row is skipped.
+
+    Each cell's text is pulled exactly once; the column lookups and the money
+    inference fallback all work from that list.
+    """
+    tds = row.find_all('td', recursive=False)
+    cell_strings = [list(td.stripped_strings) for td in tds]
+    texts = [''.join(parts) for parts in cell_strings]
+
+    # Respect rank 1..max_rank only, when rank cell is present
+    rank = None
+    if tds:
+        idx = _cell(tds, header_map, 'rank')
+        if idx is None:
+            # Skip favorites column if present (first td has star)
+            idx = 1 if len(tds) > 1 and tds[0].find('svg') else 0
+        try:
+            rank = int(texts[idx].replace('#', '').strip())
+        except ValueError:
+            rank = None
+    if rank is not None and max_rank is not None and (rank < 1 or rank > max_rank):
+        return None
+
+    name = None
+    symbol = None
+    price = 0.0
+    change_24h = 0.0
+    change_dir = 'flat'
+    vol_24h = 0.0
+    market_cap = 0.0
+
+    if tds and len(tds) >= 5:
+        coin_idx = _cell(tds, header_map, 'coin')
+        if coin_idx is None:
+            # Fallback: if first td is star and second is rank, coin is third
+            if len(tds) > 2 and ('#' in texts[1] or texts[1].isdigit()):
+                coin_idx = 2
+            else:
+                coin_idx = 1
+        price_idx = _cell(tds, header_map, 'price')
+        if price_idx is None and len(tds) > 2:
+            price_idx = 2
+        change_idx = _cell(tds, header_map, 'change24')
+        vol_idx = _cell(tds, header_map, 'volume24')
+        mcap_idx = _cell(tds, header_map, 'marketcap')
+
+        coin_cell = tds[coin_idx]
+        # Prefer image alt for the name—it’s often clean
+        img = coin_cell.find('img')
+        name = img.get('alt') if img and img.get('alt') else None
+        if not name:
+            a = coin_cell.find('a')
+            name = a.get_text(strip=True) if a else texts[coin_idx]
+        # symbol within coin cell: first uppercase token (2-6)
+        tokens = [t for t in ' '.join(cell_strings[coin_idx]).split()
+                  if t.isupper() and 2 <= len(t) <= 6 and t != 'BUY']
+        symbol = tokens[0] if tokens else None
+
+        if price_idx is not None:
+            price = parse_money(texts[price_idx])
+        if change_idx is not None:
+            change_24h, change_dir = _parse_change(texts[change_idx], tds[change_idx])
+        if vol_idx is not None:
+            vol_24h = parse_money(texts[vol_idx])
+        if mcap_idx is not None:
+            market_cap = parse_money(texts[mcap_idx])
+
+        # If either volume or market cap is missing, try to infer from remaining $ cells
+        if market_cap == 0.0 or vol_24h == 0.0:
+            money_vals = [parse_money(t) for t in texts if '$' in t]
+            # remove the price value if present
+            money_vals = [v for v in money_vals if v != price and v > 0]
+            if money_vals:
+                # Market cap is typically the largest amount; volume is the next
+                money_vals.sort(reverse=True)
+                if market_cap == 0.0:
+                    market_cap = money_vals[0]
+                if vol_24h == 0.0 and len(money_vals) > 1:
+                    vol_24h = money_vals[1]
+
+    else:
+        # Fallback to heuristic parsing if table cells missing
+        texts = [el.get_text(separator=' ', strip=True) for el in row.find_all(['td', 'span', 'a', 'div']) if el.get_text(strip=True)]
+        # Name
+        for t in texts:
+            if len(t) > 2 and any(c.isalpha() for c in t):
+                name = t
+                break
+        # Symbol
+        for t in texts:
+            match = _SYMBOL_RE.search(t)
+            if match:
+                symbol = match.group(1)
+                break
+        # Money fields
+        for t in texts:
+            if '$' in t and any(ch.isdigit() for ch in t):
+                if price == 0.0:
+                    price = parse_money(t)
+                    continue
+                if market_cap == 0.0:
+                    market_cap = parse_money(t)
+                    continue
+                if vol_24h == 0.0:
+                    vol_24h = parse_money(t)
+                    continue
+            if '%' in t and any(ch.isdigit() for ch in t):
+                try:
+                    raw_change = t.replace('−', '-').replace('–', '-').strip()
+                    change_24h = float(raw_change.replace('%', ''))
+                    change_dir = 'up' if change_24h > 0 else 'down' if change_24h < 0 else 'flat'
+                except ValueError:
+                    change_24h = 0.0
+                    change_dir = 'flat'
+
+    # Image
+    img = row.find('img')
+    image_url = img['src'] if img and img.get('src') else ''
+
+    if not name and not symbol:
+        return None
+
+    return {
+        'symbol': (symbol or (name.split()[0] if name else 'N/A')).upper()[:10],
+        'name': name or symbol or 'Unknown',
+        'price': price,
+        'market_cap': market_cap,
+        'volume_24h': vol_24h,
+        'change_24h': change_24h,
+        'change_dir': change_dir,
+        'image_url': image_url
+    }
+
+
+def parse_listing(content, limit=10, max_rank=None, parser=None, strainer=TABLE_STRAINER):
+    """
+    Parse a CoinGecko listing page into at most `limit` unique coin records.
+
+    The first pass only builds <table> elements (`strainer`); if that finds no
+    rows the whole document is parsed so the fallback heuristics still run.
+    Returns (records, rows_seen); rows_seen is 0 when no candidate rows exist.
+    """
+    parser = parser or DEFAULT_PARSER
+    max_rank = limit if max_rank is None else max_rank
+
+    soup = BeautifulSoup(content, parser, parse_only=strainer) if strainer is not None else None
+    rows, header_map = find_listing_rows(soup) if soup is not None else ([], {})
+    if not rows:
+        soup = BeautifulSoup(content, parser)
+        rows, header_map = find_listing_rows(soup)
+
+    records = []
+    seen = set()
+    for row in rows:
+        try:
+            record = parse_row(row, header_map, max_rank=max_rank)
+        except Exception as e:
+            print(f"❌ Failed to parse a row: {e}")
+            continue
+        if record is None:
+            continue
+        records.append(record)
+        seen.add(record['symbol'])
+        # Break once we have `limit` distinct symbols
+        if len(seen) >= limit:
+            break
+    return records, len(rows)
+
+
+if __name__ == "__main__":
+    # Time the parser against saved pages: python extract.py page.html [...]
+    import sys
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            content = f.read()
+        started = time.perf_counter()
+        records, rows_seen = parse_listing(content)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{path}: {len(records)} records from {rows_seen} rows in {elapsed:.1f} ms ({DEFAULT_PARSER})")
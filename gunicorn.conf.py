@@ -0,0 +1,25 @@
+"""
+gunicorn hooks, loaded automatically from the working directory
+(`gunicorn app:app ...`, as in render.yaml and the Procfile).
+
+Each worker starts its scheduler as soon as it has forked, so a fresh deploy
+scrapes without waiting for a first request. The master never runs one, even
+with --preload.
+"""
+
+
+def on_starting(server):
+    """Clear metric samples left by a previous run before any worker writes"""
+    import metrics
+    metrics.reset_stale()
+
+
+def post_worker_init(worker):
+    import app
+    app.ensure_scheduler()
+
+
+def child_exit(server, worker):
+    """Drop an exited worker's live gauges from /metrics"""
+    import metrics
+    metrics.process_exit(worker.pid)
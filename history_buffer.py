@@ -0,0 +1,220 @@
+import math
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from metrics import CACHE_LOOKUPS
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _micros(ts):
+    """Stored timestamp (string or datetime) -> integer microseconds, no timezone involved"""
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _timestamp(micros):
+    """Inverse of _micros, formatted the way sqlite3 stores datetimes"""
+    return str(_EPOCH + timedelta(microseconds=micros))
+
+
+class RingBuffer:
+    """Fixed-capacity history for one symbol in parallel typed arrays (32 bytes per point)"""
+
+    __slots__ = ('capacity', 'times', 'prices', 'market_caps', 'volumes', 'start', 'size')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('q', bytes(8 * capacity))
+        self.prices = array('d', bytes(8 * capacity))
+        self.market_caps = array('d', bytes(8 * capacity))
+        self.volumes = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def append(self, micros, price, market_cap, volume):
+        if self.size and micros <= self.times[(self.start + self.size - 1) % self.capacity]:
+            return
+        if self.size < self.capacity:
+            i = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[i] = micros
+        self.prices[i] = price
+        # NaN stands in for NULL
+        self.market_caps[i] = market_cap if market_cap is not None else math.nan
+        self.volumes[i] = volume if volume is not None else math.nan
+
+    def oldest(self):
+        return self.times[self.start] if self.size else None
+
+    def newest_first(self, limit=None, since=None):
+        """Points newest first, at most `limit` of them and none before `since` (micros)"""
+        out = []
+        count = self.size if limit is None else min(limit, self.size)
+        for k in range(count):
+            i = (self.start + self.size - 1 - k) % self.capacity
+            if since is not None and self.times[i] < since:
+                break
+            out.append(i)
+        return out
+
+    def point(self, i):
+        market_cap, volume = self.market_caps[i], self.volumes[i]
+        return {
+            'price': self.prices[i],
+            'market_cap': None if math.isnan(market_cap) else market_cap,
+            'volume_24h': None if math.isnan(volume) else volume,
+            'timestamp': _timestamp(self.times[i]),
+        }
+
+
+class RecentHistory:
+    """
+    The last `capacity` points of every symbol, kept in memory so chart
+    requests inside that window skip the history query. The writing process
+    appends each committed snapshot directly; other processes see a new
+    generation stamp and pull only the points newer than what they hold.
+    Lookups return None when memory cannot answer exactly, and the caller
+    falls back to SQL.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffers = {}
+        self._generation = None
+        self._newest = None
+        self._lock = threading.Lock()
+        # gunicorn --preload forks workers while the scraper thread may be
+        # appending: fork only between mutations, and give each child a fresh lock
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._lock.acquire, after_in_parent=self._lock.release,
+                                after_in_child=self._reset_lock)
+        self._hit_counter = CACHE_LOOKUPS.labels('history_buffer', 'hit')
+        self._miss_counter = CACHE_LOOKUPS.labels('history_buffer', 'miss')
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _add(self, symbol, price, market_cap, volume, ts):
+        buf = self._buffers.get(symbol)
+        if buf is None:
+            buf = self._buffers[symbol] = RingBuffer(self.capacity)
+        micros = _micros(ts)
+        buf.append(micros, price, market_cap, volume)
+        if self._newest is None or micros > self._newest:
+            self._newest = micros
+
+    def warm(self, cursor):
+        """Load the newest `capacity` points of every tracked coin (one windowed query)"""
+        cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+        row = cursor.fetchone()
+        cursor.execute('''
+            SELECT symbol, price, market_cap, volume_24h, timestamp FROM (
+                SELECT symbol, price, market_cap, volume_24h, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) AS rn
+                FROM price_points
+                WHERE symbol IN (SELECT symbol FROM cryptos)
+            )
+            WHERE rn <= ?
+            ORDER BY timestamp
+        ''', (self.capacity,))
+        rows = cursor.fetchall()
+        with self._lock:
+            self._buffers = {}
+            self._newest = None
+            for r in rows:
+                self._add(*r)
+            self._generation = int(row[0]) if row else 0
+        return len(rows)
+
+    def sync(self, cursor):
+        """Warm on first use; afterwards pull points committed by other processes"""
+        if self._generation is None:
+            self.warm(cursor)
+            return
+        # One primary-key read; callers build per-generation snapshots, so
+        # memory must never lag the stamp they saw
+        cursor.execute("SELECT value FROM meta WHERE key = 'generation'")
+        row = cursor.fetchone()
+        generation = int(row[0]) if row else 0
+        if generation == self._generation:
+            return
+        since = _timestamp(self._newest) if self._newest is not None else str(_EPOCH)
+        # New rows, plus scrapes that extended an existing run (run_until is indexed)
+        cursor.execute('''
+            SELECT symbol, price, market_cap, volume_24h, timestamp
+            FROM price_history WHERE timestamp > ?
+            UNION ALL
+            SELECT h.symbol, h.price, h.market_cap, h.volume_24h, s.timestamp
+            FROM price_history h
+            JOIN scrape_times s ON s.timestamp > h.timestamp AND s.timestamp <= h.run_until
+            WHERE h.run_until > ? AND s.timestamp > ?
+            ORDER BY timestamp
+        ''', (since, since, since))
+        rows = cursor.fetchall()
+        with self._lock:
+            for r in rows:
+                self._add(*r)
+            self._generation = generation
+
+    def append_batch(self, records, now, previous_generation, generation):
+        """Writer path: add a just-committed snapshot if we were current before it"""
+        with self._lock:
+            if self._generation is None or self._generation != previous_generation:
+                # Missed someone else's commit; sync() will fetch the gap
+                return
+            for r in records:
+                self._add(r['symbol'], r['price'], r['market_cap'], r['volume_24h'], now)
+            self._generation = generation
+
+    def _count(self, answered):
+        (self._hit_counter if answered is not None else self._miss_counter).inc()
+        return answered
+
+    def latest(self, symbol, limit):
+        """The newest `limit` points, or None unless memory holds that many"""
+        with self._lock:
+            buf = self._buffers.get(symbol)
+            if buf is None or buf.size < limit:
+                return self._count(None)
+            return self._count([buf.point(i) for i in buf.newest_first(limit)])
+
+    def since(self, symbol, since):
+        """Every point at or after `since`, or None unless the buffer reaches back past it"""
+        cutoff = _micros(since)
+        with self._lock:
+            buf = self._buffers.get(symbol)
+            if buf is None or not buf.size or buf.oldest() >= cutoff:
+                return self._count(None)
+            return self._count([buf.point(i) for i in buf.newest_first(since=cutoff)])
+
+    def latest_many(self, symbols, points):
+        """get_history_batch rows for `symbols` (oldest first), or None if any symbol falls short"""
+        rows = []
+        with self._lock:
+            for symbol in symbols:
+                buf = self._buffers.get(symbol)
+                if buf is None or buf.size < points:
+                    return self._count(None)
+                for i in buf.newest_first(points):
+                    rows.append({'symbol': symbol, 'price': buf.prices[i], 'timestamp': _timestamp(buf.times[i])})
+        rows.sort(key=lambda r: (r['timestamp'], r['symbol']))
+        return self._count(rows)
+
+    def forget(self, keep_symbols):
+        """Drop buffers of coins that fell out of the tracked set"""
+        keep = set(keep_symbols)
+        with self._lock:
+            for symbol in [s for s in self._buffers if s not in keep]:
+                del self._buffers[symbol]
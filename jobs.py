@@ -0,0 +1,114 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import coordination
+from database import enqueue_scrape_job, claim_scrape_job, finish_scrape_job, get_scrape_job
+
+try:
+    # Manual refreshes within this many seconds of a finished one are refused
+    MIN_REFRESH_SECONDS = int(os.environ.get("MIN_REFRESH_SECONDS", "60"))
+except ValueError:
+    MIN_REFRESH_SECONDS = 60
+# How often the scraper process checks for jobs queued by other workers
+JOB_POLL_SECONDS = 2
+
+# Scheduled and manual scrapes never overlap inside the scraper process
+_scrape_lock = threading.Lock()
+# One reusable background thread for jobs started by a request in this process
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scrape-job')
+# Process whose scheduler is running; only there may a request take the scraper lease
+_scheduler_pid = None
+
+
+def _scrape():
+    # requests and bs4 are only loaded in the process that actually scrapes
+    from scraper import scrape_crypto_prices
+    return scrape_crypto_prices()
+
+
+def run_scrape_exclusive():
+    """
+    Run one scrape unless another is already in progress in this process.
+    Returns the scrape_runs id it recorded, or None when it was skipped.
+    """
+    if not _scrape_lock.acquire(blocking=False):
+        print("⏭️ Scrape already in progress, skipping")
+        return None
+    try:
+        _scrape()
+        import scraper
+        return scraper.last_run_id
+    finally:
+        _scrape_lock.release()
+
+
+def run_pending_jobs():
+    """Claim and run queued manual scrape jobs (scraper process only)"""
+    while True:
+        job = claim_scrape_job()
+        if job is None:
+            return
+        with _scrape_lock:
+            try:
+                ok = _scrape()
+                finish_scrape_job(job['id'], ok, None if ok else 'Scrape returned no data')
+            except Exception as e:
+                finish_scrape_job(job['id'], False, str(e))
+
+
+def scheduler_started():
+    """Mark this process as running a scheduler (it renews the lease and polls the queue)"""
+    global _scheduler_pid
+    _scheduler_pid = os.getpid()
+
+
+def _kick():
+    """Start the queue right away when this process runs a scheduler and is the scraper"""
+    if _scheduler_pid != os.getpid():
+        # A read-only process must not take the lease it would never renew;
+        # the leader's queue poll picks the job up within JOB_POLL_SECONDS
+        return
+    if coordination.renew_lease():
+        _executor.submit(run_pending_jobs)
+
+
+def request_scrape():
+    """
+    Queue a manual scrape without doing any scraping in the caller's thread.
+    Returns (job, created) as described in database.enqueue_scrape_job.
+    """
+    job, created = enqueue_scrape_job(uuid.uuid4().hex[:12], MIN_REFRESH_SECONDS)
+    if created:
+        _kick()
+    return job, created
+
+
+def _iso(ts):
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def describe_job(job):
+    """JSON-friendly view of a job with its queue and run timings"""
+    started = job.get('started_at')
+    finished = job.get('finished_at')
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'requests': job['requests'],
+        'requested_at': _iso(job['requested_at']),
+        'started_at': _iso(started),
+        'finished_at': _iso(finished),
+        'queue_ms': round((started - job['requested_at']) * 1000, 1) if started else None,
+        'duration_ms': round((finished - started) * 1000, 1) if started and finished else None,
+        'error': job.get('error')
+    }
+
+
+def get_job(job_id):
+    job = get_scrape_job(job_id)
+    return describe_job(job) if job else None
@@ -0,0 +1,175 @@
+import functools
+import glob
+import os
+import tempfile
+import time
+
+# Workers write their samples to files in a shared directory so /metrics can
+# sum them no matter which worker answers. Must be set before prometheus_client loads.
+METRICS_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'crypto-tracker-metrics')
+)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _file_pid(path):
+    pid = os.path.basename(path)[:-3].rsplit('_', 1)[-1]
+    return int(pid) if pid.isdigit() else None
+
+
+def reset_stale():
+    """
+    Drop samples left by earlier runs unless another live process is already
+    writing here. This process's own files are kept. Called by create_app()
+    and gunicorn's on_starting hook, never at import.
+    """
+    paths = glob.glob(os.path.join(METRICS_DIR, '*.db'))
+    pids = {path: _file_pid(path) for path in paths}
+    if any(pid is not None and pid != os.getpid() and _pid_alive(pid) for pid in pids.values()):
+        return False
+    for path, pid in pids.items():
+        if pid == os.getpid():
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return True
+
+
+# prometheus_client writes into the directory as soon as metrics are defined
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+_DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+SCRAPE_STAGE_SECONDS = Histogram(
+    'crypto_scrape_stage_seconds',
+    'Time spent in each scrape stage (fetch and parse per page, save_row per record)',
+    ['stage']
+)
+SCRAPE_RUNS = Counter('crypto_scrape_runs_total', 'Scrape runs by outcome', ['result'])
+SCRAPE_PAGES = Counter(
+    'crypto_scrape_pages_total', 'Listing page fetches by status (modified, not_modified, failed)', ['status']
+)
+SCRAPE_ROWS = Gauge(
+    'crypto_scrape_rows', 'Records saved by the most recent scrape',
+    multiprocess_mode='mostrecent'
+)
+SCRAPE_INTERVAL_SECONDS = Gauge(
+    'crypto_scrape_interval_seconds', 'Delay chosen before the next scheduled scrape (adaptive pacing)',
+    multiprocess_mode='mostrecent'
+)
+LAST_SCRAPE = Gauge(
+    'crypto_last_scrape_timestamp_seconds', 'Unix time of the last successful scrape',
+    multiprocess_mode='max'
+)
+ROWS_WRITTEN = Counter(
+    'crypto_db_rows_written_total',
+    'Rows touched by snapshot writes (history "extended" rows are run-length repeats)',
+    ['kind']
+)
+
+RETENTION_LOCK_SECONDS = Histogram(
+    'crypto_retention_lock_seconds', 'Write lock hold time of each retention transaction',
+    buckets=_DB_BUCKETS
+)
+RETENTION_RUN_SECONDS = Histogram('crypto_retention_run_seconds', 'Wall time of each retention run')
+RETENTION_ROWS_DELETED = Counter(
+    'crypto_retention_rows_deleted_total', 'Rows removed by retention (raw history or rollups)', ['kind']
+)
+RETENTION_ROWS_PER_SECOND = Gauge(
+    'crypto_retention_rows_per_second', 'Rows removed per second by the most recent retention run',
+    multiprocess_mode='mostrecent'
+)
+
+DB_QUERY_SECONDS = Histogram(
+    'crypto_db_query_seconds', 'Wall time of each database.py function', ['function'],
+    buckets=_DB_BUCKETS
+)
+DB_LOCK_WAIT_SECONDS = Histogram(
+    'crypto_db_lock_wait_seconds', 'Time spent waiting for the SQLite write lock', ['function'],
+    buckets=_DB_BUCKETS
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'crypto_http_request_seconds', 'Time to build each response', ['route', 'method', 'status']
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    'crypto_http_response_bytes', 'Response body size as sent (after compression)', ['route'],
+    buckets=_SIZE_BUCKETS
+)
+
+CACHE_LOOKUPS = Counter(
+    'crypto_cache_lookups_total', 'Snapshot cache lookups; hit rate = hit / all', ['cache', 'result']
+)
+
+
+def db_timed(func):
+    """Record a database function's wall time under its own name"""
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def begin_immediate(cursor, function):
+    """Open a write transaction, recording how long it waited for the lock"""
+    started = time.perf_counter()
+    cursor.execute("BEGIN IMMEDIATE")
+    DB_LOCK_WAIT_SECONDS.labels(function).observe(time.perf_counter() - started)
+
+
+class _TableCollector:
+    """Row counts and file size, read from the database when /metrics is scraped"""
+
+    def __init__(self, sizes):
+        self._sizes = sizes
+
+    def collect(self):
+        rows, file_bytes, data_age = self._sizes()
+        family = GaugeMetricFamily('crypto_table_rows', 'Rows per SQLite table', labels=['table'])
+        for table, count in rows.items():
+            family.add_metric([table], count)
+        yield family
+        yield GaugeMetricFamily('crypto_db_file_bytes', 'Database plus WAL size on disk', value=file_bytes)
+        if data_age is not None:
+            yield GaugeMetricFamily('crypto_data_age_seconds', 'Seconds since the last saved scrape', value=data_age)
+
+
+def render(table_sizes=None):
+    """
+    Prometheus text exposition summed across every worker process.
+    `table_sizes()` returns ({table: rows}, file_bytes, data_age_seconds).
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=METRICS_DIR)
+    if table_sizes is not None:
+        registry.register(_TableCollector(table_sizes))
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def process_exit(pid=None):
+    """Drop a finished process's live gauges (gunicorn child_exit / atexit)"""
+    multiprocess.mark_process_dead(pid or os.getpid(), METRICS_DIR)
@@ -0,0 +1,127 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import coordination
+import jobs
+from database import get_pacing_signals, set_scrape_run_pacing
+from metrics import SCRAPE_INTERVAL_SECONDS
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+# Pick the delay before each scheduled scrape from how fast prices move (off: fixed SCRAPE_INTERVAL)
+SCRAPE_ADAPTIVE = os.environ.get("SCRAPE_ADAPTIVE", "0") != "0"
+# Bounds on the adaptive delay, in minutes
+SCRAPE_MIN_SECONDS = max(0.1, _env_float("SCRAPE_MIN_INTERVAL", 2)) * 60
+SCRAPE_MAX_SECONDS = max(SCRAPE_MIN_SECONDS, _env_float("SCRAPE_MAX_INTERVAL", 30) * 60)
+# Aim to scrape about when the typical coin has moved this many percent
+SCRAPE_TARGET_MOVE_PCT = max(0.01, _env_float("SCRAPE_TARGET_MOVE_PCT", 0.25))
+# A fetch this many times slower than usual stretches the delay by as much, up to this cap
+MAX_LATENCY_STRETCH = 4.0
+# Scrape runs looked at for failures and the usual fetch time
+PACING_WINDOW_RUNS = 10
+_FAILED = ('failed', 'empty')
+
+
+def longest_interval(base_seconds):
+    """The longest gap between scheduled scrapes, for staleness checks"""
+    return max(base_seconds, SCRAPE_MAX_SECONDS) if SCRAPE_ADAPTIVE else base_seconds
+
+
+def decide(signals, rng=random):
+    """
+    Seconds until the next scrape, and a one-line reason, from
+    database.get_pacing_signals(). Prices are treated as a random walk: a
+    mean move m over g minutes means the target move T is reached after
+    about g * (T / m)^2 minutes, and a 24h spread s after 1440 * (T / s)^2.
+    The shorter estimate wins, a slower than usual fetch stretches it, and
+    the result is held within [SCRAPE_MIN_SECONDS, SCRAPE_MAX_SECONDS].
+    Consecutive failed runs back off exponentially with jitter instead.
+    """
+    runs = signals['runs']
+    failures = 0
+    for outcome, _ in runs:
+        if outcome not in _FAILED:
+            break
+        failures += 1
+    if failures:
+        ceiling = min(SCRAPE_MAX_SECONDS, SCRAPE_MIN_SECONDS * 2 ** failures)
+        seconds = max(SCRAPE_MIN_SECONDS, rng.uniform(ceiling / 2, ceiling))
+        return seconds, f"backoff after {failures} failed run{'s' if failures > 1 else ''} (up to {ceiling / 60:.1f} min)"
+
+    target = SCRAPE_TARGET_MOVE_PCT
+    parts = []
+    estimates = []
+    move, gap = signals['move_pct'], signals['gap_minutes']
+    if runs and runs[0][0] == 'unchanged':
+        # Nothing moved since the last saved snapshot
+        estimates.append(SCRAPE_MAX_SECONDS)
+        parts.append("listing unchanged")
+    elif move is not None and gap:
+        estimate = gap * 60 * (target / move) ** 2 if move > 0 else SCRAPE_MAX_SECONDS
+        estimates.append(estimate)
+        parts.append(f"moves {move:.3f}% over {gap:.1f} min -> {estimate / 60:.1f} min")
+    spread = signals['spread_pct']
+    if spread:
+        estimate = 86400 * (target / spread) ** 2
+        estimates.append(estimate)
+        parts.append(f"24h spread {spread:.2f}% -> {estimate / 60:.1f} min")
+    seconds = min(estimates) if estimates else SCRAPE_MAX_SECONDS
+
+    fetches = [fetch_ms for outcome, fetch_ms in runs if outcome not in _FAILED and fetch_ms]
+    if len(fetches) >= 3:
+        earlier = sorted(fetches[1:])
+        usual = earlier[len(earlier) // 2]
+        stretch = min(MAX_LATENCY_STRETCH, max(1.0, fetches[0] / usual)) if usual else 1.0
+        seconds *= stretch
+        parts.append(f"fetch {fetches[0]:.0f} ms vs {usual:.0f} ms usual (x{stretch:.2f})")
+
+    seconds = min(SCRAPE_MAX_SECONDS, max(SCRAPE_MIN_SECONDS, seconds))
+    return seconds, ', '.join(parts) or "no price history yet"
+
+
+class AdaptiveScrapeJob:
+    """
+    The scheduled scrape as a chain of one-shot APScheduler jobs, each
+    scheduling the next after deciding the delay. Processes that do not hold
+    the scraper lease only check it again every `base_seconds`.
+    """
+
+    JOB_ID = 'adaptive-scrape'
+
+    def __init__(self, scheduler, base_seconds):
+        self._scheduler = scheduler
+        self._base_seconds = base_seconds
+
+    def start(self):
+        self._schedule(0)
+
+    def _schedule(self, seconds):
+        self._scheduler.add_job(
+            func=self.run,
+            trigger="date",
+            run_date=datetime.now(timezone.utc) + timedelta(seconds=seconds),
+            id=self.JOB_ID,
+            replace_existing=True
+        )
+
+    def run(self):
+        seconds = self._base_seconds
+        try:
+            if coordination.renew_lease():
+                run_id = jobs.run_scrape_exclusive()
+                seconds, reason = decide(get_pacing_signals(PACING_WINDOW_RUNS))
+                print(f"🧭 Next scrape in {seconds / 60:.1f} min ({reason}; "
+                      f"bounds {SCRAPE_MIN_SECONDS / 60:g}-{SCRAPE_MAX_SECONDS / 60:g} min)")
+                SCRAPE_INTERVAL_SECONDS.set(seconds)
+                if run_id is not None:
+                    set_scrape_run_pacing(run_id, round(seconds, 1), reason)
+        except Exception as e:
+            print(f"⚠️ Scheduled scrape failed: {e}")
+        finally:
+            self._schedule(seconds)
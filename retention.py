@@ -0,0 +1,239 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from database import get_connection, rebuild_rollups, ROLLUP_TIERS
+from metrics import (
+    begin_immediate, RETENTION_LOCK_SECONDS, RETENTION_ROWS_DELETED, RETENTION_ROWS_PER_SECOND,
+    RETENTION_RUN_SECONDS
+)
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+# Raw points (and the 1-minute tier) older than this are folded and deleted
+RETENTION_DAYS = _env_int('RETENTION_DAYS', 7)
+# Hourly rollups are kept this long; daily rollups are kept forever
+HOURLY_RETENTION_DAYS = _env_int('HOURLY_RETENTION_DAYS', 90)
+# Rows per delete transaction, and the pause between transactions
+RETENTION_CHUNK_ROWS = _env_int('RETENTION_CHUNK_ROWS', 5000)
+RETENTION_PAUSE_MS = _env_int('RETENTION_PAUSE_MS', 50)
+# Free pages handed back to the OS per incremental_vacuum step
+VACUUM_STEP_PAGES = 1000
+
+# Stats from the most recent run, for monitoring
+last_run_stats = {}
+
+_TIER_STEP = {'1h': timedelta(hours=1), '1d': timedelta(days=1)}
+
+
+def _bucket_bounds(resolution, first_ts, last_ts):
+    """Bucket starts covering [first_ts, last_ts] for a tier"""
+    fmt = ROLLUP_TIERS[resolution]
+    step = _TIER_STEP[resolution]
+    start = datetime.strptime(datetime.fromisoformat(str(first_ts)).strftime(fmt), '%Y-%m-%d %H:%M:%S')
+    last = datetime.fromisoformat(str(last_ts))
+    buckets = []
+    while start <= last:
+        buckets.append(start)
+        start += step
+    return buckets
+
+
+def _fold_expired(cursor, first_ts, last_ts, folded):
+    """
+    Make sure hourly and daily rollups exist for every bucket the chunk touches.
+
+    Deletion runs oldest-first, so when a bucket is first touched all of its raw
+    rows are still present and the aggregate is complete; buckets already
+    maintained by the write path are left alone (INSERT OR IGNORE).
+    """
+    for resolution in ('1h', '1d'):
+        pending = [b for b in _bucket_bounds(resolution, first_ts, last_ts) if (resolution, b) not in folded]
+        if not pending:
+            continue
+        rebuild_rollups(
+            cursor, [resolution],
+            since=pending[0], until=pending[-1] + _TIER_STEP[resolution],
+            replace=False
+        )
+        folded.update((resolution, b) for b in pending)
+
+
+def _timed_transaction(conn, stats, work):
+    """Run work(cursor) in one write transaction, recording how long the lock was held"""
+    cursor = conn.cursor()
+    try:
+        begin_immediate(cursor, 'run_retention')
+        locked_at = time.perf_counter()
+        result = work(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    held_ms = (time.perf_counter() - locked_at) * 1000
+    RETENTION_LOCK_SECONDS.observe(held_ms / 1000)
+    stats['lock_ms_total'] += held_ms
+    stats['lock_ms_max'] = max(stats['lock_ms_max'], held_ms)
+    stats['transactions'] += 1
+    return result
+
+
+def _pause():
+    time.sleep(RETENTION_PAUSE_MS / 1000.0)
+
+
+def _delete_raw(conn, cutoff, stats):
+    """
+    Fold and delete expired price_history rows in rowid-range chunks.
+
+    A run-length row only expires once its last repeat (`run_until`) is past
+    the cutoff, so a coin whose price has not moved keeps its current point.
+    """
+    folded = set()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id) FROM price_history WHERE timestamp < ?", (cutoff,))
+    lo, last_id = cursor.fetchone()
+    cursor.close()
+    if lo is None:
+        return
+
+    while lo <= last_id:
+        hi = lo + RETENTION_CHUNK_ROWS - 1
+
+        def work(cursor):
+            cursor.execute('''
+                SELECT MIN(timestamp), MAX(COALESCE(run_until, timestamp)) FROM price_history
+                WHERE id BETWEEN ? AND ? AND COALESCE(run_until, timestamp) < ?
+            ''', (lo, hi, cutoff))
+            first_ts, last_ts = cursor.fetchone()
+            if first_ts is None:
+                return 0
+            _fold_expired(cursor, first_ts, last_ts, folded)
+            cursor.execute('''
+                DELETE FROM price_history
+                WHERE id BETWEEN ? AND ? AND COALESCE(run_until, timestamp) < ?
+            ''', (lo, hi, cutoff))
+            return cursor.rowcount
+
+        deleted = _timed_transaction(conn, stats, work)
+        stats['raw_deleted'] += deleted
+        lo = hi + 1
+        if deleted:
+            _pause()
+
+
+def _trim_logs(conn, cutoff, stats):
+    """
+    Scrape times only expand runs, so ones before the cutoff are no longer
+    needed; the scrape run log is kept for the same window.
+    """
+    def work(cursor):
+        cursor.execute("DELETE FROM scrape_times WHERE timestamp < ?", (cutoff,))
+        cursor.execute("DELETE FROM scrape_runs WHERE started_at < ?", (cutoff.timestamp(),))
+
+    _timed_transaction(conn, stats, work)
+
+
+def _delete_rollups(conn, resolution, cutoff, stats):
+    """Delete one tier's buckets older than cutoff, a chunk at a time"""
+    bucket_cutoff = cutoff.strftime(ROLLUP_TIERS[resolution])
+    while True:
+        def work(cursor):
+            cursor.execute('''
+                DELETE FROM price_rollups
+                WHERE (symbol, resolution, bucket) IN (
+                    SELECT symbol, resolution, bucket FROM price_rollups
+                    WHERE resolution = ? AND bucket < ?
+                    LIMIT ?
+                )
+            ''', (resolution, bucket_cutoff, RETENTION_CHUNK_ROWS))
+            return cursor.rowcount
+
+        deleted = _timed_transaction(conn, stats, work)
+        stats['rollups_deleted'] += deleted
+        if deleted < RETENTION_CHUNK_ROWS:
+            return
+        _pause()
+
+
+def _incremental_vacuum(conn, stats):
+    """Return free pages to the OS in small steps (no-op unless auto_vacuum is INCREMENTAL)"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        cursor.close()
+        return
+    while True:
+        cursor.execute("PRAGMA freelist_count")
+        free = cursor.fetchone()[0]
+        if not free:
+            break
+        # execute() steps the pragma once, which frees a single page; a script runs it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+        cursor.execute("PRAGMA freelist_count")
+        left = cursor.fetchone()[0]
+        stats['pages_vacuumed'] += free - left
+        if left >= free:
+            break
+        _pause()
+    cursor.close()
+
+
+def run_retention(days=None):
+    """
+    Enforce retention without long write locks: fold expired raw points into
+    hourly/daily rollups, delete them in bounded chunks with pauses between
+    transactions, trim the minute and hourly tiers, then vacuum incrementally.
+    """
+    global last_run_stats
+    days = RETENTION_DAYS if days is None else days
+    now = datetime.now()
+    stats = {
+        'raw_deleted': 0,
+        'rollups_deleted': 0,
+        'pages_vacuumed': 0,
+        'transactions': 0,
+        'lock_ms_total': 0.0,
+        'lock_ms_max': 0.0,
+    }
+    started = time.perf_counter()
+    conn = get_connection()
+
+    try:
+        _delete_raw(conn, now - timedelta(days=days), stats)
+        _trim_logs(conn, now - timedelta(days=days), stats)
+        _delete_rollups(conn, '1m', now - timedelta(days=days), stats)
+        _delete_rollups(conn, '1h', now - timedelta(days=HOURLY_RETENTION_DAYS), stats)
+        _incremental_vacuum(conn, stats)
+    except Exception as e:
+        print(f"❌ Retention run failed: {e}")
+
+    elapsed = time.perf_counter() - started
+    removed = stats['raw_deleted'] + stats['rollups_deleted']
+    stats['elapsed_s'] = round(elapsed, 3)
+    stats['rows_per_sec'] = round(removed / elapsed, 1) if elapsed else 0.0
+    stats['lock_ms_total'] = round(stats['lock_ms_total'], 2)
+    stats['lock_ms_max'] = round(stats['lock_ms_max'], 2)
+    stats['finished_at'] = datetime.now().isoformat()
+    last_run_stats = stats
+    RETENTION_RUN_SECONDS.observe(elapsed)
+    RETENTION_ROWS_DELETED.labels('raw').inc(stats['raw_deleted'])
+    RETENTION_ROWS_DELETED.labels('rollup').inc(stats['rollups_deleted'])
+    RETENTION_ROWS_PER_SECOND.set(stats['rows_per_sec'])
+
+    print(
+        f"🧹 Retention: {stats['raw_deleted']} raw + {stats['rollups_deleted']} rollup rows removed "
+        f"({stats['rows_per_sec']}/s), {stats['transactions']} transactions, "
+        f"max lock {stats['lock_ms_max']} ms, {stats['pages_vacuumed']} pages vacuumed"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    run_retention()
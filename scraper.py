@@ -1,296 +1,219 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from datetime import datetime
-from database import save_crypto_data, prune_cryptos
+from database import save_crypto_batch, get_generation, record_scrape_run
+from extract import parse_listing
+from metrics import SCRAPE_STAGE_SECONDS, SCRAPE_RUNS, SCRAPE_ROWS, SCRAPE_PAGES, LAST_SCRAPE
+
+URL = "https://www.coingecko.com/"
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+# CoinGecko lists this many coins per page (?page=2 starts at rank 101)
+ROWS_PER_PAGE = 100
+
+# How many coins to track, and how many listing pages may download at once
+try:
+    TOP_N = max(1, int(os.environ.get("TOP_N", "10")))
+except ValueError:
+    TOP_N = 10
+try:
+    MAX_CONCURRENT_FETCHES = max(1, int(os.environ.get("MAX_CONCURRENT_FETCHES", "4")))
+except ValueError:
+    MAX_CONCURRENT_FETCHES = 4
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Shared keep-alive session, with one pooled connection per concurrent fetch"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_FETCHES)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+def page_urls(top_n=None):
+    """Listing page URLs needed to cover the top `top_n` coins"""
+    top_n = top_n or TOP_N
+    pages = math.ceil(top_n / ROWS_PER_PAGE)
+    return [URL] + [f"{URL}?page={n}" for n in range(2, pages + 1)]
+
+# What the last successful fetch of each page returned: validators for the
+# next conditional request, and the parse result to reuse when nothing changed
+PageState = namedtuple('PageState', 'etag last_modified digest records rows_seen')
+_page_state = {}
+# Generation written by our last save; a different one means another process wrote since
+_saved_generation = None
+# scrape_runs id of the last run, so its pacing decision can be attached to it
+last_run_id = None
+
+def listing_digest(content):
+    """Hash of the listing <table> region (the whole body when there is no table)"""
+    start = content.find(b'<table')
+    end = content.rfind(b'</table>')
+    region = content[start:end] if start != -1 and end > start else content
+    return hashlib.sha1(region).hexdigest()
+
+def fetch_listing(url):
+    """
+    Conditionally download a listing page, sending the ETag/Last-Modified seen
+    last time. Returns (response, status, finished_at) where status is
+    'modified', 'not_modified' (HTTP 304) or 'failed'.
+    """
+    state = _page_state.get(url)
+    headers = {}
+    if state is not None:
+        if state.etag:
+            headers['If-None-Match'] = state.etag
+        if state.last_modified:
+            headers['If-Modified-Since'] = state.last_modified
+    try:
+        with SCRAPE_STAGE_SECONDS.labels('fetch').time():
+            resp = get_session().get(url, timeout=15, headers=headers)
+            if resp.status_code == 304 and state is not None:
+                return None, 'not_modified', time.perf_counter()
+            resp.raise_for_status()
+    except requests.RequestException as e:
+        print(f"❌ Network error fetching CoinGecko page {url}: {e}")
+        return None, 'failed', time.perf_counter()
+    return resp, 'modified', time.perf_counter()
+
+def _page_records(url, resp, status):
+    """Parse a fetched page, or reuse the last parse when the page or its table is unchanged"""
+    state = _page_state.get(url)
+    if status == 'not_modified':
+        return state.records, state.rows_seen, True
+    content = resp.content
+    digest = listing_digest(content)
+    if state is not None and state.digest == digest:
+        unchanged = True
+        records, rows_seen = state.records, state.rows_seen
+    else:
+        unchanged = False
+        with SCRAPE_STAGE_SECONDS.labels('parse').time():
+            records, rows_seen = parse_listing(content, limit=TOP_N, max_rank=TOP_N)
+    _page_state[url] = PageState(
+        resp.headers.get('ETag'), resp.headers.get('Last-Modified'), digest, records, rows_seen
+    )
+    return records, rows_seen, unchanged
+
+def _record_run(outcome, run):
+    global last_run_id
+    last_run_id = record_scrape_run(outcome=outcome, **run)
 
 def scrape_crypto_prices():
     """
     Scrape cryptocurrency prices by parsing the CoinGecko homepage HTML.
     This avoids using the public API and extracts visible values from the page.
+
+    Pages are fetched conditionally; when every page answers 304 or its listing
+    table hashes the same as last run, parsing and the database write are skipped.
     """
+    global _saved_generation, last_run_id
+    last_run_id = None
     print(f"\n⏰ [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting crypto price scrape (HTML)...")
 
-    url = "https://www.coingecko.com/"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    urls = page_urls()
+    run = {
+        'started_at': time.time(),
+        'pages': len(urls),
+        'pages_not_modified': 0,
+        'pages_unchanged': 0,
+        'bytes': 0,
+        'records': 0,
     }
-
-    try:
-        resp = requests.get(url, headers=headers, timeout=15)
-        resp.raise_for_status()
-    except requests.RequestException as e:
-        print(f"❌ Network error fetching CoinGecko page: {e}")
-        return False
-
-    soup = BeautifulSoup(resp.content, 'html.parser')
-
-    # Try to find the main listings table by matching headers
-    rows = []
-    target_table = None
-    for table in soup.find_all('table'):
-        thead = table.find('thead')
-        if not thead:
-            continue
-        headers = [th.get_text(strip=True).lower() for th in thead.find_all('th')]
-        if any('price' in h for h in headers) and any('market' in h for h in headers):
-            target_table = table
-            break
-
-    header_map = {}
-    if target_table:
-        # Build header index map
-        thead = target_table.find('thead')
-        headers = [th.get_text(strip=True).lower() for th in thead.find_all('th')] if thead else []
-
-        def find_col_idx(names):
-            for i, h in enumerate(headers):
-                if any(n in h for n in names):
-                    return i
-            return None
-
-        def find_24h_idx():
-            for i, h in enumerate(headers):
-                if '24h' in h and '7d' not in h and '1h' not in h and 'volume' not in h:
-                    return i
-            return None
-
-        header_map = {
-            'rank': find_col_idx(['#', 'rank']),
-            'coin': find_col_idx(['coin']),
-            'price': find_col_idx(['price']),
-            'change24': find_24h_idx(),
-            'volume24': find_col_idx(['24h volume', 'volume']),
-            'marketcap': find_col_idx(['market cap', 'market'])
-        }
-        tbody = target_table.find('tbody')
-        if tbody:
-            rows = tbody.find_all('tr', recursive=False)
-
-    # Fallback: rows with data-coin-id (CoinGecko often includes this attribute)
-    if not rows:
-        rows = soup.find_all('tr', attrs={'data-coin-id': True})
-
-    # Final fallback: any top-level tr elements
-    if not rows:
-        rows = soup.find_all('tr')
-
-    if not rows:
-        print('❌ Could not find crypto rows on CoinGecko page - structure may have changed')
-        return False
-
-    def parse_money(s):
-        """Convert strings like '$3.38T', '$82.65B', '$1,234' to float."""
-        if not s:
-            return 0.0
-        s = s.replace('$', '').replace(',', '').strip()
-        try:
-            if s.endswith('T'):
-                return float(s[:-1]) * 1e12
-            if s.endswith('B'):
-                return float(s[:-1]) * 1e9
-            if s.endswith('M'):
-                return float(s[:-1]) * 1e6
-            if s.endswith('K'):
-                return float(s[:-1]) * 1e3
-            return float(s)
-        except:
-            # Try to extract a number from the string
-            import re
-            m = re.search(r"[-+]?[0-9]*\.?[0-9]+", s)
-            return float(m.group()) if m else 0.0
-
-    scraped = 0
-    top_symbols = []
-    for row in rows:
-        try:
-            # Respect rank 1..10 only, when rank cell is present
-            rank = None
-            tds = row.find_all('td', recursive=False)
-            # Use header map for rank when possible
-            if tds:
-                if header_map.get('rank') is not None and len(tds) > header_map['rank']:
-                    rank_text = tds[header_map['rank']].get_text(strip=True)
-                else:
-                    # Skip favorites column if present (first td has star)
-                    rank_td_idx = 1 if len(tds) > 1 and tds[0].find('svg') else 0
-                    rank_text = tds[rank_td_idx].get_text(strip=True)
-                try:
-                    rank = int(rank_text.replace('#', '').strip())
-                except:
-                    rank = None
-            if rank is not None and (rank < 1 or rank > 10):
+    started = time.perf_counter()
+    fetched_at = started
+    pages = []
+    complete = True
+    rows_found = False
+
+    # Pages download concurrently; map() yields them in order, so page N is
+    # parsed while page N+1 is still in flight
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_FETCHES, len(urls))) as pool:
+        for url, (resp, status, finished_at) in zip(urls, pool.map(fetch_listing, urls)):
+            fetched_at = max(fetched_at, finished_at)
+            SCRAPE_PAGES.labels(status).inc()
+            if status == 'failed':
+                complete = False
                 continue
-
-            # Initialize default values
-            name = None
-            symbol = None
-            price = 0.0
-            change_24h = 0.0
-            change_dir = 'flat'
-            vol_24h = 0.0
-            market_cap = 0.0
-
-            if tds and len(tds) >= 5:
-                # Use header_map to pick the right columns when available
-                if header_map.get('coin') is not None and len(tds) > header_map['coin']:
-                    coin_cell = tds[header_map['coin']]
-                else:
-                    # Fallback: if first td is star and second is rank, coin is third
-                    if len(tds) > 2 and (('#' in tds[1].get_text()) or tds[1].get_text(strip=True).isdigit()):
-                        coin_cell = tds[2]
-                    else:
-                        coin_cell = tds[1] if len(tds) > 1 else None
-
-                price_cell = tds[header_map.get('price')] if header_map.get('price') is not None and len(tds) > header_map['price'] else (tds[2] if len(tds) > 2 else None)
-                change24_cell = tds[header_map.get('change24')] if header_map.get('change24') is not None and len(tds) > header_map['change24'] else None
-                vol_cell = tds[header_map.get('volume24')] if header_map.get('volume24') is not None and len(tds) > header_map['volume24'] else None
-                mcap_cell = tds[header_map.get('marketcap')] if header_map.get('marketcap') is not None and len(tds) > header_map['marketcap'] else None
-
-                if coin_cell:
-                    # Prefer image alt for the name—it’s often clean
-                    img = coin_cell.find('img')
-                    name = img.get('alt') if img and img.get('alt') else None
-                    if not name:
-                        a = coin_cell.find('a')
-                        name = a.get_text(strip=True) if a else coin_cell.get_text(strip=True)
-                    # symbol within coin cell: first uppercase token (2-6)
-                    import re
-                    text_in_coin = coin_cell.get_text(separator=' ', strip=True)
-                    tokens = [t for t in text_in_coin.split() if t.isupper() and 2 <= len(t) <= 6 and t != 'BUY']
-                    symbol = tokens[0] if tokens else None
-
-                if price_cell:
-                    price = parse_money(price_cell.get_text(strip=True))
-
-                # --- Improved 24h change parsing ---
-                if change24_cell:
-                    try:
-                        raw_change = change24_cell.get_text(strip=True)
-                        # Normalize minus signs (U+2212 or other variants)
-                        raw_change = raw_change.replace('−', '-').replace('–', '-')
-                        change_24h = float(raw_change.replace('%', '').strip())
-
-                        # Determine direction from value
-                        if change_24h > 0:
-                            change_dir = 'up'
-                        elif change_24h < 0:
-                            change_dir = 'down'
-                        else:
-                            change_dir = 'flat'
-
-                        # Optional: check for icons indicating direction
-                        icon = change24_cell.find('svg') or change24_cell.find('i')
-                        if icon:
-                            icon_classes = icon.get('class', [])
-                            # icon_classes could be list or string
-                            if isinstance(icon_classes, str):
-                                icon_classes = [icon_classes]
-                            icon_classes = [c.lower() for c in icon_classes]
-                            if any('down' in c or 'arrow-down' in c for c in icon_classes):
-                                change_dir = 'down'
-                            elif any('up' in c or 'arrow-up' in c for c in icon_classes):
-                                change_dir = 'up'
-
-                    except Exception:
-                        change_24h = 0.0
-                        change_dir = 'flat'
-
-                if vol_cell:
-                    vol_24h = parse_money(vol_cell.get_text(strip=True))
-                if mcap_cell:
-                    market_cap = parse_money(mcap_cell.get_text(strip=True))
-
-                # If either volume or market cap is missing, try to infer from remaining $ cells
-                if market_cap == 0.0 or vol_24h == 0.0:
-                    money_vals = [parse_money(td.get_text(strip=True)) for td in tds if '$' in td.get_text()]
-                    # remove the price value if present
-                    money_vals = [v for v in money_vals if v != price and v > 0]
-                    if money_vals:
-                        # Market cap is typically the largest amount; volume is the next
-                        money_vals.sort(reverse=True)
-                        if market_cap == 0.0:
-                            market_cap = money_vals[0]
-                        if vol_24h == 0.0 and len(money_vals) > 1:
-                            vol_24h = money_vals[1]
-
+            if status == 'not_modified':
+                run['pages_not_modified'] += 1
             else:
-                # Fallback to heuristic parsing if table cells missing
-                texts = [el.get_text(separator=' ', strip=True) for el in row.find_all(['td', 'span', 'a', 'div']) if el.get_text(strip=True)]
-                # Name
-                for t in texts:
-                    if len(t) > 2 and any(c.isalpha() for c in t):
-                        name = t
-                        break
-                # Symbol
-                import re
-                for t in texts:
-                    match = re.search(r"\b([A-Z]{2,6})\b", t)
-                    if match:
-                        symbol = match.group(1)
-                        break
-                # Money fields
-                for t in texts:
-                    if '$' in t and any(ch.isdigit() for ch in t):
-                        if price == 0.0:
-                            price = parse_money(t)
-                            continue
-                        if market_cap == 0.0:
-                            market_cap = parse_money(t)
-                            continue
-                        if vol_24h == 0.0:
-                            vol_24h = parse_money(t)
-                            continue
-                    if '%' in t and any(ch.isdigit() for ch in t):
-                        try:
-                            raw_change = t.replace('−', '-').replace('–', '-').strip()
-                            change_24h = float(raw_change.replace('%', ''))
-                            change_dir = 'up' if change_24h > 0 else 'down' if change_24h < 0 else 'flat'
-                        except:
-                            change_24h = 0.0
-                            change_dir = 'flat'
-
-            # Image
-            img = row.find('img')
-            image_url = img['src'] if img and img.get('src') else ''
-
-            if not name and not symbol:
+                run['bytes'] += len(resp.content)
+            if len({r['symbol'] for p in pages for r in p}) >= TOP_N:
+                # Enough coins already; do not parse, and forget the page's state
+                _page_state.pop(url, None)
                 continue
+            page_records, rows_seen, unchanged = _page_records(url, resp, status)
+            run['pages_unchanged'] += unchanged
+            rows_found = rows_found or rows_seen > 0
+            pages.append(page_records)
+    run['fetch_ms'] = round((fetched_at - started) * 1000, 1)
+
+    if (complete and pages and run['pages_unchanged'] == len(pages)
+            and _saved_generation is not None and _saved_generation == get_generation()):
+        print("⏭️ Listing unchanged since the last run, skipping parse and save\n")
+        SCRAPE_RUNS.labels('unchanged').inc()
+        _record_run('unchanged', run)
+        return True
+
+    records = []
+    top_symbols = []
+    for page_records in pages:
+        for crypto_data in page_records:
+            if crypto_data['symbol'] in top_symbols:
+                continue
+            if len(top_symbols) >= TOP_N:
+                break
+            records.append(crypto_data)
+            top_symbols.append(crypto_data['symbol'])
+            print(f"  ✓ Parsed {crypto_data['name']} ({crypto_data['symbol']}) price: {crypto_data['price']}")
+    run['records'] = len(records)
+
+    if not records:
+        if not rows_found and complete:
+            print('❌ Could not find crypto rows on CoinGecko page - structure may have changed')
+        SCRAPE_RUNS.labels('empty').inc()
+        _record_run('empty' if complete else 'failed', run)
+        return False
 
-            crypto_data = {
-                'symbol': (symbol or (name.split()[0] if name else 'N/A')).upper()[:10],
-                'name': name or symbol or 'Unknown',
-                'price': price,
-                'market_cap': market_cap,
-                'volume_24h': vol_24h,
-                'change_24h': change_24h,
-                'change_dir': change_dir,
-                'image_url': image_url
-            }
-
-            save_crypto_data(crypto_data)
-            if crypto_data['symbol'] not in top_symbols:
-                top_symbols.append(crypto_data['symbol'])
-            scraped += 1
-            print(f"  ✓ Saved {crypto_data['name']} ({crypto_data['symbol']}) price: {crypto_data['price']}")
-
-        except Exception as e:
-            print(f"❌ Failed to parse a row: {e}")
-            continue
-
-        # Break once we have 10
-        if len(top_symbols) >= 10:
-            break
-
-    # Prune to exactly the top 10 we captured
-    if top_symbols:
-        deleted = prune_cryptos(top_symbols)
-        if deleted:
-            print(f"🧹 Pruned {deleted} non-top entries from DB")
-
-    print(f"✅ Scraping complete, saved {scraped} items (top 10 enforced)\n")
+    # Write the whole snapshot and prune to exactly the top N in one transaction.
+    # If a page failed we cannot tell which stored coins fell out, so keep them.
+    if not complete:
+        print(f"⚠️ Some listing pages failed; skipping top-{TOP_N} prune this run")
+    started = time.perf_counter()
+    scraped = save_crypto_batch(records, keep_symbols=top_symbols if complete else None)
+    elapsed = time.perf_counter() - started
+    SCRAPE_STAGE_SECONDS.labels('save').observe(elapsed)
+    if scraped:
+        SCRAPE_STAGE_SECONDS.labels('save_row').observe(elapsed / scraped)
+        SCRAPE_ROWS.set(scraped)
+        LAST_SCRAPE.set_to_current_time()
+        _saved_generation = get_generation()
+    else:
+        # The parse results were never stored; parse again next time
+        _page_state.clear()
+    SCRAPE_RUNS.labels('ok' if scraped else 'failed').inc()
+    _record_run('saved' if scraped else 'failed', run)
+
+    print(f"✅ Scraping complete, saved {scraped} items (top {TOP_N} enforced), fetched in {run['fetch_ms']} ms\n")
     return scraped > 0
 
-
 if __name__ == "__main__":
     # Test the scraper
     scrape_crypto_prices()
@@ -4,16 +4,20 @@ const isLocal = ["localhost", "127.0.0.1"].includes(window.location.hostname);
 const API_BASE = isLocal ? "" : "https://deploython2171025.onrender.com";
 const CRYPTOS_ENDPOINT = `${API_BASE}/api/cryptos`;
 const SCRAPE_ENDPOINT = `${API_BASE}/api/scrape-now`;
+const STREAM_ENDPOINT = `${API_BASE}/api/stream`;
+const JOBS_ENDPOINT = `${API_BASE}/api/jobs`;
 
 // State management
 let currentData = [];
 let autoRefreshInterval = null;
+let cryptosEtag = null;
+let eventSource = null;
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
     loadCryptoData();
     setupEventListeners();
-    startAutoRefresh();
+    startLiveUpdates();
 });
 
 // Setup event listeners
@@ -25,12 +29,24 @@ function setupEventListeners() {
 // Load cryptocurrency data
 async function loadCryptoData() {
     try {
-        showLoading();
+        // Only show the spinner when there is nothing on screen yet
+        if (currentData.length === 0) {
+            showLoading();
+        }
+        
+        // Conditional GET: the server answers 304 with no body if nothing changed
+        const headers = cryptosEtag ? { 'If-None-Match': cryptosEtag } : {};
+        const response = await fetch(CRYPTOS_ENDPOINT, { headers, cache: 'no-store' });
+        
+        if (response.status === 304) {
+            hideLoading();
+            return;
+        }
         
-        const response = await fetch(CRYPTOS_ENDPOINT);
         const result = await response.json();
         
         if (result.success && result.data) {
+            cryptosEtag = response.headers.get('ETag');
             currentData = result.data;
             updateUI(result.data);
             updateLastUpdateTime(result.timestamp);
@@ -125,13 +141,19 @@ async function handleManualRefresh() {
         btn.disabled = true;
         btn.innerHTML = '<span class="btn-icon">⏳</span> Refreshing...';
         
-        // Trigger immediate scrape
-        const scrapeResponse = await fetch(SCRAPE_ENDPOINT);
+        // Queue a scrape; the server answers 202 with a job to follow,
+        // or 429 when the data was refreshed moments ago
+        const scrapeResponse = await fetch(SCRAPE_ENDPOINT, { method: 'POST' });
         const scrapeResult = await scrapeResponse.json();
         
-        if (scrapeResult.success) {
-            // Wait a moment for data to be saved
-            await new Promise(resolve => setTimeout(resolve, 1000));
+        if (scrapeResponse.status === 429) {
+            await loadCryptoData();
+            showNotification('✅ Data is already up to date');
+        } else if (scrapeResult.success) {
+            const job = await waitForJob(scrapeResult.job.id);
+            if (job.status !== 'succeeded') {
+                throw new Error(job.error || 'Refresh failed');
+            }
             
             // Reload the data
             await loadCryptoData();
@@ -149,8 +171,77 @@ async function handleManualRefresh() {
     }
 }
 
+// Prefer the server push stream; poll only when SSE is unavailable
+function startLiveUpdates() {
+    if (!window.EventSource) {
+        startAutoRefresh();
+        return;
+    }
+    
+    eventSource = new EventSource(STREAM_ENDPOINT);
+    
+    eventSource.onopen = () => stopAutoRefresh();
+    
+    // Full table, sent on connect or when our Last-Event-ID cannot be replayed
+    eventSource.addEventListener('snapshot', (e) => {
+        const msg = JSON.parse(e.data);
+        currentData = msg.data;
+        updateUI(currentData);
+        updateLastUpdateTime(msg.timestamp);
+        hideLoading();
+    });
+    
+    // Only the rows that changed in one scrape
+    eventSource.addEventListener('prices', (e) => {
+        const msg = JSON.parse(e.data);
+        const bySymbol = new Map(currentData.map(c => [c.symbol, c]));
+        msg.removed.forEach(symbol => bySymbol.delete(symbol));
+        msg.changed.forEach(c => bySymbol.set(c.symbol, c));
+        currentData = Array.from(bySymbol.values())
+            .sort((a, b) => (b.market_cap || 0) - (a.market_cap || 0));
+        updateUI(currentData);
+        updateLastUpdateTime(msg.timestamp);
+    });
+    
+    eventSource.onerror = () => {
+        // The browser reconnects on its own (sending Last-Event-ID) unless the
+        // server refused the stream; keep the page fresh by polling meanwhile
+        if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+        }
+        startAutoRefresh();
+    };
+}
+
+// Stop polling (the stream is delivering updates)
+function stopAutoRefresh() {
+    if (autoRefreshInterval) {
+        clearInterval(autoRefreshInterval);
+        autoRefreshInterval = null;
+    }
+}
+
+// Poll a scrape job until it finishes (or give up after ~2 minutes)
+async function waitForJob(jobId) {
+    for (let attempt = 0; attempt < 120; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response = await fetch(`${JOBS_ENDPOINT}/${jobId}`, { cache: 'no-store' });
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.error || 'Unknown job');
+        }
+        if (result.job.status === 'succeeded' || result.job.status === 'failed') {
+            return result.job;
+        }
+    }
+    throw new Error('Refresh is taking too long');
+}
+
 // Start auto-refresh
 function startAutoRefresh() {
+    if (autoRefreshInterval) {
+        return;
+    }
     // Refresh every 2 minutes
     autoRefreshInterval = setInterval(() => {
         console.log('Auto-refreshing data...');
@@ -248,7 +339,8 @@ function showNotification(message, type = 'success') {
 
 // Cleanup on page unload
 window.addEventListener('beforeunload', () => {
-    if (autoRefreshInterval) {
-        clearInterval(autoRefreshInterval);
+    stopAutoRefresh();
+    if (eventSource) {
+        eventSource.close();
     }
 });
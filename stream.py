@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from database import add_commit_listener
+
+try:
+    SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+except ValueError:
+    SSE_HEARTBEAT_SECONDS = 15.0
+
+try:
+    # Streams per sync/gthread worker, each holding a request thread; 0 (the
+    # default) refuses them so dashboards poll. asgi.py serves streams without threads.
+    SSE_MAX_STREAMS = max(0, int(os.environ.get("SSE_MAX_STREAMS", "0")))
+except ValueError:
+    SSE_MAX_STREAMS = 0
+
+try:
+    # Streams are closed after this long so workers can recycle; clients resume via Last-Event-ID
+    SSE_MAX_STREAM_SECONDS = float(os.environ.get("SSE_MAX_STREAM_SECONDS", "300"))
+except ValueError:
+    SSE_MAX_STREAM_SECONDS = 300.0
+
+# How many past delta events are kept for Last-Event-ID replay
+SSE_REPLAY_EVENTS = 32
+
+
+def format_event(event, data, event_id=None, retry=None):
+    """Encode one Server-Sent Event frame"""
+    lines = []
+    if retry is not None:
+        lines.append(f"retry: {int(retry)}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(',', ':')))
+    return "\n".join(lines) + "\n\n"
+
+
+class Broadcaster:
+    """
+    Fans each committed scrape out to every open stream in this worker.
+
+    All subscribers wait on one shared Condition instead of owning a queue, so
+    an idle subscriber costs only a waiting frame. Deltas are computed once per
+    generation from the shared snapshot cache, which also notices scrapes
+    committed by other workers. The async entry point (asgi.py) drives the
+    same event log from its event loop through refresh(), opening() and
+    pending(), with no thread per stream.
+    """
+
+    def __init__(self, snapshot_cache, check_seconds=2.0):
+        self._cache = snapshot_cache
+        self._check_seconds = check_seconds
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=SSE_REPLAY_EVENTS)
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._wakers = []
+        self.subscribers = 0
+        add_commit_listener(self._on_commit)
+
+    @property
+    def check_seconds(self):
+        return self._check_seconds
+
+    def add_waker(self, callback):
+        """Register callback() to run after every commit in this process (e.g. to wake an event loop)"""
+        self._wakers.append(callback)
+
+    def _on_commit(self, generation):
+        # Wake every stream now instead of at its next check
+        with self._cond:
+            self._checked_at = 0.0
+            self._cond.notify_all()
+        for callback in self._wakers:
+            try:
+                callback()
+            except RuntimeError:
+                # An event loop that has since closed (e.g. inherited across fork)
+                pass
+
+    def refresh(self):
+        """
+        Publish a delta event if the snapshot generation moved; returns True
+        when one was added. The snapshot is fetched without holding the lock,
+        since a rebuild reads SQLite and every subscriber would stall behind it.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._checked_at < self._check_seconds:
+                return False
+            self._checked_at = now
+        snap = self._cache.get()
+        with self._cond:
+            prev = self._snapshot
+            # Another subscriber may have published this generation (or a newer one) meanwhile
+            if prev is not None and snap.generation <= prev.generation:
+                return False
+            self._snapshot = snap
+            if prev is None:
+                return False
+
+            old_rows = {r['symbol']: r for r in prev.data['data']}
+            new_rows = {r['symbol']: r for r in snap.data['data']}
+            changed = [r for s, r in new_rows.items() if old_rows.get(s) != r]
+            removed = [s for s in old_rows if s not in new_rows]
+            # Each event is a delta from prev.generation to snap.generation
+            self._events.append((snap.generation, prev.generation, {
+                'generation': snap.generation,
+                'timestamp': snap.data.get('timestamp'),
+                'changed': changed,
+                'removed': removed
+            }))
+            self._cond.notify_all()
+            return True
+
+    def _snapshot_event(self):
+        snap = self._snapshot
+        return format_event('snapshot', {
+            'generation': snap.generation,
+            'timestamp': snap.data.get('timestamp'),
+            'data': snap.data['data']
+        }, event_id=snap.generation, retry=5000)
+
+    def opening(self, last_event_id=None):
+        """
+        The first frame for a new subscriber and the generation it leaves them
+        at: a replay of missed deltas when Last-Event-ID is one we still know,
+        else the full table. Call refresh() first.
+        """
+        with self._cond:
+            try:
+                last_seen = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last_seen = None
+            known = last_seen is not None and (
+                last_seen == self._snapshot.generation
+                or any(last_seen in (g, base) for g, base, _ in self._events)
+            )
+            if known:
+                replay = [e for e in self._events if e[0] > last_seen]
+                first = "retry: 5000\n\n" + "".join(format_event('prices', d, event_id=g) for g, _, d in replay)
+                return first, (replay[-1][0] if replay else last_seen)
+            # New client or a gap we cannot replay: send the full table
+            return self._snapshot_event(), self._snapshot.generation
+
+    def pending(self, last_seen):
+        """Frames for every delta after `last_seen` ('' when none) and the new last_seen"""
+        with self._cond:
+            pending = [e for e in self._events if e[0] > last_seen]
+        if not pending:
+            return '', last_seen
+        return "".join(format_event('prices', d, event_id=g) for g, _, d in pending), pending[-1][0]
+
+    def try_subscribe(self):
+        with self._cond:
+            if self.subscribers >= SSE_MAX_STREAMS:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def stream(self, last_event_id=None):
+        """Yield SSE frames for one subscriber (pair with try_subscribe/unsubscribe)"""
+        self.refresh()
+        first, last_seen = self.opening(last_event_id)
+        yield first
+
+        started = last_beat = time.monotonic()
+        while time.monotonic() - started < SSE_MAX_STREAM_SECONDS:
+            with self._cond:
+                self._cond.wait(timeout=self._check_seconds)
+            self.refresh()
+            frames, last_seen = self.pending(last_seen)
+            if frames:
+                last_beat = time.monotonic()
+                yield frames
+            elif time.monotonic() - last_beat >= SSE_HEARTBEAT_SECONDS:
+                last_beat = time.monotonic()
+                yield ": ping\n\n"
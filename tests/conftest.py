@@ -0,0 +1,58 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+# Metrics and the default database must point somewhere disposable before the app modules load
+_scratch = tempfile.mkdtemp(prefix='crypto-tests-')
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(_scratch, 'metrics'))
+os.environ.setdefault('DATABASE_PATH', os.path.join(_scratch, 'default.db'))
+os.environ['RUN_SCHEDULER'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import analytics  # noqa: E402
+import database  # noqa: E402
+from benchmarks.fixtures import coin_record  # noqa: E402
+from history_buffer import RecentHistory  # noqa: E402
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """An empty, unmigrated database file with this process's in-memory state cleared"""
+    database.close_all_connections()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(database, '_last_written', None)
+    monkeypatch.setattr(database, '_last_written_key', None)
+    monkeypatch.setattr(database, '_last_batch_at', None)
+    monkeypatch.setattr(database, 'recent_history', RecentHistory(database.HISTORY_BUFFER_POINTS))
+    analytics.reset()
+    yield database
+    database.close_all_connections()
+    analytics.reset()
+
+
+@pytest.fixture
+def db(fresh_db):
+    """A migrated, empty database"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        fresh_db.init_db()
+    return fresh_db
+
+
+@pytest.fixture
+def records():
+    """Ten scraped coins, as the scraper would parse them"""
+    return [coin_record(i) for i in range(1, 11)]
+
+
+def query(sql, params=()):
+    """Run one read on the test database and return the rows as tuples"""
+    cursor = database.get_connection().cursor()
+    try:
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
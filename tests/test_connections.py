@@ -0,0 +1,51 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+def _in_thread(func):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = func()
+        except Exception as e:
+            result['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return result
+
+
+def test_finished_threads_close_their_connections(db):
+    opened = []
+    for _ in range(20):
+        opened.append(_in_thread(lambda: (db.get_cryptos_page(), db.get_connection())[1])['value'])
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    # This thread's connection stays open and registered for close_all_connections
+    db.get_connection().execute("SELECT 1")
+    assert db.get_connection() in db._connections
+
+
+def test_connection_is_reused_within_a_thread(db):
+    assert db.get_connection() is db.get_connection()
+
+
+def test_failed_prune_releases_the_write_lock(db, records, monkeypatch):
+    db.save_crypto_batch(records)
+
+    def fail(cursor, keep_symbols):
+        cursor.execute("DELETE FROM cryptos WHERE symbol = ?", (records[-1]['symbol'],))
+        raise sqlite3.OperationalError("disk I/O error")
+    with monkeypatch.context() as m:
+        m.setattr(db, '_prune_cryptos', fail)
+        with pytest.raises(sqlite3.OperationalError):
+            db.prune_cryptos([r['symbol'] for r in records[:3]])
+    assert not db.get_connection().in_transaction
+
+    moved = [dict(r, price=r['price'] * 1.01) for r in records]
+    assert _in_thread(lambda: db.save_crypto_batch(moved)) == {'value': 10}
+    assert len(db.get_all_cryptos()) == 10
@@ -0,0 +1,91 @@
+import pytest
+
+import app
+from benchmarks.fixtures import coin_record
+from conftest import query
+
+
+@pytest.fixture
+def listing(db):
+    """25 coins, every fourth with no change_24h, and two pairs sharing a market cap"""
+    records = []
+    for i in range(1, 26):
+        r = coin_record(i)
+        if i % 4 == 0:
+            r['change_24h'] = None
+        records.append(r)
+    records[5]['market_cap'] = records[6]['market_cap']
+    records[10]['market_cap'] = records[11]['market_cap']
+    db.save_crypto_batch(records)
+    return db
+
+
+def _expected(column, descending):
+    """Every symbol in API order: non-NULL keys by (key, symbol), then NULL keys by symbol"""
+    rows = query(f"SELECT {column}, symbol FROM cryptos")
+    present = sorted((r for r in rows if r[0] is not None), reverse=descending)
+    missing = sorted((r for r in rows if r[0] is None), key=lambda r: r[1], reverse=descending)
+    return [symbol for _, symbol in present + missing]
+
+
+def _walk(db, sort, descending, limit):
+    symbols, after, pages = [], None, 0
+    while True:
+        rows, more, _ = db.get_cryptos_page(sort, descending, limit, after)
+        pages += 1
+        symbols += [row['symbol'] for row in rows]
+        if not more:
+            return symbols, pages
+        after = (rows[-1][db.CRYPTO_SORTS[sort]], rows[-1]['symbol'])
+
+
+@pytest.mark.parametrize('sort', ['market_cap', 'volume', 'change'])
+@pytest.mark.parametrize('descending', [True, False])
+@pytest.mark.parametrize('limit', [1, 4, 7, 25, 100])
+def test_pages_cover_the_listing_once_in_order(listing, sort, descending, limit):
+    symbols, pages = _walk(listing, sort, descending, limit)
+    assert symbols == _expected(listing.CRYPTO_SORTS[sort], descending)
+    assert pages == max(1, -(-25 // limit))
+
+
+def test_cursor_inside_the_null_range(listing):
+    nulls = _expected('change_24h', True)[-6:]
+    rows, more, _ = listing.get_cryptos_page('change', True, 3, (None, nulls[0]))
+    assert [row['symbol'] for row in rows] == nulls[1:4]
+    assert more
+    rows, more, _ = listing.get_cryptos_page('change', True, 3, (None, nulls[3]))
+    assert [row['symbol'] for row in rows] == nulls[4:]
+    assert not more
+
+
+def test_page_after_the_last_row_is_empty(listing):
+    last = _expected('market_cap', False)[-1]
+    value = query("SELECT market_cap FROM cryptos WHERE symbol = ?", (last,))[0][0]
+    assert listing.get_cryptos_page('market_cap', False, 10, (value, last))[:2] == ([], False)
+
+
+def test_fields_and_newest_stamp(listing):
+    rows, _, newest = listing.get_cryptos_page('volume', True, 5, None, ('price',))
+    assert set(rows[0]) == {'symbol', 'volume_24h', 'price'}
+    assert newest == query("SELECT MAX(last_updated) FROM cryptos")[0][0]
+
+
+def test_api_cursor_round_trip(listing):
+    args = {'sort': 'change', 'order': 'asc', 'limit': '10'}
+    symbols = []
+    while True:
+        payload = app.build_cryptos_page_payload(app.parse_cryptos_page_query(args))
+        symbols += [c['symbol'] for c in payload['data']]
+        if payload['next'] is None:
+            break
+        args['after'] = payload['next']
+    assert symbols == _expected('change_24h', False)
+    assert payload['timestamp'] == app._iso_utc(query("SELECT MAX(last_updated) FROM cryptos")[0][0])
+
+
+def test_api_rejects_a_cursor_from_another_sort(listing):
+    payload = app.build_cryptos_page_payload(app.parse_cryptos_page_query({'sort': 'volume', 'limit': '5'}))
+    with pytest.raises(ValueError, match='different sort'):
+        app.parse_cryptos_page_query({'sort': 'market_cap', 'after': payload['next']})
+    with pytest.raises(ValueError, match='not a valid cursor'):
+        app.parse_cryptos_page_query({'after': 'not-a-cursor'})
@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+import app
+import database
+from benchmarks.fixtures import coin_record
+from conftest import query
+
+START = datetime(2024, 1, 1, 0, 0, 0, 500000)
+SCRAPES = 6
+
+
+@pytest.fixture
+def history(db, monkeypatch):
+    """Three coins over six scrapes 10 minutes apart; prices only move on scrapes 0, 1 and 3"""
+    clock = [START]
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock[0]
+
+    monkeypatch.setattr(database, 'datetime', Clock)
+    records = [coin_record(i) for i in range(1, 4)]
+    for n in range(SCRAPES):
+        clock[0] = START + timedelta(minutes=10 * n)
+        if n in (1, 3):
+            for r in records:
+                r['price'] *= 1.01
+        db.save_crypto_batch([dict(r) for r in records])
+    return sorted(r['symbol'] for r in records)
+
+
+@pytest.fixture
+def client():
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.routes)
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def local_tz():
+    """Run with the server clock at UTC+05:30"""
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Kolkata'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def _lines(resp):
+    assert resp.status_code == 200
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+
+def _at(n):
+    return app._iso_local(START + timedelta(minutes=10 * n))
+
+
+def test_parse_time_matches_local_storage(local_tz):
+    assert app._parse_time('2024-01-01', 'since') == datetime(2024, 1, 1)
+    assert app._parse_time('2024-01-01T10:00:00', 'since') == datetime(2024, 1, 1, 10)
+    # An explicit offset is converted to the server's local time, as timestamps are stored
+    assert app._parse_time('2024-01-01T10:00:00Z', 'since') == datetime(2024, 1, 1, 15, 30)
+    assert app._parse_time('2024-01-01T10:00:00+01:00', 'since') == datetime(2024, 1, 1, 14, 30)
+    # Exported timestamps carry no offset and parse back to the stored value
+    assert app._parse_time(app._iso_local(START), 'after') == START
+    with pytest.raises(ValueError, match='since must be an ISO 8601'):
+        app._parse_time('yesterday', 'since')
+
+
+def test_export_expands_runs_in_symbol_then_time_order(history, client):
+    rows = _lines(client.get('/api/export'))
+    assert len(rows) == 3 * SCRAPES == query("SELECT COUNT(*) FROM price_points")[0][0]
+    assert [(r['symbol'], r['timestamp']) for r in rows] == [
+        (symbol, _at(n)) for symbol in history for n in range(SCRAPES)]
+    # Scrapes 4 and 5 repeat the run stored at scrape 3
+    btc = [r['price'] for r in rows if r['symbol'] == history[0]]
+    assert btc[3] == btc[4] == btc[5] != btc[2]
+
+
+def test_since_is_inclusive_and_until_exclusive(history, client):
+    # Bounds on stored timestamps exactly, one of them inside a run
+    since = (START + timedelta(minutes=20)).isoformat()
+    until = (START + timedelta(minutes=50)).isoformat()
+    rows = _lines(client.get(f'/api/export?symbols={history[1]}&since={since}&until={until}'))
+    assert [r['timestamp'] for r in rows] == [_at(2), _at(3), _at(4)]
+    rows = _lines(client.get(f'/api/export?symbols={history[1]}&since={_at(4)}'))
+    assert [r['timestamp'] for r in rows] == [_at(4), _at(5)]
+
+
+def test_after_resumes_just_past_every_row(history, client):
+    rows = _lines(client.get('/api/export'))
+    for k, row in enumerate(rows):
+        rest = _lines(client.get(f"/api/export?after={row['symbol']},{row['timestamp']}"))
+        assert rest == rows[k + 1:]
+
+
+def test_exported_timestamps_round_trip_on_a_non_utc_server(history, client, local_tz):
+    rows = _lines(client.get(f'/api/export?symbols={history[0]}'))
+    assert rows[0]['timestamp'] == _at(0)
+    window = _lines(client.get(f"/api/export?symbols={history[0]}&since={rows[1]['timestamp']}&until={rows[4]['timestamp']}"))
+    assert window == rows[1:4]
+    rest = _lines(client.get(f"/api/export?symbols={history[0]}&after={history[0]},{rows[4]['timestamp']}"))
+    assert rest == rows[5:]
+
+
+def test_after_combines_with_since_and_until(history, client):
+    since, until = _at(1), _at(5)
+    rows = _lines(client.get(f'/api/export?since={since}&until={until}'))
+    assert len(rows) == 3 * 4
+    rest = _lines(client.get(f"/api/export?since={since}&until={until}&after={history[0]},{rows[3]['timestamp']}"))
+    assert rest == rows[4:]
+
+
+def test_csv_export(history, client):
+    resp = client.get(f'/api/export?format=csv&symbols={history[2].lower()}')
+    assert resp.mimetype == 'text/csv'
+    table = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+    assert table[0] == list(database.EXPORT_FIELDS)
+    assert [row[:2] for row in table[1:]] == [[history[2], _at(n)] for n in range(SCRAPES)]
+
+
+@pytest.mark.parametrize('query_string, error', [
+    ('format=xml', 'format must be one of'),
+    ('since=2024-02-01&until=2024-01-01', 'since must be before until'),
+    ('after=BTC', 'after must look like SYMBOL,TIMESTAMP'),
+    ('until=soon', 'until must be an ISO 8601'),
+])
+def test_bad_parameters_are_rejected(db, client, query_string, error):
+    resp = client.get(f'/api/export?{query_string}')
+    assert resp.status_code == 400
+    assert error in resp.get_json()['error']
+
+
+def _failing_points(*args, **kwargs):
+    yield [('BTC', '2024-01-01 00:00:00', 1.0, 2.0, 3.0)]
+    raise RuntimeError('database disk image is malformed')
+
+
+def test_ndjson_export_ends_with_an_error_line(db, client, monkeypatch):
+    monkeypatch.setattr(app, 'iter_price_points', _failing_points)
+    rows = _lines(client.get('/api/export'))
+    assert rows[0]['symbol'] == 'BTC'
+    assert rows[-1] == {'success': False, 'error': 'database disk image is malformed'}
+
+
+def test_csv_export_stops_after_the_last_good_row(db, client, monkeypatch):
+    monkeypatch.setattr(app, 'iter_price_points', _failing_points)
+    text = client.get('/api/export?format=csv').get_data(as_text=True)
+    assert text.splitlines() == [','.join(database.EXPORT_FIELDS), 'BTC,2024-01-01T00:00:00,1.0,2.0,3.0']
@@ -0,0 +1,65 @@
+import pytest
+
+import coordination
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze the lease clock (time.time) at a value the test can move"""
+    import database
+    now = [1_000_000.0]
+    monkeypatch.setattr(database.time, 'time', lambda: now[0])
+    return now
+
+
+def test_holder_keeps_and_renews_its_lease(db, clock):
+    assert db.acquire_lease('scraper', 'a', 90)
+    clock[0] += 60
+    assert db.acquire_lease('scraper', 'a', 90)
+    # Renewed at +60, so still held at +120 even though the first grant ran out
+    clock[0] += 60
+    assert not db.acquire_lease('scraper', 'b', 90)
+
+
+def test_live_lease_is_not_taken_over(db, clock):
+    assert db.acquire_lease('scraper', 'a', 90)
+    clock[0] += 89
+    assert not db.acquire_lease('scraper', 'b', 90)
+
+
+def test_expired_lease_is_taken_over(db, clock):
+    assert db.acquire_lease('scraper', 'a', 90)
+    clock[0] += 91
+    assert db.acquire_lease('scraper', 'b', 90)
+    # The old holder lost it and cannot renew until the new one lapses
+    assert not db.acquire_lease('scraper', 'a', 90)
+
+
+def test_release_frees_the_lease_for_the_holder_only(db, clock):
+    assert db.acquire_lease('scraper', 'a', 90)
+    db.release_lease('scraper', 'b')
+    assert not db.acquire_lease('scraper', 'b', 90)
+    db.release_lease('scraper', 'a')
+    assert db.acquire_lease('scraper', 'b', 90)
+
+
+def test_leases_are_independent_by_name(db, clock):
+    assert db.acquire_lease('scraper', 'a', 90)
+    assert db.acquire_lease('retention', 'b', 90)
+
+
+def test_leader_only_runs_the_job_on_the_holder(db):
+    ran = []
+    job = coordination.leader_only(lambda: ran.append(True) or 'done')
+    assert job() == 'done'
+    # Another process holds a live lease
+    db.release_lease(coordination.SCRAPER_LEASE, coordination.holder_id())
+    assert db.acquire_lease(coordination.SCRAPER_LEASE, 'other-host:1:abc', 90)
+    assert job() is None
+    assert ran == [True]
+
+
+def test_holder_id_changes_after_fork(monkeypatch):
+    first = coordination.holder_id()
+    monkeypatch.setattr(coordination.os, 'getpid', lambda: -1)
+    assert coordination.holder_id() != first
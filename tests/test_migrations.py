@@ -0,0 +1,90 @@
+import contextlib
+import io
+import sqlite3
+
+import database
+from conftest import query
+
+
+def _migrate(db):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return db.init_db()
+
+
+def _columns(table):
+    return {row[1] for row in query(f"PRAGMA table_info({table})")}
+
+
+def test_fresh_database_reaches_current_version(fresh_db):
+    assert _migrate(fresh_db) is True
+    assert query("PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    tables = {row[0] for row in query("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    assert {'cryptos', 'price_history', 'scrape_times', 'price_points', 'meta', 'leases',
+            'scrape_jobs', 'price_rollups', 'scrape_runs', 'crypto_stats'} <= tables
+    assert {'next_interval_s', 'pacing'} <= _columns('scrape_runs')
+    indexes = {row[0] for row in query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_history_run_until', 'idx_cryptos_market_cap', 'idx_cryptos_volume_24h',
+            'idx_cryptos_change_24h'} <= indexes
+
+
+def test_current_database_is_not_migrated_again(db):
+    assert _migrate(db) is False
+
+
+def test_unversioned_database_upgrades_in_place(fresh_db):
+    # The schema as it was before user_version tracking: no change_dir, no run_until
+    conn = sqlite3.connect(fresh_db.DATABASE_PATH)
+    conn.executescript('''
+        CREATE TABLE cryptos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            market_cap REAL,
+            volume_24h REAL,
+            change_24h REAL,
+            image_url TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            market_cap REAL,
+            volume_24h REAL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO cryptos (symbol, name, price, last_updated) VALUES ('BTC', 'Bitcoin', 65000, '2024-01-01 00:00:00');
+        INSERT INTO price_history (symbol, price, timestamp) VALUES ('BTC', 64000, '2024-01-01 00:00:00');
+        INSERT INTO price_history (symbol, price, timestamp) VALUES ('BTC', 65000, '2024-01-01 00:10:00');
+    ''')
+    conn.close()
+
+    assert _migrate(fresh_db) is True
+    assert query("PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    assert 'change_dir' in _columns('cryptos')
+    assert 'run_until' in _columns('price_history')
+    assert query("SELECT symbol, price FROM cryptos") == [('BTC', 65000.0)]
+    # Existing history is kept and seeds the rollups and rolling stats
+    assert query("SELECT COUNT(*) FROM price_points") == [(2,)]
+    assert query("SELECT COUNT(*) FROM price_rollups WHERE symbol = 'BTC' AND resolution = '1m'") == [(2,)]
+    assert query("SELECT COUNT(*) FROM crypto_stats WHERE symbol = 'BTC'")[0][0] > 0
+
+
+def test_partial_upgrade_applies_only_newer_migrations(fresh_db):
+    # A database left at version 5, before scrape_runs gained the pacing columns
+    conn = fresh_db.get_connection()
+    cursor = conn.cursor()
+    for version, migrate in database._MIGRATIONS:
+        if version <= 5:
+            migrate(cursor)
+    cursor.execute("PRAGMA user_version = 5")
+    conn.commit()
+    cursor.execute("INSERT INTO scrape_runs (started_at, outcome) VALUES (1.0, 'saved')")
+    conn.commit()
+    cursor.close()
+    assert 'pacing' not in _columns('scrape_runs')
+
+    assert _migrate(fresh_db) is True
+    assert {'next_interval_s', 'pacing'} <= _columns('scrape_runs')
+    assert query("SELECT outcome, pacing FROM scrape_runs") == [('saved', None)]
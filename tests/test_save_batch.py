@@ -0,0 +1,86 @@
+import analytics
+from conftest import query
+
+
+def _save(db, records, **kwargs):
+    return db.save_crypto_batch([dict(r) for r in records], **kwargs)
+
+
+def test_unchanged_scrape_extends_runs_instead_of_inserting(db, records):
+    assert _save(db, records) == 10
+    assert db.last_batch_stats['history_inserted'] == 10
+    first_seen = dict(query("SELECT symbol, last_updated FROM cryptos"))
+
+    assert _save(db, records) == 10
+    assert db.last_batch_stats == {
+        'records': 10, 'cryptos_written': 0, 'cryptos_seen': 10,
+        'history_inserted': 0, 'history_extended': 10,
+    }
+    assert query("SELECT COUNT(*) FROM price_history") == [(10,)]
+    assert query("SELECT COUNT(*) FROM price_history WHERE run_until IS NOT NULL") == [(10,)]
+    # The view still yields one point per coin per scrape
+    assert query("SELECT COUNT(*) FROM price_points") == [(20,)]
+    # Unchanged coins are still stamped as seen by the newer scrape
+    for symbol, seen in query("SELECT symbol, last_updated FROM cryptos"):
+        assert seen > first_seen[symbol]
+
+
+def test_price_change_starts_a_new_run(db, records):
+    _save(db, records)
+    _save(db, records)
+    moved = [dict(r) for r in records]
+    moved[0]['price'] *= 1.01
+    _save(db, moved)
+    assert db.last_batch_stats['history_inserted'] == 1
+    assert db.last_batch_stats['history_extended'] == 9
+    symbol = moved[0]['symbol']
+    assert [p for p, in query("SELECT price FROM price_points WHERE symbol = ? ORDER BY timestamp", (symbol,))] == [
+        records[0]['price'], records[0]['price'], moved[0]['price']]
+
+
+def test_only_the_immediately_preceding_scrape_is_extended(db, records):
+    _save(db, records)
+    # A scrape without the first coin breaks its run even if it returns unchanged
+    _save(db, records[1:])
+    _save(db, records)
+    assert db.last_batch_stats['history_inserted'] == 1
+    symbol = records[0]['symbol']
+    assert query("SELECT COUNT(*) FROM price_points WHERE symbol = ?", (symbol,)) == [(2,)]
+
+
+def test_run_row_removed_by_retention_is_inserted_again(db, records):
+    _save(db, records)
+    conn = db.get_connection()
+    conn.execute("DELETE FROM price_history WHERE symbol = ?", (records[0]['symbol'],))
+    conn.commit()
+    _save(db, records)
+    assert db.last_batch_stats['history_extended'] == 9
+    assert db.last_batch_stats['history_inserted'] == 1
+
+
+def test_prune_in_batch_forgets_dropped_coins_after_commit(db, records):
+    _save(db, records)
+    keep = [r['symbol'] for r in records[:3]]
+    _save(db, records[:3], keep_symbols=keep)
+    assert sorted(s for s, in query("SELECT symbol FROM cryptos")) == sorted(keep)
+    assert sorted(s for s, in query("SELECT DISTINCT symbol FROM crypto_stats")) == sorted(keep)
+    assert sorted(analytics._state) == sorted(keep)
+    assert sorted(db._last_written) == sorted(keep)
+
+
+def test_failed_batch_keeps_in_memory_state(db, records, monkeypatch):
+    _save(db, records)
+    before = query("SELECT COUNT(*) FROM price_points")
+
+    def fail(cursor):
+        raise RuntimeError("disk full")
+    keep = [r['symbol'] for r in records[:3]]
+    with monkeypatch.context() as m:
+        m.setattr(db, '_bump_generation', fail)
+        assert _save(db, records[:3], keep_symbols=keep) == 0
+
+    assert query("SELECT COUNT(*) FROM cryptos") == [(10,)]
+    assert query("SELECT COUNT(*) FROM price_points") == before
+    # The next save reloads its copies and carries on from the committed state
+    assert _save(db, records) == 10
+    assert query("SELECT COUNT(*) FROM price_points") == [(20,)]
@@ -0,0 +1,31 @@
+import pytest
+from flask import Flask
+
+import app
+import stream
+
+
+@pytest.fixture
+def client():
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(app.routes)
+    return flask_app.test_client()
+
+
+def test_threaded_streams_are_refused_by_default(db, client):
+    assert stream.SSE_MAX_STREAMS == 0
+    resp = client.get('/api/stream')
+    assert resp.status_code == 503
+    assert 'asgi.py' in resp.get_json()['error']
+    assert app.broadcaster.subscribers == 0
+
+
+def test_threaded_streams_up_to_the_cap(db, client, monkeypatch):
+    monkeypatch.setattr(stream, 'SSE_MAX_STREAMS', 1)
+    first = client.get('/api/stream', buffered=False)
+    assert first.status_code == 200
+    assert first.mimetype == 'text/event-stream'
+    assert b'event: snapshot' in next(first.response)
+    assert client.get('/api/stream').get_json()['error'] == 'Too many open streams'
+    first.close()
+    assert app.broadcaster.subscribers == 0